@@ -0,0 +1,240 @@
+# Batch mode for write_all_regions: each sonde is processed on numpy arrays, with the
+# tropopause found once per sonde, sondes are spread over a pool of worker processes, and
+# the results are written as columns of a .npz file instead of the tab separated text files.
+
+from __future__ import division
+
+import os
+import numpy as np
+
+import bulk_ingest
+from write_all_regions import (station_ids, average_tropopause_heights, new_height,
+                               find_unstable_regions)
+
+#Column names of the region table, in the same order as the fields of the text file
+REGION_COLUMNS = ['sid', 'latitude', 'longitude', 'date', 'time', 'tropopause_height',
+                  'start_T', 'start_Tdep', 'start_h', 'start_Theta',
+                  'end_T', 'end_Tdep', 'end_h', 'end_Theta',
+                  'middle_T', 'middle_Tdep', 'middle_h', 'middle_Theta']
+
+
+def interpolate_array(sondedata):
+    #Array version of 'interpolate': puts all variables onto 10m height intervals at once,
+    #sharing the interpolation indices and weights between variables. Returns an array with one
+    #row per variable.
+    columns = np.asarray(sondedata, dtype=float)
+    h = columns[3]
+    newh = np.arange(0, int(100*h[-1])+1)/100.0
+    if len(h) == 1:
+        return np.repeat(columns, len(newh), axis=1)
+
+    #np.interp holds the end values constant outside the range of the data, as done here
+    upper = np.clip(np.searchsorted(h, newh, side='right'), 1, len(h)-1)
+    lower = upper - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.clip((newh - h[lower])/(h[upper] - h[lower]), 0, 1)
+    weight[~np.isfinite(weight)] = 0
+
+    return columns[:, lower]*(1 - weight) + columns[:, upper]*weight
+
+
+def potential_temperature_array(pressure, temperature):
+    #Array version of 'find_potential_temperature', with pressure in hPa
+    return temperature*(pressure/1000.0)**(-2.0/7.0)
+
+
+def tenm_weights_array(d):
+    #Array version of 'tenm_weights': normalised truncated gaussian weights for points every 10m
+    half = np.exp(-((0.01*np.arange(0, int(200*d+1)))**2)/(2*d**2))
+    weights = np.concatenate([half[-1:0:-1], half])
+    return weights/weights.sum()
+
+
+def smooth_equal_10m_intervals_array(Theta, d):
+    #Array version of 'smooth_equal_10m_intervals'. Near the ends of the profile the window is
+    #truncated and the remaining weights re-normalised, which is the same as dividing the
+    #convolution of the data by the convolution of an array of ones.
+    weights = tenm_weights_array(d)
+    hw = len(weights)//2
+    n = len(Theta)
+    if n == 0:
+        return np.asarray(Theta, dtype=float)
+
+    top = np.convolve(Theta, weights)[hw:hw+n]
+    bottom = np.convolve(np.ones(n), weights)[hw:hw+n]
+    return top/bottom
+
+
+def find_tropopause_array(temperature, height, block=64):
+    #Array version of 'find_tropopause' for heights increasing upwards, in km. Returns the index
+    #of the point such that the tropopause is half way between height[index-1] and height[index],
+    #or 0 if no tropopause is found.
+    T = np.asarray(temperature, dtype=float)
+    h = np.asarray(height, dtype=float)
+    n = len(h)
+    if n < 3:
+        return 0
+
+    #levels outside of the boundary layer where the lapse rate is below the cutoff
+    levels = np.arange(1, n-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lapserate = (T[levels-1] - T[levels])/(h[levels] - h[levels-1])
+    candidates = levels[(h[levels] > 2) & (lapserate < 2.0)]
+
+    #the average lapse rate is checked for all points up to 2km above, excluding the top point
+    ends = np.minimum(np.searchsorted(h, h[candidates] + 2.0, side='left'), n-1)
+    ends = np.maximum(ends, candidates + 1)
+
+    #candidates are checked in blocks, in order, stopping at the first which is satisfied
+    for start in range(0, len(candidates), block):
+        checklevel = candidates[start:start+block]
+        end = ends[start:start+block]
+        width = max(int((end - checklevel).max()) - 1, 1)
+
+        index = checklevel[:, None] + np.arange(1, width+1)[None, :]
+        inside = index < end[:, None]
+        index = np.minimum(index, n-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averagerate = (T[checklevel][:, None] - T[index])/(h[index] - h[checklevel][:, None])
+        checktropopause = ~np.any(inside & (averagerate > 2.0), axis=1)
+
+        if checktropopause.any():
+            return int(checklevel[np.argmax(checktropopause)])
+
+    print("no tropopause found")
+    return 0
+
+
+def region_information(h, T, Tdep, Theta, region):
+    #Temperature, dew point depression, height and potential temperature at the bottom, top and
+    #middle of a region, as recorded in write_all_regions.read_files
+    r1 = region[3]
+    r2 = region[4]
+    start = [T[r1], Tdep[r1], h[r1], Theta[r1]]
+    end = [T[r2], Tdep[r2], h[r2], Theta[r2]]
+    hmid = (h[r2] + h[r1])/2.0
+    middle = [np.interp(hmid, h, T), np.interp(hmid, h, Tdep), hmid, np.interp(hmid, h, Theta)]
+    return start, end, middle
+
+
+def process_sonde(args):
+    #Processes a single sonde, returning its entries of 'regiondata' and 'regionnumbers' as
+    #produced by write_all_regions.read_files. Takes a single tuple argument so that it can be
+    #used with Pool.imap.
+    sid, date, sonde, average_height = args
+
+    time = [date, int(sonde[6][0])]
+    location = [sonde[5][0], sonde[4][0]]
+
+    #process data to remove variability in results due to resolution
+    sonde = interpolate_array(sonde)
+    Theta = potential_temperature_array(sonde[0], sonde[1])
+    Theta = smooth_equal_10m_intervals_array(Theta, 0.2)
+
+    #find tropopause once, and use it for both the height and to discard points in stratosphere
+    index = find_tropopause_array(sonde[1], sonde[3])
+    if index == 0:
+        trop = 0
+    else:
+        trop = (sonde[3][index-1] + sonde[3][index])/2.0
+    Theta = Theta[:index]
+    P, T, Tdep, h, longitude, latitude, t = sonde[:, :index]
+
+    #find regions of reduced static stability
+    regions = find_unstable_regions(h, Theta, 1.125)
+
+    regiondata = []
+    for region in regions:
+        start, end, middle = region_information(h, T, Tdep, Theta, region)
+        regiondata += [[sid, time, location, trop, start, end, middle]]
+
+    return regiondata, [trop > average_height, len(regions)]
+
+
+def sonde_tasks(directory, f, sids, average, cache_dir=None, pool=None):
+    #Returns the arguments of 'process_sonde' for every sonde of the file f in the directory.
+    #The file is parsed by 'pool' if given, so this must not be called from within a task of
+    #the same pool.
+    data = bulk_ingest.ingest_file(directory, f, sids, cache_dir, pool)
+
+    tasks = []
+    for sondeindex in range(len(data)):
+        if len(data[sondeindex][0]) > 0:
+            sonde = data[sondeindex]
+            if bulk_ingest.is_canadian(f):
+                sonde = new_height(sonde)
+            sid = sids[sondeindex]
+            tasks.append((sid, int(f[0:10]), sonde, average[sid]))
+    return tasks
+
+
+def read_files_batch(directory, cache_dir=None, processes=None, chunksize=8):
+    #Batch equivalent of write_all_regions.read_files, returning the same regiondata and
+    #regionnumbers, with sondes processed in parallel by 'processes' worker processes.
+    #Each file is parsed and then its sondes processed, one after the other, so that the pool
+    #is never waiting on itself.
+    sids = station_ids()
+    average = average_tropopause_heights()
+    pool = bulk_ingest.make_pool(processes)
+
+    regiondata = []
+    regionnumbers = []
+    try:
+        for f in os.listdir(directory):
+            tasks = sonde_tasks(directory, f, sids, average, cache_dir, pool)
+            if pool is None:
+                results = [process_sonde(task) for task in tasks]
+            else:
+                results = pool.imap(process_sonde, tasks, chunksize)
+
+            for sonderegions, numbers in results:
+                regiondata += sonderegions
+                regionnumbers += [numbers]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return regiondata, regionnumbers
+
+
+def region_columns(regiondata):
+    #Converts the list 'regiondata' to a dictionary of arrays, one for each of REGION_COLUMNS
+    rows = [[int(sid)] + location + time + [trop] + start + end + middle
+            for sid, time, location, trop, start, end, middle in regiondata]
+    table = np.array(rows, dtype=float).reshape(len(rows), len(REGION_COLUMNS))
+
+    columns = {}
+    for n, name in enumerate(REGION_COLUMNS):
+        columns[name] = table[:, n]
+    for name in ['sid', 'date', 'time']:
+        columns[name] = columns[name].astype(np.int64)
+    return columns
+
+
+def write_columnar(regiondata, regionnumbers, filename):
+    #Columnar replacement for write_to_file: saves the region table and the number of regions for
+    #each sonde to a single .npz file, with one array per column. The number of regions table is
+    #stored with the prefix 'numbers_'.
+    columns = region_columns(regiondata)
+    numbers = np.array(regionnumbers, dtype=np.int64).reshape(len(regionnumbers), 2)
+    columns['numbers_above_average'] = numbers[:, 0].astype(bool)
+    columns['numbers_of_regions'] = numbers[:, 1]
+    np.savez(filename, **columns)
+
+
+def read_columnar(filename):
+    #Reads a file written by write_columnar back into a dictionary of arrays
+    with np.load(filename) as data:
+        return dict((name, data[name]) for name in data.files)
+
+
+def main(processes=4):
+    directory = "/glusterfs/scenario/users/tk176953/alldata/"
+    regiondata, regionnumbers = read_files_batch(directory, processes=processes)
+    write_columnar(regiondata, regionnumbers,
+                   "/glusterfs/scenario/users/tk176953/regions_output/allregions.npz")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# Reading and splitting by station of the data files of write_all_regions.
+# CSV files are parsed in parallel chunks, rows are grouped by station ID with a single
+# stable argsort, the missing-value and unit conversions are done on whole arrays, and the
+# parsed columns are cached as binary .npy files so that reruns skip the text parsing.
+
+from __future__ import division
+
+import os
+import numpy as np
+from multiprocessing import Pool
+
+#Columns read from the files: Station ID, Pressure (Pa), Temperature (K), Dew Point Depression (K),
+#Height (m), Longitude, Latitude, Time (s). Canadian files keep the time in a different column.
+STANDARD_COLUMNS = (0, 1, 4, 5, 6, 8, 9, 10)
+CANADIAN_COLUMNS = (0, 1, 4, 5, 6, 8, 9, 11)
+
+
+def is_canadian(filename):
+    #Canadian files are identified by '_ua' in the file name
+    return "_ua" in filename
+
+
+def file_columns(filename):
+    #Columns to read from a file, depending on whether it contains Canadian data
+    if is_canadian(filename):
+        return CANADIAN_COLUMNS
+    return STANDARD_COLUMNS
+
+
+def parse_chunk(args):
+    #Parses a list of CSV lines into an array with one row per line and one column per entry
+    #in usecols. Takes a single tuple argument so that it can be used with Pool.map.
+    lines, usecols = args
+    if len(lines) == 0:
+        return np.empty((0, len(usecols)))
+    return np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2)
+
+
+def parse_csv(filepath, usecols, pool=None, chunk_lines=50000):
+    #Equivalent of np.loadtxt(filepath, delimiter=",", usecols=usecols, unpack=True), but with the
+    #file split into chunks of chunk_lines lines which are parsed by the workers of 'pool' if given.
+    with open(filepath, 'r') as f:
+        lines = f.readlines()
+
+    chunks = [(lines[i:i + chunk_lines], usecols) for i in range(0, len(lines), chunk_lines)]
+
+    if pool is None:
+        parts = [parse_chunk(chunk) for chunk in chunks]
+    else:
+        parts = pool.map(parse_chunk, chunks)
+
+    if not parts:
+        return np.empty((len(usecols), 0))
+    return np.concatenate(parts).T
+
+
+def cache_filename(cache_dir, filename):
+    #Name of the binary file holding the parsed columns of 'filename'
+    return os.path.join(cache_dir, filename + '.npy')
+
+
+def load_columns(directory, filename, cache_dir=None, pool=None, chunk_lines=50000):
+    #Returns the parsed columns of directory+filename as an array of shape (8, number of lines).
+    #If cache_dir is given, the columns are read from a cached .npy file when it is newer than the
+    #CSV file, and are otherwise written there after parsing.
+    filepath = os.path.join(directory, filename)
+
+    if cache_dir is not None:
+        cached = cache_filename(cache_dir, filename)
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(filepath):
+            return np.load(cached)
+
+    data = parse_csv(filepath, file_columns(filename), pool, chunk_lines)
+
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        #write to a temporary file first so that an interrupted run cannot leave a partial cache
+        temporary = cached + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.save(f, data)
+        os.rename(temporary, cached)
+
+    return data
+
+
+def convert_units(columns):
+    #Converts pressure from Pa to hPa and height from m to km, for columns without the Station ID
+    converted = np.array(columns, dtype=float)
+    converted[0] /= 100.0
+    converted[3] /= 1000.0
+    return converted
+
+
+def split_by_station(sids, data, canadian=False):
+    #Splits the columns of a file by station, keeping missing temperatures for 'new_height' in
+    #write_all_regions if canadian=True. Returns a list with one entry per station in 'sids',
+    #each a list of seven arrays: Pressure (hPa), Temperature (K), Dew Point Depression (K),
+    #Height (km), Longitude, Latitude, Time (s). The order of rows within a station is preserved.
+    splitdata = [[np.empty(0) for column in range(7)] for station in sids]
+
+    if len(data) == 0 or np.size(data[0]) == 0:
+        return splitdata
+
+    #Discard points from other stations and points with missing data: recorded pressure < 0Pa for
+    #Canadian stations (missing temperatures are kept for 'new_height'), temperature < 0K otherwise
+    if canadian:
+        present = data[1] >= 0
+    else:
+        present = data[2] >= 0
+    keep = np.isin(data[0], np.asarray(sids, dtype=float)) & present
+
+    station_ids = data[0][keep]
+    columns = convert_units(data[1:, keep])
+
+    #A stable sort groups the rows of each station without changing their order in the file
+    order = np.argsort(station_ids, kind='mergesort')
+    ids, starts = np.unique(station_ids[order], return_index=True)
+    groups = np.split(columns[:, order], starts[1:], axis=1)
+
+    location = {}
+    for index, sid in enumerate(sids):
+        location.setdefault(float(sid), index)
+
+    for sid, group in zip(ids, groups):
+        splitdata[location[sid]] = list(group)
+
+    return splitdata
+
+
+def ingest_file(directory, filename, sids, cache_dir=None, pool=None):
+    #Reads a single file and splits it by station, as done at the start of the loop over files
+    #in write_all_regions.read_files
+    data = load_columns(directory, filename, cache_dir, pool)
+    return split_by_station(sids, data, canadian=is_canadian(filename))
+
+
+def make_pool(processes):
+    #Creates a pool of worker processes for parsing, or returns None to parse in this process
+    if processes is None or processes <= 1:
+        return None
+    return Pool(processes)
@@ -5,81 +5,15 @@ import os
 import math as math
 import datetime as datetime
 
-#def split_stations(data):
-#    stations = []
-#    currentstation = []
-#    for column in range(len(data)):
-#        currentstation += [[]]
-#    for columnno in range(len(data)):
-#        currentstation[columnno] += [data[columnno][0]]
-#    for lineno in range(1,len(data[0])):
-#        if data[0][lineno] != data[0][lineno-1]:
-#            stations += [currentstation]
-#            currentstation = []
-#            for column in range(len(data)):
-#                currentstation += [[]]
-#        for columnno in range(len(data)):
-#            currentstation[columnno] += [data[columnno][lineno]]
-#    stations += [currentstation]
-#    return stations
-
-def split_stations(sids,data):
-    #Splits an array with columns Station ID, Pressure (Pa), Temperature (K), Dew Point Depression (K),
-    #Height (m), Longitude, Latitude, Time (s) into a list of arrays of the same form but without
-    #Station ID, split according to the stations in the list 'sids'.
-
-    #Prepare list of arrays to contain data
-    splitdata = []
-    for station in sids:
-        splitdata += [[[],[],[],[],[],[],[]]]
-
-    #Extract data for each station, discarding points with recorded temperature < 0K (assumed missing)
-    #and converting pressure to hPa, height to km
-    for i in range(len(data[0])):
-        if data[0][i] in sids and data[2][i] >= 0:
-            location = sids.index(data[0][i])
-            splitdata[location][0] += [data[1][i]/100.0]
-            splitdata[location][1] += [data[2][i]]
-            splitdata[location][2] += [data[3][i]]
-            splitdata[location][3] += [data[4][i]/1000.0]
-            splitdata[location][4] += [data[5][i]]
-            splitdata[location][5] += [data[6][i]]
-            splitdata[location][6] += [data[7][i]]
-            
-    return splitdata
-
-def canadian_split_stations(sids,data):
-    #Similar to 'split_stations' but for Canadian stations where missing temperature points need to be
-    #kept for later processing.
-
-    #Prepare list of arrays to contain data
-    splitdata = []
-    for station in sids:
-        splitdata += [[[],[],[],[],[],[],[]]]
-
-    #Extract data for each station, discarding points with recorded pressure < 0Pa (assumed missing)
-    #and converting pressure to hPa, height to km
-    if len(data) > 0:
-        for i in range(len(data[0])):
-            if data[0][i] in sids and data[1][i] >= 0:
-                location = sids.index(data[0][i])
-                splitdata[location][0] += [data[1][i]/100.0]
-                splitdata[location][1] += [data[2][i]]
-                splitdata[location][2] += [data[3][i]]
-                splitdata[location][3] += [data[4][i]/1000.0]
-                splitdata[location][4] += [data[5][i]]
-                splitdata[location][5] += [data[6][i]]
-                splitdata[location][6] += [data[7][i]]
-                
-    return splitdata
+import bulk_ingest
 
 def new_height(sondedata):
     #Fills in points in Canadian data where height data is missing but temperature is available by
     #first plotting height against pressure regardless of the presence of temperature data and then
     #interpolating onto the points with temperature data present.
     #
-    #'sondedata' is the array produced by 'canadian_split_stations' for some station. An array of the
-    #same form is produced as output. 
+    #'sondedata' is the array produced by 'bulk_ingest.split_by_station' for some Canadian station.
+    #An array of the same form is produced as output. 
 
     #Prepare lists h and T containing height and temperature where available and two lists containing
     #pressure - P for points where temperature available, Pnew where height available
@@ -319,16 +253,23 @@ def average_tropopause_heights():
             average[int(sid)] = float(meanheight)
     return average
 
-def read_files(directory):
-    #Reads all data files and returns information about the reduced static stability regions
-
-    #a list of stations to find information for
+def station_ids():
+    #Returns the list of stations to find information for
     #All:
     sids = [10771, 11952, 16546, 16080, 16045, 16320, 16245, 4320, 10035, 10184, 1400, 7510, 3005, 3808, 7110, 7645, 1028, 1415, 1010, 1001, 14240, 7145, 6011, 1004, 2365, 11035, 10238, 4270, 10113, 10410, 3354, 1241, 2527, 2185, 4339, 10393, 3918, 14430, 10618, 10868, 2591, 10548, 3238, 10739, 3882, 4360,71917,71924,71081,71909,71802,71600]
     #Canadian:
     #sids = [71917,71924,71081,71909,71802,71600]
     #eumetnet:
     #sids = [10771, 11952, 16546, 16080, 16045, 16320, 16245, 4320, 10035, 10184, 1400, 7510, 3005, 3808, 7110, 7645, 1028, 1415, 1010, 1001, 14240, 7145, 6011, 1004, 2365, 11035, 10238, 4270, 10113, 10410, 3354, 1241, 2527, 2185, 4339, 10393, 3918, 14430, 10618, 10868, 2591, 10548, 3238, 10739, 3882, 4360]
+    return sids
+
+def read_files(directory, cache_dir=None, processes=None):
+    #Reads all data files and returns information about the reduced static stability regions
+    #If cache_dir is given, parsed files are cached there as binary arrays for faster reruns
+    #and if processes is given, files are parsed in parallel by that many worker processes
+
+    #a list of stations to find information for
+    sids = station_ids()
 
     #a dictionary containing mean tropopause heights for each station
     average = average_tropopause_heights()
@@ -339,57 +280,60 @@ def read_files(directory):
     regiondata = []
     regionnumbers = []
     
-    for f in allfiles:
-        print f
-        
-        #check whether file contains Canadian data and then read in and split by station appropriately
-        if "_ua" in f:
-            data = np.loadtxt(directory+f, delimiter=",", usecols=(0,1,4,5,6,8,9,11), unpack=True)
-            data = canadian_split_stations(sids,data)
-            for i in range(len(data)):
-                if len(data[i][0]) > 0:
-                    fixedsonde = new_height(data[i])
-                    data[i] = fixedsonde
-        else:
-            data = np.loadtxt(directory+f, delimiter=",", usecols=(0,1,4,5,6,8,9,10), unpack=True)
-            data = split_stations(sids,data)
-
-        for sondeindex in range(len(data)):
-            if len(data[sondeindex][0]) > 0:
-                #for each station in the file extract information about location, time measured, etc.
-                sid = sids[sondeindex]
-                sonde = data[sondeindex]
-                time = [int(f[0:10]),int(sonde[6][0])]
-                location = [sonde[5][0],sonde[4][0]]
-                #process data to remove variability in results due to resolution
-                sonde = interpolate(sonde)
-                Theta = find_potential_temperature(sonde[0],sonde[1])
-                Theta = smooth_equal_10m_intervals(Theta,0.2)
-                #find tropopause height and discard points in stratosphere
-                trop = trop_height(sonde[1],sonde[3])
-                Theta = Theta[:find_tropopause(sonde[1],sonde[3])]
-                P,T,Tdep,h,longitude,latitude,t = clean_up(sonde)
-                #find regions of reduced static stability
-                regions = find_unstable_regions(h,Theta,1.125)
-                #record number of regions found and whether the tropopause is higher than average
-                regionnumbers += [[trop>average[sid],len(regions)]]
-                #find information about the top,bottom and middle of each region and record it
-                for region in regions:
-                    r1 = region[3]
-                    r2 = region[4]
-                    start = [T[r1],Tdep[r1],h[r1],Theta[r1]]
-                    end = [T[r2],Tdep[r2],h[r2],Theta[r2]]
-                    ###
-                    hmid = (h[r2]+h[r1])/2.0
-                    Tmid = np.interp([hmid],h,T)
-                    Tmid = Tmid[0]
-                    Tdepmid = np.interp([hmid],h,Tdep)
-                    Tdepmid = Tdepmid[0]
-                    Thetamid = np.interp([hmid],h,Theta)
-                    Thetamid = Thetamid[0]
-                    middle = [Tmid,Tdepmid,hmid,Thetamid]
-                    ###
-                    regiondata += [[sid,time,location,trop,start,end,middle]]
+    pool = bulk_ingest.make_pool(processes)
+    try:
+        for f in allfiles:
+            print f
+
+            #read in and split by station, checking whether file contains Canadian data
+            data = bulk_ingest.ingest_file(directory, f, sids, cache_dir, pool)
+            if bulk_ingest.is_canadian(f):
+                for i in range(len(data)):
+                    if len(data[i][0]) > 0:
+                        fixedsonde = new_height(data[i])
+                        data[i] = fixedsonde
+
+            for sondeindex in range(len(data)):
+                if len(data[sondeindex][0]) > 0:
+                    #for each station in the file extract information about location, time measured, etc.
+                    sid = sids[sondeindex]
+                    sonde = data[sondeindex]
+                    time = [int(f[0:10]),int(sonde[6][0])]
+                    location = [sonde[5][0],sonde[4][0]]
+                    #process data to remove variability in results due to resolution
+                    sonde = interpolate(sonde)
+                    Theta = find_potential_temperature(sonde[0],sonde[1])
+                    Theta = smooth_equal_10m_intervals(Theta,0.2)
+                    #find tropopause height and discard points in stratosphere
+                    trop = trop_height(sonde[1],sonde[3])
+                    Theta = Theta[:find_tropopause(sonde[1],sonde[3])]
+                    P,T,Tdep,h,longitude,latitude,t = clean_up(sonde)
+                    #find regions of reduced static stability
+                    regions = find_unstable_regions(h,Theta,1.125)
+                    #record number of regions found and whether the tropopause is higher than average
+                    regionnumbers += [[trop>average[sid],len(regions)]]
+                    #find information about the top,bottom and middle of each region and record it
+                    for region in regions:
+                        r1 = region[3]
+                        r2 = region[4]
+                        start = [T[r1],Tdep[r1],h[r1],Theta[r1]]
+                        end = [T[r2],Tdep[r2],h[r2],Theta[r2]]
+                        ###
+                        hmid = (h[r2]+h[r1])/2.0
+                        Tmid = np.interp([hmid],h,T)
+                        Tmid = Tmid[0]
+                        Tdepmid = np.interp([hmid],h,Tdep)
+                        Tdepmid = Tdepmid[0]
+                        Thetamid = np.interp([hmid],h,Theta)
+                        Thetamid = Thetamid[0]
+                        middle = [Tmid,Tdepmid,hmid,Thetamid]
+                        ###
+                        regiondata += [[sid,time,location,trop,start,end,middle]]
+    finally:
+        #close the pool even if a file cannot be processed, so that no worker processes are left
+        if pool is not None:
+            pool.close()
+            pool.join()
                     
     return regiondata,regionnumbers
 
@@ -413,4 +357,5 @@ def main():
     regiondata,regionnumbers = read_files(directory)
     write_to_file(regiondata,regionnumbers)
 
-main()
+if __name__ == '__main__':
+    main()
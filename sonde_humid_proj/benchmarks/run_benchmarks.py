@@ -0,0 +1,281 @@
+"""
+Seeded benchmarks of the stages of the processing pipeline at realistic sizes
+
+Micro-benchmarks time single functions on profiles from 51 levels (UKMO) to about
+10000 levels (2 second sondes); macro-benchmarks time process_single_ascent,
+re_grid_trop_0 and a full station concatenation on data written by synthetic_data.
+Results are saved as JSON, labelled with the git revision, so that runs of different
+versions can be compared with compare_results
+
+Usage, from this folder:
+    python run_benchmarks.py                       # run all and save results
+    python -c "import run_benchmarks as rb; rb.compare_results('old.json', 'new.json')"
+"""
+from __future__ import division
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC_FOLDER)
+
+import calculate
+import synthetic_data
+from my_filters import gaussian_kernel_smooth, my_filter
+
+PROFILE_SIZES = [51, 500, 2000, 10000]
+KERNEL_DIC = {'name': 'kernel', 'gaussian_half_width': 50, 'window_half_width': 200}
+SAVGOL_DIC = {'name': 'savgol', 'window': 21, 'order': 3}
+
+
+def time_function(function, repeats = 3):
+    """
+    Time repeated calls of a function taking no arguments
+    :param function: function to time
+    :param repeats: integer, number of calls
+    :return: dictionary of best and mean time of a call in seconds
+    """
+    times = []
+    for n in range(repeats):
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+    return {'best': min(times), 'mean': sum(times)/len(times), 'repeats': repeats}
+
+
+def synthetic_profile(size, seed = 0):
+    """
+    Single realistic profile on 'size' levels between the surface and 30 km
+    :param size: integer, number of levels
+    :param seed: integer, seed for random numbers
+    :return: dictionary of arrays with CF standard names as keys, including 'altitude'
+    """
+    rng = np.random.RandomState(seed)
+    if size <= 100:
+        altitude = synthetic_data.model_levels(size, 30000.)
+    else:
+        altitude = np.linspace(20., 30000., size)
+    profile = synthetic_data.atmosphere(altitude, 290., 11000., rng, temperature_noise = 0.2)
+    profile['altitude'] = altitude
+    return profile
+
+
+def profile_cubes(profile):
+    """
+    Cubes of each variable of a profile, as produced by read_files.read_data
+    :param profile: dictionary of arrays from synthetic_profile
+    :return: CubeList of variables and a cube of altitude
+    """
+    import iris
+
+    time = iris.coords.DimCoord(409572., standard_name = 'time', units = synthetic_data.TIME_UNITS)
+    cubes = iris.cube.CubeList([iris.cube.Cube(profile[name], standard_name = name,
+                                               aux_coords_and_dims = [(time, None)])
+                                for name in ['air_pressure', 'air_temperature', 'dew_point_temperature',
+                                             'specific_humidity', 'air_potential_temperature']])
+    altitude = iris.cube.Cube(profile['altitude'] - 11000., standard_name = 'altitude', units = 'm',
+                              aux_coords_and_dims = [(time, None)])
+    return cubes, altitude
+
+
+def humidity_chain(profile):
+    """
+    Humidity calculations carried out for each sonde ascent in make_cubes
+    """
+    vapour_pressure = calculate.svpw_from_temp(profile['dew_point_temperature'])
+    partial_pressure = calculate.partial_from_vapour(vapour_pressure, profile['air_temperature'],
+                                                     profile['air_pressure'])
+    q = calculate.q_from_partialpressure(partial_pressure, profile['air_pressure'])
+    vapour_pres = calculate.vapour_pressure_from_q(q, profile['air_pressure'])
+    for state in ['liquid_water', 'ice', 'mixed']:
+        calculate.RH_from_vapourpressure(vapour_pres, profile['air_temperature'], state)
+
+
+def micro_benchmarks(sizes = PROFILE_SIZES, repeats = 3, seed = 0, n_ascents = 100):
+    """
+    Time individual functions for profiles of each size
+    :param sizes: list of integers, numbers of levels
+    :param repeats: integer, number of calls to time of each function
+    :param seed: integer, seed for random numbers
+    :param n_ascents: integer, number of rows of the 2D arrays used for gradients
+    :return: list of dictionaries of results
+    """
+    results = []
+
+    for size in sizes:
+        profile = synthetic_profile(size, seed)
+        T = profile['air_temperature']
+        Z = profile['altitude']
+        theta_2D = np.tile(profile['air_potential_temperature'], (n_ascents, 1))
+        altitude_2D = np.tile(Z, (n_ascents, 1))
+
+        benchmarks = [
+            ('gaussian_kernel_smooth', lambda: gaussian_kernel_smooth(T, Z, KERNEL_DIC['gaussian_half_width'],
+                                                                      KERNEL_DIC['window_half_width'])),
+            ('savgol', lambda: my_filter(T, Z, SAVGOL_DIC)),
+            ('tropopause_height', lambda: calculate.tropopause_height(T, Z, 0)),
+            ('calculate_humidity', lambda: humidity_chain(profile)),
+            ('array_gradient_axis1', lambda: calculate.array_gradient_axis1(theta_2D, altitude_2D))]
+
+        try:
+            from re_grid import re_grid_1d
+            cubes, altitude = profile_cubes(profile)
+            benchmarks.append(('re_grid_1d', lambda: re_grid_1d(cubes, altitude, -10000, 10000, 10)))
+        except ImportError:
+            print('iris is not available, skipping re_grid_1d')
+
+        for name, function in benchmarks:
+            if name == 'savgol' and size < SAVGOL_DIC['window']:
+                continue
+            result = time_function(function, repeats)
+            result.update({'benchmark': name, 'size': size, 'kind': 'micro'})
+            results.append(result)
+            print('{:>24} {:>6} levels: {:.5f} s'.format(name, size, result['best']))
+
+    return results
+
+
+def macro_benchmarks(n_ascents = 4, sonde_spacing = 10., repeats = 1, seed = 0, folder = None):
+    """
+    Time the processing of whole ascents and of a whole station on synthetic data
+    :param n_ascents: integer, number of ascents of the synthetic station
+    :param sonde_spacing: number, vertical resolution of sondes in m
+    :param repeats: integer, number of calls to time of each function
+    :param seed: integer, seed for random numbers
+    :param folder: string, folder in which to write synthetic data, by default a temporary folder
+    :return: list of dictionaries of results
+    """
+    from process_data import process_single_ascent
+    from re_grid import re_grid_trop_0
+    import concatenate
+
+    remove = folder is None
+    if remove:
+        folder = tempfile.mkdtemp(prefix = 'nawdex_benchmark_')
+
+    environment = {'NAWDEX_DATA_ROOT': folder,
+                   'NAWDEX_FILE_LISTS': os.path.join(folder, 'File_lists'),
+                   'NAWDEX_OUTPUT_ROOT': os.path.join(folder, 'output')}
+    previous = dict((key, os.environ.get(key)) for key in environment)
+    os.environ.update(environment)
+
+    results = []
+    try:
+        source, station_number = synthetic_data.generate_dataset(folder, n_stations = 1, n_ascents = n_ascents,
+                                                                 sonde_spacing = sonde_spacing, seed = seed)[0]
+        time = concatenate.create_datetime_list(source, station_number)[0]
+
+        benchmarks = [
+            ('process_single_ascent_sonde',
+             lambda: process_single_ascent(source, station_number, time, 'sonde', KERNEL_DIC, 0)),
+            ('process_single_ascent_UKMO',
+             lambda: process_single_ascent(source, station_number, time, 'UKMO', KERNEL_DIC, 0)),
+            ('re_grid_trop_0', lambda: re_grid_trop_0(source, station_number, time, KERNEL_DIC)),
+            ('concatenate_station', lambda: concatenate.concatenate_cubelist_dictionary(source, station_number))]
+
+        for name, function in benchmarks:
+            result = time_function(function, repeats)
+            result.update({'benchmark': name, 'size': n_ascents, 'kind': 'macro',
+                           'sonde_spacing': sonde_spacing})
+            results.append(result)
+            print('{:>28} {:>4} ascents: {:.3f} s'.format(name, n_ascents, result['best']))
+    finally:
+        for key in previous:
+            if previous[key] is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = previous[key]
+        if remove:
+            shutil.rmtree(folder)
+
+    return results
+
+
+def revision():
+    """
+    :return: string, git revision of the code being benchmarked, or 'unknown'
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           cwd = SRC_FOLDER, stderr = devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_results(results, filename = None):
+    """
+    Save results with details of the version and machine
+    :param results: list of dictionaries of results
+    :param filename: string, by default benchmark_results/<revision>.json
+    :return: filename
+    """
+    if filename is None:
+        filename = os.path.join('benchmark_results', revision() + '.json')
+    folder = os.path.dirname(filename)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    with open(filename, 'w') as results_file:
+        json.dump({'revision': revision(),
+                   'date': datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'machine': platform.node(),
+                   'results': results}, results_file, indent = 1, sort_keys = True)
+    return filename
+
+
+def load_results(filename):
+    """
+    :param filename: string, file written by save_results
+    :return: dictionary of results and details
+    """
+    with open(filename, 'r') as results_file:
+        return json.load(results_file)
+
+
+def compare_results(old_filename, new_filename):
+    """
+    Print a table of the best times of benchmarks common to two result files
+    :param old_filename: string, file written by save_results for the reference version
+    :param new_filename: string, file written by save_results for the new version
+    :return: list of (benchmark, size, old time, new time, ratio new/old)
+    """
+    old = load_results(old_filename)
+    new = load_results(new_filename)
+    old_times = dict(((result['benchmark'], result['size']), result['best']) for result in old['results'])
+
+    comparison = []
+    print('{:>28} {:>6} {:>10} {:>10} {:>7}'.format('benchmark', 'size', old['revision'], new['revision'], 'ratio'))
+    for result in new['results']:
+        key = (result['benchmark'], result['size'])
+        if key in old_times:
+            ratio = result['best']/old_times[key]
+            comparison.append((key[0], key[1], old_times[key], result['best'], ratio))
+            print('{:>28} {:>6} {:>10.5f} {:>10.5f} {:>7.2f}'.format(key[0], key[1], old_times[key],
+                                                                    result['best'], ratio))
+    return comparison
+
+
+def main(micro = True, macro = True, filename = None):
+    results = []
+    if micro:
+        results += micro_benchmarks()
+    if macro:
+        results += macro_benchmarks()
+    print('results saved to ' + save_results(results, filename))
+
+
+if __name__ == '__main__':
+    main()
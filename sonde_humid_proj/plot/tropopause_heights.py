@@ -1,3 +1,5 @@
+import os
+
 import iris
 iris.FUTURE.cell_datetime_objects=True
 import matplotlib.pyplot as plt
@@ -7,7 +9,34 @@ import sys
 sys.path.append('..')
 
 import src.calculate
+import src.summary
 from src.ERA_climatology import find_mean_trop_GPH
+from src.read_files import output_folder
+
+
+def load_trop_heights(station_code, nlist):
+    """
+    :param station_code: string, source and station number, e.g. 'EMN_03882'
+    :param nlist: list of keys of the products, e.g. ['sonde', 'ukmo', 'ecan']
+    :return: list of dictionaries, one for each product, of arrays of the 'time', 'tropopause_altitude',
+             'latitude' and 'longitude' of each ascent, from the per-ascent table of the station
+             or, for stations saved before there were tables, from the 2D files
+    """
+    source, station_number = station_code.split('_')
+    folder = output_folder(source, station_number)
+
+    if os.path.exists(os.path.join(folder, src.summary.SUMMARY_FILENAME)):
+        table = src.summary.load_summary(os.path.join(folder, src.summary.SUMMARY_FILENAME))
+        return [src.summary.select(table, product = name) for name in nlist]
+
+    trop_list = []
+    for name in nlist:
+        trop = iris.load(os.path.join(folder, name + '_2D_trop_relative.nc'), 'tropopause_altitude')[0]
+        trop_list.append({'time': trop.coord('time').points, 'tropopause_altitude': trop.data,
+                          'latitude': trop.coord('latitude').points,
+                          'longitude': trop.coord('longitude').points})
+    return trop_list
+
 
 def compare_trop_heights(station_code):
     """
@@ -17,19 +46,13 @@ def compare_trop_heights(station_code):
                          second digits identify the particular station, e.g. 'EMN_03882'
     """
 
-    sonde_trop = iris.load('/home/users/bn826011/PhD/radiosonde/NAWDEX_timeseries/high_res/'
-                           + station_code + '/sonde_2D_trop_relative.nc', 'tropopause_altitude')[0]
-    ukmo_trop = iris.load('/home/users/bn826011/PhD/radiosonde/NAWDEX_timeseries/high_res/'
-                          + station_code + '/ukmo_2D_trop_relative.nc', 'tropopause_altitude')[0]
-    ecan_trop = iris.load('/home/users/bn826011/PhD/radiosonde/NAWDEX_timeseries/high_res/'
-                          + station_code + '/ecan_2D_trop_relative.nc', 'tropopause_altitude')[0]
-    # load trop_altitude from obs & analyses
-
-    trop_list = [sonde_trop, ukmo_trop, ecan_trop]
     nlist = ['sonde', 'ukmo', 'ecan']
+    trop_list = load_trop_heights(station_code, nlist)
+    # load the per-ascent table, rather than the 2D files, of obs & analyses where there is one
+    sonde_trop = trop_list[0]
 
-    lat = sonde_trop.coord('latitude').points[0]
-    lon = sonde_trop.coord('longitude').points[0]
+    lat = sonde_trop['latitude'][0]
+    lon = sonde_trop['longitude'][0]
     # read latitude & longitude of station
 
     mean_trop_gph = find_mean_trop_GPH(lat, lon)
@@ -37,14 +60,14 @@ def compare_trop_heights(station_code):
     trop_ref = src.calculate.altitude_from_GPH(mean_trop_gph)
     # convert to altitude
 
-    start_time = sonde_trop.coord('time').points[0]
-    end_time = sonde_trop.coord('time').points[-1]
+    start_time = sonde_trop['time'][0]
+    end_time = sonde_trop['time'][-1]
     # first & last times in timeseries
 
     plt.figure(figsize=(12, 8))
 
     for n, trop in enumerate(trop_list):
-        plt.plot(trop.coord('time').points, trop.data, label=nlist[n])
+        plt.plot(trop['time'], trop['tropopause_altitude'], label=nlist[n])
 
     plt.plot([start_time, end_time], [trop_ref, trop_ref], label='ERA-Interim Sept/Oct mean')
     # plot tropopause timeseries against reference on same plot to compare
@@ -0,0 +1,170 @@
+"""
+Bootstrap confidence intervals of mean profiles on the tropopause-relative grid, such as
+the mean difference of a product from the sonde across ascents or stations
+
+Each resample draws indices of ascents with replacement (or indices of stations, taking
+all ascents of each station drawn, as blocks), which are held as the number of times each
+ascent is drawn. The nan-aware means of all resamples in a chunk are then one matrix product
+    sum(counts * values) / sum(counts * valid)
+over ascents, and chunks can be spread over a pool of processes for many resamples
+"""
+from __future__ import division
+
+import warnings
+from multiprocessing import Pool
+
+import numpy as np
+
+import verification
+
+_worker = {}
+# values and validity of the data, set once in each worker process of the pool
+
+
+def resample_counts(n_items, n_resamples, random_state, blocks = None):
+    """
+    :param n_items: number of ascents
+    :param n_resamples: number of resamples
+    :param random_state: numpy RandomState
+    :param blocks: array of the block (e.g. station) of each ascent, as integers from 0, if given
+                   whole blocks are resampled rather than single ascents
+    :return: array (resample x ascent) of the number of times each ascent is drawn
+    """
+    if blocks is None:
+        n_draws = n_items
+    else:
+        n_draws = int(np.max(blocks)) + 1
+
+    indices = random_state.randint(0, n_draws, size = (n_resamples, n_draws))
+    # indices drawn with replacement for each resample
+    counts = np.bincount((np.arange(n_resamples)[:, np.newaxis]*n_draws + indices).ravel(),
+                         minlength = n_resamples*n_draws).reshape(n_resamples, n_draws)
+
+    if blocks is not None:
+        counts = counts[:, blocks]
+        # each ascent is drawn as many times as its block
+
+    return counts.astype(float)
+
+
+def resample_means(values, valid, counts):
+    """
+    :param values: array (ascent x altitude), with zero where not valid
+    :param valid: array (ascent x altitude) of 1 where valid and 0 otherwise
+    :param counts: array (resample x ascent) from resample_counts
+    :return: array (resample x altitude) of the mean of the valid values of each resample,
+             nan where none are valid
+    """
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return counts.dot(values)/counts.dot(valid)
+
+
+def _set_worker(values, valid, blocks):
+    _worker.update({'values': values, 'valid': valid, 'blocks': blocks})
+
+
+def _chunk_means(task):
+    """
+    :param task: tuple of the seed and number of resamples of a chunk
+    :return: array (resample x altitude) of means, from the data of the worker process
+    """
+    seed, n_resamples = task
+    counts = resample_counts(len(_worker['values']), n_resamples, np.random.RandomState(seed),
+                             _worker['blocks'])
+    return resample_means(_worker['values'], _worker['valid'], counts)
+
+
+def bootstrap_means(data, n_resamples = 1000, blocks = None, seed = None, chunk_size = 200,
+                    processes = None):
+    """
+    Means over ascents of many bootstrap resamples
+    :param data: array (ascent x altitude), with nan where there is no value
+    :param n_resamples: number of resamples
+    :param blocks: array of the block (e.g. station) of each ascent, as integers from 0,
+                   or None to resample single ascents
+    :param seed: integer seed of the random numbers, for reproducible resamples
+    :param chunk_size: number of resamples whose means are calculated at once
+    :param processes: number of processes over which the chunks are spread, if None all
+                      chunks are done in this process
+    :return: array (resample x altitude) of means
+    """
+    data = np.ma.filled(np.asanyarray(data, dtype = float), np.nan)
+    valid = ~np.isnan(data)
+    values = np.where(valid, data, 0.)
+    valid = valid.astype(float)
+    if blocks is not None:
+        blocks = np.unique(blocks, return_inverse = True)[1]
+        # numbered from 0 in order
+
+    chunks = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size = len(chunks))
+    # one seed for each chunk, such that the result does not depend on the number of processes
+    tasks = list(zip(seeds, chunks))
+
+    if not processes or processes <= 1:
+        _set_worker(values, valid, blocks)
+        try:
+            return np.concatenate([_chunk_means(task) for task in tasks])
+        finally:
+            _worker.clear()
+
+    pool = Pool(processes, initializer = _set_worker, initargs = (values, valid, blocks))
+    try:
+        return np.concatenate(pool.map(_chunk_means, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def confidence_band(data, percentiles = (2.5, 97.5), n_resamples = 1000, blocks = None, seed = None,
+                    chunk_size = 200, processes = None):
+    """
+    Percentile bootstrap confidence band of the mean profile
+    :param data: array (ascent x altitude), with nan where there is no value, e.g. of the
+                 difference of a product from the sonde
+    :param percentiles: lower and upper percentiles of the band
+    :param n_resamples: number of resamples, see bootstrap_means for the rest
+    :return: dictionary of arrays (altitude) of the 'mean' of all ascents, the 'lower' and
+             'upper' percentiles of the resampled means, and the 'count' of valid values
+    """
+    means = bootstrap_means(data, n_resamples, blocks, seed, chunk_size, processes)
+    data = np.ma.filled(np.asanyarray(data, dtype = float), np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # levels with no valid values give nan
+        lower, upper = np.nanpercentile(means, percentiles, axis = 0)
+        return {'mean': np.nanmean(data, axis = 0), 'lower': lower, 'upper': upper,
+                'count': np.sum(~np.isnan(data), axis = 0)}
+
+
+def composite_band(station_codes, variable, product = None, kind = 'difference', by_station = True,
+                   percentiles = (2.5, 97.5), n_resamples = 1000, seed = None, chunk_size = 200,
+                   processes = None):
+    """
+    Confidence band of the mean profile of a variable, or of its difference from the sonde,
+    over the ascents of several stations
+    :param station_codes: list of strings, source and station number, e.g. 'EMN_03882'
+    :param variable: string, name of variable
+    :param product: key of re_grid.PRODUCTS to compare with the sonde, or None for the
+                    variable of the sonde itself
+    :param kind: kind of difference from the sonde, see verification
+    :param by_station: if True, resample whole stations, such that ascents of the same station
+                       are not taken as independent, otherwise resample ascents
+    :param percentiles: lower and upper percentiles of the band, see bootstrap_means for the rest
+    :return: dictionary of arrays as confidence_band, with the tropopause-relative 'altitude'
+    """
+    arrays = []
+    blocks = []
+    for n, code in enumerate(station_codes):
+        data, times, altitude = verification.station_arrays(code, [variable], [product] if product else [])
+        if product:
+            data = verification.differences(data, [kind])[kind]
+        arrays.append(data[0, -1])
+        # the product, or the sonde if there is no product
+        blocks.append(np.zeros(len(times), dtype = int) + n)
+
+    band = confidence_band(np.concatenate(arrays), percentiles, n_resamples,
+                           np.concatenate(blocks) if by_station else None, seed, chunk_size, processes)
+    band['altitude'] = altitude
+    return band
@@ -3,8 +3,45 @@ Collection of functions to carry out necessary calculations of meteorological qu
 """
 
 from __future__ import division
+import threading
+
 import numpy as np
 
+import precision
+
+_workspace = threading.local()
+# scratch arrays of each thread, reused by the out= versions of the functions below
+
+
+def workspace(function, name, shape, dtype = np.float64):
+    """
+    Scratch array which is reused by every call asking for the same function, name, shape &
+    dtype, so that repeated calls on arrays of the same shape allocate no new temporaries
+    The arrays of each function are its own, such that an array a caller holds (or passes as
+    out) is not overwritten by the temporaries of another function it calls
+    Only the last shape & dtype of each name is kept, and each thread has its own arrays
+    :param function: string, name of the function using the array
+    :param name: string identifying the use of the array within the function
+    :param shape: tuple, shape of the array
+    :param dtype: numpy dtype of the array
+    :return: array, with undefined values
+    """
+    buffers = getattr(_workspace, 'buffers', None)
+    if buffers is None:
+        buffers = _workspace.buffers = {}
+    buffer = buffers.get((function, name))
+    if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != np.dtype(dtype):
+        buffer = buffers[(function, name)] = np.empty(shape, dtype)
+    return buffer
+
+
+def clear_workspace():
+    """
+    Release the scratch arrays of this thread
+    """
+    _workspace.buffers = {}
+
+
 def gp_to_gph(geopotential, g = 9.80665):
     """
     Calculate geopotential height from geopotential
@@ -22,65 +59,117 @@ def altitude_from_GPH(geopotential_height, a = 6371229.0):
     """
     return a*geopotential_height/(a-geopotential_height)
 
-def temp_from_theta(theta, pressure, R = 8.31446, cp = 29.07):
+def temp_from_theta(theta, pressure, R = 8.31446, cp = 29.07, out = None):
     """
     Calculate air_temperature from potential temperature and pressure
     :param theta: array of potential temperature in K
     :param pressure: corresponding array of pressure in Pa
     :param R: gas constant
     :param cp: approximation to isobaric specific heat capacity of air
+    :param out: array (not masked) in which to put the result, which may be one of the inputs,
+                with temporaries held in the workspace; if None a new array is returned
     :return: array of temperature
     """
-    return theta*((pressure/1e5)**(R/cp))
+    if out is None:
+        return theta*((pressure/1e5)**(R/cp))
+
+    exner = workspace('temp_from_theta', 'exner', out.shape, out.dtype)
+    np.divide(pressure, 1e5, out = exner)
+    np.power(exner, R/cp, out = exner)
+    return np.multiply(theta, exner, out = out)
 
-def theta_from_temp(temperature, pressure, R = 8.31446, cp = 29.07):
+def theta_from_temp(temperature, pressure, R = 8.31446, cp = 29.07, out = None):
     """
     Calculate potential temperature from temperature and pressure
     :param temperature: array of temperature in K
     :param pressure: corresponding array of pressure in Pa
     :param R: gas constant
     :param cp: approximation to isobaric specific heat capacity of air
+    :param out: array (not masked) in which to put the result, which may be one of the inputs,
+                with temporaries held in the workspace; if None a new array is returned
     :return: array of potential temperature
     """
-    return temperature*((pressure/1e5)**(-R/cp))
+    if out is None:
+        return temperature*((pressure/1e5)**(-R/cp))
+
+    exner = workspace('theta_from_temp', 'exner', out.shape, out.dtype)
+    np.divide(pressure, 1e5, out = exner)
+    np.power(exner, -R/cp, out = exner)
+    return np.multiply(temperature, exner, out = out)
 
-def partial_from_vapour(vapour_pressure, temperature, pressure):
+def partial_from_vapour(vapour_pressure, temperature, pressure, out = None):
     """
     Calculate partial pressure of water vapour from vapour pressure 
     with respect to liquid water using eq. A4.7 in Gill AOD p606
     :param vapour_pressure: array of vapour pressure with respect to liquid water in Pa
     :param temperature: array of air temperature in K
     :param pressure: array of total air pressure in Pa
+    :param out: array (not masked) in which to put the result, which may be one of the inputs,
+                with temporaries held in the workspace; if None a new array is returned
     :return: array of partial pressure of water vapour in Pa
     """
-    return (1 + 1e-8*pressure*(4.5 + 6e-4*(temperature - 273.15)**2))*vapour_pressure
-
-def q_from_partialpressure(partial_pres, pressure, repsilon = 0.621981):
+    if out is None:
+        return (1 + 1e-8*pressure*(4.5 + 6e-4*(temperature - 273.15)**2))*vapour_pressure
+
+    enhancement = workspace('partial_from_vapour', 'enhancement', out.shape, out.dtype)
+    term = workspace('partial_from_vapour', 'term', out.shape, out.dtype)
+    np.subtract(temperature, 273.15, out = term)
+    np.square(term, out = term)
+    term *= 6e-4
+    term += 4.5
+    np.multiply(pressure, 1e-8, out = enhancement)
+    enhancement *= term
+    enhancement += 1
+    return np.multiply(enhancement, vapour_pressure, out = out)
+
+def q_from_partialpressure(partial_pres, pressure, repsilon = 0.621981, out = None):
     """
     Calculate specific humidity from vapour pressure using eq. A4.3 in Gill AOD p606, 
     equiv. 3.1.12 p41, equiv. 5.22 in Ambaum TPOA p100
     :param partial_pres: array of partial pressure of water vapour in Pa
     :param pressure: array of pressure in Pa
     :param repsilon: number, ratio of effective molar masses of water and dry air, approx 0.62198
+    :param out: array (not masked) in which to put the result, which may be one of the inputs,
+                with temporaries held in the workspace; if None a new array is returned
     :return: array of specific humidity in kg kg-1
     """
-    return repsilon*partial_pres/(np.amax([pressure, partial_pres], 0) - 
+    if out is None:
+        return repsilon*partial_pres/(np.maximum(pressure, partial_pres) - 
                                                      (1-repsilon)*partial_pres)
-    # using the fix of 'amax(pressure, partial_pres)' means that q is capped at 1kg/kg if for some reason e > p    
+    # using the fix of 'maximum(pressure, partial_pres)' means that q is capped at 1kg/kg if for some reason e > p    
     # FIND ACTUAL SOURCE - I think I found this reading through the code for the UM
 
-def vapour_pressure_from_q(q, pressure, repsilon = 0.621981):
+    denominator = workspace('q_from_partialpressure', 'denominator', out.shape, out.dtype)
+    term = workspace('q_from_partialpressure', 'term', out.shape, out.dtype)
+    np.maximum(pressure, partial_pres, out = denominator)
+    np.multiply(partial_pres, 1-repsilon, out = term)
+    denominator -= term
+    np.multiply(partial_pres, repsilon, out = term)
+    return np.divide(term, denominator, out = out)
+
+def vapour_pressure_from_q(q, pressure, repsilon = 0.621981, out = None):
     """
     Calculate vapour pressure from specific humidity using eq. A4.3 in Gill AOD p606, 
     equiv. 3.1.12 p41, equiv. 5.22 in Ambaum TPOA p100
     :param q: array of specific humidity in Pa
     :param pressure: array of pressure in Pa
     :param repsilon: number, ratio of effective molar masses of water and dry air, approx 0.62198
+    :param out: array (not masked) in which to put the result, which may be one of the inputs,
+                with temporaries held in the workspace; if None a new array is returned
     :return: array of vapour pressure in Pa
     """
-    return pressure*q/(repsilon + (1-repsilon)*q)
-
-def RH_from_vapourpressure(vapour_pres, temp, state = 'mixed', T0 = 273.16, Ti = 250.16):
+    if out is None:
+        return pressure*q/(repsilon + (1-repsilon)*q)
+
+    denominator = workspace('vapour_pressure_from_q', 'denominator', out.shape, out.dtype)
+    term = workspace('vapour_pressure_from_q', 'term', out.shape, out.dtype)
+    np.multiply(q, 1-repsilon, out = denominator)
+    denominator += repsilon
+    np.multiply(pressure, q, out = term)
+    return np.divide(term, denominator, out = out)
+
+def RH_from_vapourpressure(vapour_pres, temp, state = 'mixed', T0 = 273.16, Ti = 250.16, method = None,
+                           out = None):
     """
     Calculate relative humidity with respect to specified state
     :param vapour_pres: array of vapour pressure in Pa
@@ -89,33 +178,26 @@ def RH_from_vapourpressure(vapour_pres, temp, state = 'mixed', T0 = 273.16, Ti =
                   either 'liquid water', 'ice' or 'mixed'
     :param T0: temperature above which RH is calculated only wrt liquid water in mixed state
     :param Ti: temperature below which RH is calculated only wrt ice in mixed state
+    :param method: method of calculating saturation vapour pressure, see set_svp_method,
+                   by default that set by set_svp_method
+    :param out: array (not masked) in which to put the result, which may be one of the inputs,
+                with temporaries held in the workspace; if None a new array is returned
     :return: array of relative humidity in kg kg-1
     """
+    svp_out = None if out is None else workspace('RH_from_vapourpressure', 'svp', out.shape,
+                                                 out.dtype)
 
     if state == 'liquid_water':
 
-        svp = svpw_from_temp(temp)
+        svp = svpw_from_temp(temp, method, svp_out)
 
     elif state == 'ice':
 
-        svp = svpi_from_temp(temp)
+        svp = svpi_from_temp(temp, method, svp_out)
 
     elif state == 'mixed':
 
-        svpw = svpw_from_temp(temp)
-        svpi = svpi_from_temp(temp)
-
-        A = (temp - Ti)/(T0 - Ti)
-        # array indicating relative distance between T0 and Ti
-        # A > 1 for temp > T0, A < 0 for temp < Ti, 0 < A < 1 for Ti < temp < T0
-
-        B = np.amax([np.amin([A, np.ones_like(A)], axis = 0), np.zeros_like(A)], axis = 0)
-        # adjusts A s.t. B = 1 for temp > T0 and B = 0 for temp < Ti
-
-        svp = svpi + (svpw - svpi)*(B**2)
-        # quadratic fit of svp for Ti < temp < T0
-        # svp = svpw for temp > T0
-        # svp = svpi for temp < Ti
+        svp = svpm_from_temp(temp, T0, Ti, method, svp_out)
 
     else:
 
@@ -123,34 +205,329 @@ def RH_from_vapourpressure(vapour_pres, temp, state = 'mixed', T0 = 273.16, Ti =
               "calculated with respect to: \n 'liquid_water', 'ice' or 'mixed'" +
               " \n As you have decided to enter something else, this function will now fail")
 
-    return vapour_pres/svp
+    if out is None:
+        return vapour_pres/svp
+    return np.divide(vapour_pres, svp, out = out)
+
+
+SVP_TABLE = {'lower' : 150., 'upper' : 340., 'spacing' : 0.01}
+# range and spacing in K of the saturation vapour pressure tables, covering the atmosphere
+
+_svp_state = {'method' : 'exact', 'tables' : {}}
+
+
+def set_svp_method(method):
+    """
+    Set how saturation vapour pressure is calculated when no method is given
+    :param method: 'exact' to evaluate the Sonntag approximation at every temperature,
+                   'linear' or 'cubic' to interpolate tables of it, in steps of 0.01 K
+                   from 150 K to 340 K (the exact formula is used outside this range)
+                   Over the whole range the largest relative error of 'linear' is 9e-7 (at the
+                   coldest temperatures) and of 'cubic' (cubic Hermite, using the exact gradient
+                   at each temperature of the table) 1.1e-13, as measured by svp_table_error
+    """
+    if method not in ['exact', 'linear', 'cubic']:
+        raise ValueError('unknown saturation vapour pressure method: ' + str(method))
+    _svp_state['method'] = method
+
+
+SONNTAG = {'water' : [-6096.9385, 16.635794, -2.711193e-2, 1.673952e-5, 2.433502],
+           'ice' : [-6024.5282, 24.721994, 1.0613868e-2, -1.3198825e-5, -0.49382577]}
+# coefficients of the Sonntag numerical approximation over liquid water and over ice
+
+
+def sonntag(T, phase, gradient = False, out = None):
+    """
+    :param T: float64 array of temperature in K
+    :param phase: 'water' or 'ice'
+    :param gradient: if True, also return the gradient with respect to temperature (Pa K-1)
+    :param out: array (not masked) in which to put the result, with the exponent summed in
+                a float64 workspace; if None a new array is returned
+    :return: saturation vapour pressure (Pa), Sonntag approximation
+    """
+    a0, a1, a2, a3, a4 = SONNTAG[phase]
+
+    if out is None:
+        svp = 100*np.exp(a0/T
+                         + a1
+                         + a2*T
+                         + a3*(T**2)
+                         + a4*np.log(T))
+    else:
+        exponent = workspace('sonntag', 'exponent', T.shape)
+        term = workspace('sonntag', 'term', T.shape)
+        np.divide(a0, T, out = exponent)
+        exponent += a1
+        np.multiply(T, a2, out = term)
+        exponent += term
+        np.square(T, out = term)
+        term *= a3
+        exponent += term
+        np.log(T, out = term)
+        term *= a4
+        exponent += term
+        np.exp(exponent, out = exponent)
+        svp = np.multiply(exponent, 100, out = out)
+        # summed in the same order as the expression above, giving the same result
+
+    if not gradient:
+        return svp
+    return svp, svp*(-a0/T**2 + a2 + 2*a3*T + a4/T)
+
+
+def svpw_exact(T, gradient = False, out = None):
+    """
+    :param T: float64 array of temperature in K
+    :param gradient: if True, also return the gradient with respect to temperature (Pa K-1)
+    :param out: array in which to put the result, see sonntag
+    :return: saturation vapour pressure with respect to liquid water (Pa), Sonntag approximation
+    """
+    return sonntag(T, 'water', gradient, out)
+
+
+def svpi_exact(T, gradient = False, out = None):
+    """
+    :param T: float64 array of temperature in K
+    :param gradient: if True, also return the gradient with respect to temperature (Pa K-1)
+    :param out: array in which to put the result, see sonntag
+    :return: saturation vapour pressure with respect to ice (Pa), Sonntag approximation
+    """
+    return sonntag(T, 'ice', gradient, out)
 
 
-def svpw_from_temp(temp):
+def svpm_exact(T, T0 = 273.16, Ti = 250.16, gradient = False, inside = None, out = None):
+    """
+    :param T: float64 array of temperature in K
+    :param T0: temperature above which svp is only wrt liquid water
+    :param Ti: temperature below which svp is only wrt ice
+    :param gradient: if True, also return the gradient with respect to temperature (Pa K-1)
+    :param inside: boolean array, whether the blend is changing at each temperature, used
+                   for the gradient at Ti & T0 themselves, by default Ti < T < T0
+    :param out: array (not masked) in which to put the result, with temporaries held in
+                the workspace; if None a new array is returned
+    :return: saturation vapour pressure blended between ice and liquid water (Pa)
+    """
+    if out is not None and not gradient:
+        svpw = svpw_exact(T, out = workspace('svpm_exact', 'svpw', T.shape))
+        svpi = svpi_exact(T, out = workspace('svpm_exact', 'svpi', T.shape))
+        B = workspace('svpm_exact', 'blend', T.shape)
+        np.subtract(T, Ti, out = B)
+        B /= (T0 - Ti)
+        np.clip(B, 0, 1, out = B)
+        np.square(B, out = B)
+        svpw -= svpi
+        svpw *= B
+        return np.add(svpi, svpw, out = out)
+        # as below, without temporaries
+
+    svpw = svpw_exact(T)
+    svpi = svpi_exact(T)
+
+    A = (T - Ti)/(T0 - Ti)
+    # array indicating relative distance between T0 and Ti
+    # A > 1 for temp > T0, A < 0 for temp < Ti, 0 < A < 1 for Ti < temp < T0
+
+    B = np.clip(A, 0, 1)
+    # adjusts A s.t. B = 1 for temp > T0 and B = 0 for temp < Ti
+
+    svp = svpi + (svpw - svpi)*(B**2)
+    # quadratic fit of svp for Ti < temp < T0
+    # svp = svpw for temp > T0
+    # svp = svpi for temp < Ti
+
+    if not gradient:
+        return svp
+
+    dsvpw = svpw_exact(T, True)[1]
+    dsvpi = svpi_exact(T, True)[1]
+    if inside is None:
+        inside = (T > Ti) & (T < T0)
+    dB = np.where(inside, 1/(T0 - Ti), 0)
+
+    return svp, dsvpi + (dsvpw - dsvpi)*(B**2) + 2*(svpw - svpi)*B*dB
+
+
+SVP_FUNCTIONS = {'water' : svpw_exact, 'ice' : svpi_exact, 'mixed' : svpm_exact}
+
+
+def svp_table(phase):
+    """
+    Table of saturation vapour pressure, made when first used
+    :param phase: 'water', 'ice' or 'mixed' (with the default T0 & Ti)
+    :return: dictionary of the temperatures, values, and the gradients at the lower and upper
+             temperature of each interval (which differ only where the mixed blend starts & ends)
+    """
+    if phase not in _svp_state['tables']:
+        n = int(round((SVP_TABLE['upper'] - SVP_TABLE['lower'])/SVP_TABLE['spacing'])) + 1
+        T = SVP_TABLE['lower'] + SVP_TABLE['spacing']*np.arange(n)
+        values = SVP_FUNCTIONS[phase](T)
+
+        if phase == 'mixed':
+            middle = T[:-1] + SVP_TABLE['spacing']/2
+            inside = (middle > 250.16) & (middle < 273.16)
+            # whether the blend is changing within each interval
+            lower_gradient = svpm_exact(T[:-1], gradient = True, inside = inside)[1]
+            upper_gradient = svpm_exact(T[1:], gradient = True, inside = inside)[1]
+        else:
+            gradient = SVP_FUNCTIONS[phase](T, gradient = True)[1]
+            lower_gradient, upper_gradient = gradient[:-1], gradient[1:]
+
+        _svp_state['tables'][phase] = {'T' : T, 'values' : values, 'lower_gradient' : lower_gradient,
+                                       'upper_gradient' : upper_gradient}
+    return _svp_state['tables'][phase]
+
+
+def svp_from_table(phase, T, method):
+    """
+    Interpolate a table of saturation vapour pressure, using the exact formula outside it
+    :param phase: 'water', 'ice' or 'mixed' (with the default T0 & Ti)
+    :param T: float64 array of temperature in K
+    :param method: 'linear', or 'cubic' for cubic Hermite interpolation
+    :return: array of saturation vapour pressure in Pa
+    """
+    table = svp_table(phase)
+    mask = np.ma.getmask(T)
+    T = np.asarray(np.ma.getdata(T), dtype = np.float64)
+    shape = T.shape
+    T = T.reshape(-1)
+
+    x = (T - SVP_TABLE['lower'])/SVP_TABLE['spacing']
+    with np.errstate(invalid = 'ignore'):
+        inside = (x >= 0) & (x <= len(table['T']) - 1)
+        x[~inside] = 0
+    index = x.astype(int)
+    # the interval of each temperature, as x >= 0
+    np.clip(index, 0, len(table['T']) - 2, out = index)
+    t = x - index
+
+    lower = table['values'].take(index)
+    upper = table['values'].take(index + 1)
+    if method == 'linear':
+        svp = upper - lower
+        svp *= t
+        svp += lower
+    else:
+        h = SVP_TABLE['spacing']
+        t2 = t**2
+        t3 = t2*t
+        svp = ((2*t3 - 3*t2 + 1)*lower + (t3 - 2*t2 + t)*h*table['lower_gradient'].take(index)
+               + (3*t2 - 2*t3)*upper + (t3 - t2)*h*table['upper_gradient'].take(index))
+
+    if not np.all(inside):
+        svp = np.where(inside, svp, np.nan)
+        svp[~inside] = SVP_FUNCTIONS[phase](T[~inside])
+        # including nan temperatures, which give nan
+
+    svp = svp.reshape(shape)
+    if mask is not np.ma.nomask:
+        return np.ma.array(svp, mask = mask)
+    if svp.ndim == 0:
+        return svp[()]
+    return svp
+
+
+def svp_table_error(phase, method, points = 10):
+    """
+    Measure the error of interpolating a table of saturation vapour pressure
+    :param phase: 'water', 'ice' or 'mixed'
+    :param method: 'linear' or 'cubic'
+    :param points: number of temperatures tested within each interval of the table
+    :return: largest relative error over the table
+    """
+    T = np.linspace(SVP_TABLE['lower'], SVP_TABLE['upper'],
+                    int(round((SVP_TABLE['upper'] - SVP_TABLE['lower'])/SVP_TABLE['spacing']))*points + 1)
+    exact = SVP_FUNCTIONS[phase](T)
+    return np.max(np.abs(svp_from_table(phase, T, method)/exact - 1))
+
+
+def exact_input(temp, out = None):
+    """
+    :param temp: array of temperature in K
+    :param out: array in which the result of the calculation will be put, or None
+    :return: temp in float64, in which the exponentials are evaluated whatever the precision
+             of temp; copied to the workspace rather than a new array if out is given
+    """
+    if out is None or not precision.is_float_array(temp) or temp.dtype == np.float64:
+        return precision.to_float64(temp)
+    T = workspace('exact_input', 'temperature', temp.shape)
+    T[...] = temp
+    return T
+
+
+def svp_from_temp(phase, temp, method = None, out = None, T0 = 273.16, Ti = 250.16):
+    """
+    :param phase: 'water', 'ice' or 'mixed'
+    :param temp: array of temperature in K
+    :param method: 'exact', 'linear' or 'cubic', by default that set by set_svp_method
+    :param out: array (not masked) in which to put the result; if None a new array is returned
+    :param T0: for 'mixed', temperature above which svp is only wrt liquid water
+    :param Ti: for 'mixed', temperature below which svp is only wrt ice
+    :return: array of saturation vapour pressure in Pa, in the precision of temp
+    """
+    if method is None:
+        method = _svp_state['method']
+    blend = {'T0' : T0, 'Ti' : Ti} if phase == 'mixed' else {}
+
+    T = exact_input(temp, out)
+    if method == 'exact':
+        if out is not None:
+            return SVP_FUNCTIONS[phase](T, out = out, **blend)
+        svp = SVP_FUNCTIONS[phase](T, **blend)
+    elif method in ['linear', 'cubic']:
+        if phase == 'mixed' and (T0 != 273.16 or Ti != 250.16):
+            # the table of the blend is only for the default T0 & Ti, otherwise blend tables of each
+            svpw = svp_from_table('water', T, method)
+            svpi = svp_from_table('ice', T, method)
+            B = np.clip((T - Ti)/(T0 - Ti), 0, 1)
+            svp = svpi + (svpw - svpi)*(B**2)
+        else:
+            svp = svp_from_table(phase, T, method)
+    else:
+        raise ValueError('unknown saturation vapour pressure method: ' + str(method))
+
+    if out is not None:
+        np.copyto(out, svp, casting = 'same_kind')
+        return out
+    return precision.like(svp, temp)
+
+
+def svpw_from_temp(temp, method = None, out = None):
     """
     Calculate saturation vapour pressure with respect to liquid water from 
     temperature using Sonntag numerical approximation
     :param temp: array of temperature in K
+    :param method: 'exact', or 'linear' or 'cubic' to interpolate a table,
+                   by default that set by set_svp_method
+    :param out: array (not masked) in which to put the result; if None a new array is returned
     :return: array of vapour pressure with respect to water in Pa
     """
-    return 100*np.exp(-6096.9385/temp
-                      + 16.635794
-                      - 2.711193e-2*temp
-                      + 1.673952e-5*(temp**2)
-                      + 2.433502*np.log(temp))
+    return svp_from_temp('water', temp, method, out)
 
-def svpi_from_temp(temp):
+def svpi_from_temp(temp, method = None, out = None):
     """
     Calculate saturation vapour pressure with respect to ice from temperature 
     using Sonntag numerical approximation
     :param temp: array of temperature in K
+    :param method: 'exact', or 'linear' or 'cubic' to interpolate a table,
+                   by default that set by set_svp_method
+    :param out: array (not masked) in which to put the result; if None a new array is returned
     :return: array of vapour pressure with respect to ice in Pa
     """
-    return 100*np.exp(-6024.5282/temp
-                      + 24.721994
-                      + 1.0613868e-2*temp
-                      - 1.3198825e-5*(temp**2)
-                      - 0.49382577*np.log(temp))
+    return svp_from_temp('ice', temp, method, out)
+
+def svpm_from_temp(temp, T0 = 273.16, Ti = 250.16, method = None, out = None):
+    """
+    Calculate saturation vapour pressure blended quadratically from ice below Ti
+    to liquid water above T0
+    :param temp: array of temperature in K
+    :param T0: temperature above which svp is only wrt liquid water
+    :param Ti: temperature below which svp is only wrt ice
+    :param method: 'exact', or 'linear' or 'cubic' to interpolate a table,
+                   by default that set by set_svp_method
+    :param out: array (not masked) in which to put the result; if None a new array is returned
+    :return: array of saturation vapour pressure in Pa
+    """
+    return svp_from_temp('mixed', temp, method, out, T0, Ti)
 
 def tropopause_height(T, Z, flag):
     """
@@ -162,6 +539,10 @@ def tropopause_height(T, Z, flag):
     :return: Tropopause height (number, in metres), 
              and optionally also the array of lapse rate (K/km)
     """
+    T = precision.to_float64(T)
+    Z = precision.to_float64(Z)
+    # lapse rates and their weighted averages are accumulated in float64
+
     Z2 = Z[1:-1]
     
     Gamma = 1e3*(T[:-2] - T[2:])/(Z[2:] - Z[:-2])
@@ -192,6 +573,86 @@ def tropopause_height(T, Z, flag):
     # if there are no layers which satisfy the condition in the profile, return nan and raise flag
 
 
+def tropopause_height_2d(T, Z, lengths = None, flag = 0):
+    """
+    Calculate the tropopause height by WMO definition for each row of 2D arrays,
+    equivalent to calling tropopause_height on each row
+    All candidate levels of a row are tested at once, using cumulative sums along
+    the rows for the weighted average lapse rate over the 2km above each candidate
+    :param T: array (rows x levels) of temperature (K)
+    :param Z: corresponding array of altitude (m)
+    :param lengths: array of the number of valid levels at the start of each row, where
+                    rows are padded to the same length, None if all levels are valid
+    :param flag: number, the flag given to rows in which things are working well
+    :return: array of tropopause height of each row (m), and array of flags as
+             given by tropopause_height
+    """
+    T = precision.to_float64(T)
+    Z = precision.to_float64(Z)
+    # lapse rates and their cumulative sums are accumulated in float64
+
+    n_rows, n_levels = Z.shape
+    if lengths is None:
+        lengths = np.zeros(n_rows, dtype = int) + n_levels
+    lengths = np.asarray(lengths)
+
+    trop_alt = np.zeros(n_rows) + np.nan
+    flags = np.zeros(n_rows, dtype = int) + 2
+    # rows with no layers which satisfy the condition keep nan and flag 2
+
+    Z2 = Z[:, 1:-1]
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+
+        Gamma = 1e3*(T[:, :-2] - T[:, 2:])/(Z[:, 2:] - Z[:, :-2])
+        weights = (Z[:, 2:] - Z[:, :-2])/2
+        # weights of the lapse rate at each level, by the vertical extent it represents
+
+        valid = np.arange(n_levels - 2) < (lengths - 2)[:, np.newaxis]
+        candidates = valid * (Gamma <= 2) * (Z2 >= 4000) * (Z2 <= 18000)
+
+        # cumulative sums along rows, with a leading zero, for sums over any range of levels
+        zero = np.zeros((n_rows, 1))
+        sum_weights = np.hstack([zero, np.cumsum(np.where(np.isnan(weights), 0, weights), axis = 1)])
+        sum_nan_weights = np.hstack([zero, np.cumsum(np.isnan(weights), axis = 1)])
+        Gamma_weights = Gamma*weights
+        sum_Gamma_weights = np.hstack([zero, np.cumsum(np.where(np.isnan(Gamma_weights), 0, Gamma_weights),
+                                                       axis = 1)])
+
+        running_max = np.maximum.accumulate(np.where(np.isnan(Z2) | ~valid, -np.inf, Z2), axis = 1)
+        # the first level at which Z2 reaches a height is the first at which its running maximum does
+
+        for row in np.nonzero(np.any(candidates, axis = 1))[0]:
+
+            index = np.nonzero(candidates[row])[0]
+            top = lengths[row] - 3
+            # the last valid level of Z2
+            target = Z2[row, index] + 2e3
+
+            no_level_above = Z2[row, top] < target
+            # if there is no point 2km above current, the highest available is taken and a flag is raised,
+            # for which the range of levels averaged over is empty and the candidate is accepted
+
+            index_2 = np.searchsorted(running_max[row, :top + 1], target)
+            # the index of the lowest point at least 2km above the current point
+            found = index_2 <= top
+            index_2 = np.minimum(index_2, top)
+
+            total_weight = sum_weights[row, index_2 + 1] - sum_weights[row, index]
+            nan_weight = sum_nan_weights[row, index_2 + 1] - sum_nan_weights[row, index]
+            average = (sum_Gamma_weights[row, index_2 + 1] - sum_Gamma_weights[row, index])/total_weight
+
+            accepted = no_level_above | (found & ((nan_weight > 0) | (average <= 2)))
+            # where any weight is nan, all normalised weights are nan and their nansum is zero
+
+            if np.any(accepted):
+                first = np.argmax(accepted)
+                trop_alt[row] = Z2[row, index[first]]
+                flags[row] = 1 if no_level_above[first] else flag
+
+    return trop_alt, flags
+
+
 
 def gradient(v1, v2, v3, c1, c2, c3):
     """
@@ -214,6 +675,11 @@ def array_gradient_axis1(var, coord):
     :param coord: array, corresponds to the second dimension of var
     :return: array of same shape as var of gradient in direction of coord
     """
+    reference = var
+    var = precision.to_float64(var)
+    coord = precision.to_float64(coord)
+    # differences are taken in float64, and the gradient returned in the precision of var
+
     # create empty array to populate with gradient values
     var_grad = np.zeros_like(var)
     # for endpoints use the two nearest points to calculate gradient
@@ -222,7 +688,7 @@ def array_gradient_axis1(var, coord):
     # in the middle calculate gradient using points either side
     var_grad[:,1:-1] = gradient(var[:,:-2], var[:,1:-1], var[:,2:], coord[:,:-2], coord[:, 1:-1], coord[:, 2:])
 
-    return var_grad
+    return precision.like(var_grad, reference)
 
 def Nsquared_from_thetagrad(theta, theta_grad, g = 9.80665):
     """
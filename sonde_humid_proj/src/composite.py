@@ -0,0 +1,291 @@
+"""
+Composite profiles of variables over stations and products, weighted by masks of conditions,
+without extracting the data selected by each mask into new cubes
+
+The data of each variable of each product of each station are saved as a .npy file (time x
+altitude, nan where there is no value) next to the 2D files, again whenever the 2D file is
+newer, and then read as a memory map. Masks are weights (time x altitude) between 0 and 1,
+so that fractional masks, such as that of low static stability layers, weight the points
+they partly cover. For each level, the weighted sums of the values, of their squares and a
+weighted histogram are accumulated over blocks of ascents, giving the weighted mean,
+variance, count and quantiles
+
+The quantiles are interpolated within the bins of the histogram, which span the range of
+each variable over all stations and products in n_bins equal bins, so each is within one
+bin width, (largest - smallest value)/n_bins, of the exact weighted quantile. This width is
+returned with the statistics as 'quantile_error'; a larger n_bins gives more exact quantiles
+at the cost of n_bins values held for each level of each mask
+
+Masks are specified by a dictionary, in the same way as the filters:
+    {'name' : 'all'}
+        every point with a value, with weight 1
+    {'name' : one of condition.CONDITIONS, 'value' : , 'invert' : , 'product' : , ...}
+        the mask of the condition from condition.station_mask, with any further keys passed
+        to it as parameters; if 'value' is given the weight is 1 where the mask equals it
+        (e.g. 'value' : -1 for troughs), and if 'invert' is True the weight is one minus the
+        mask. 'product' is the product whose cubelist defines the mask, by default the
+        product being composited (e.g. 'product' : 'sonde' to use the sonde ridges for all)
+    {'name' : 'weights', 'weights' : }
+        dictionary of arrays (time x altitude) of weights for each station code
+
+composite_batch evaluates many variables, products and masks together, reading each
+block of each array once for all masks
+"""
+from __future__ import division
+
+import os
+import warnings
+
+import iris
+import numpy as np
+
+from read_files import output_folder
+import condition
+
+_arrays = {}
+# memory maps of the station arrays already opened, by station, product and variable
+
+ALL_DIC = {'name' : 'all'}
+
+
+def array_filename(station_code, product, variable):
+    """
+    :param station_code: string, source and station number, e.g. 'EMN_03882'
+    :param product: key of re_grid.PRODUCTS, e.g. 'sonde'
+    :param variable: string, name of variable
+    :return: path of the .npy file of the data of the variable
+    """
+    source, station_number = station_code.split('_')
+    return os.path.join(output_folder(source, station_number), 'arrays', product + '_' + variable + '.npy')
+
+
+def save_array(filename, array):
+    """
+    :param filename: path of the .npy file
+    :param array: array to save, written to a temporary file first so that an interrupted
+                  run cannot leave a partial file
+    """
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.save(f, array)
+    os.rename(temporary, filename)
+
+
+def station_array(station_code, product, variable):
+    """
+    Data of a variable of one product of a station, written to a .npy file from the 2D file
+    the first time it is asked for, and again whenever the 2D file is newer
+    :param station_code: string, source and station number, e.g. 'EMN_03882'
+    :param product: key of re_grid.PRODUCTS, e.g. 'sonde'
+    :param variable: string, name of variable
+    :return: read-only memory map (time x altitude), nan where there is no value, and
+             array of the tropopause-relative altitudes
+    """
+    key = (station_code, product, variable)
+    source, station_number = station_code.split('_')
+    source_filename = os.path.join(output_folder(source, station_number), product + '_2D_trop_relative.nc')
+    filename = array_filename(station_code, product, variable)
+    altitude_filename = filename[:-4] + '_altitude.npy'
+
+    stale = not (os.path.exists(filename) and os.path.exists(altitude_filename) and
+                 os.path.getmtime(filename) >= os.path.getmtime(source_filename))
+    # the 2D file has been re-written since the .npy file was saved, e.g. by a new re-gridding
+    if stale:
+        cube = iris.load(source_filename, iris.Constraint(name = variable))[0]
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        save_array(altitude_filename, cube.coord(dimensions = 1).points)
+        save_array(filename, np.ma.filled(np.asanyarray(cube.data, dtype = float), np.nan))
+
+    if stale or key not in _arrays:
+        _arrays[key] = (np.load(filename, mmap_mode = 'r'), np.load(altitude_filename))
+    return _arrays[key]
+
+
+def clear_arrays():
+    """
+    Close the memory maps of all station arrays
+    """
+    _arrays.clear()
+
+
+def mask_weights(station_code, product, mask_dic):
+    """
+    :param station_code: string, source and station number, e.g. 'EMN_03882'
+    :param product: key of re_grid.PRODUCTS being composited
+    :param mask_dic: dictionary specifying the mask, see above
+    :return: array of weights (time x altitude), or None for the same weight everywhere
+    """
+    if mask_dic['name'] == 'all':
+        return None
+
+    if mask_dic['name'] == 'weights':
+        return np.asarray(mask_dic['weights'][station_code], dtype = float)
+
+    parameters = dict((key, value) for key, value in mask_dic.items()
+                      if key not in ['name', 'value', 'invert', 'product'])
+    mask = condition.station_mask(station_code, mask_dic.get('product', product), mask_dic['name'],
+                                  **parameters)
+    weights = np.ma.filled(np.asanyarray(mask.data, dtype = float), 0.)
+    if 'value' in mask_dic:
+        weights = (weights == mask_dic['value']).astype(float)
+    if mask_dic.get('invert'):
+        weights = 1. - weights
+    return weights
+
+
+def value_range(variable, station_codes, products):
+    """
+    :return: the smallest and largest values of the variable over all stations and products
+    """
+    lowest, highest = np.inf, -np.inf
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # arrays with no values give nan
+        for product in products:
+            for station_code in station_codes:
+                data = station_array(station_code, product, variable)[0]
+                lowest = np.nanmin([lowest, np.nanmin(data)])
+                highest = np.nanmax([highest, np.nanmax(data)])
+    if not lowest < highest:
+        highest = lowest + 1.
+        # all values the same, or none
+    return lowest, highest
+
+
+def new_sums(n_levels, n_bins):
+    """
+    :return: dictionary of zero arrays in which to accumulate the weighted sums of each level
+    """
+    return {'weight': np.zeros(n_levels), 'weighted_sum': np.zeros(n_levels),
+            'weighted_square_sum': np.zeros(n_levels), 'count': np.zeros(n_levels, dtype = int),
+            'histogram': np.zeros(n_levels*n_bins)}
+
+
+def accumulate(sums, data, valid, weights, bin_index, n_bins):
+    """
+    Add a block of ascents to the weighted sums
+    :param sums: dictionary from new_sums
+    :param data: array (time x altitude) of values, zero where not valid
+    :param valid: boolean array (time x altitude), True where there is a value
+    :param weights: array (time x altitude) of weights, or None for weight 1
+    :param bin_index: array (time x altitude) of the index of the histogram bin of each value
+                      over all levels, (level * n_bins + bin)
+    :param n_bins: number of histogram bins of each level
+    """
+    if weights is None:
+        weights = valid.astype(float)
+    else:
+        weights = np.where(valid, weights, 0.)
+
+    sums['weight'] += weights.sum(axis = 0)
+    sums['weighted_sum'] += (weights*data).sum(axis = 0)
+    sums['weighted_square_sum'] += (weights*data*data).sum(axis = 0)
+    sums['count'] += (weights > 0).sum(axis = 0)
+
+    selected = weights > 0
+    sums['histogram'] += np.bincount(bin_index[selected], weights = weights[selected],
+                                     minlength = len(sums['histogram']))
+
+
+def statistics(sums, edges, quantiles):
+    """
+    :param sums: dictionary of accumulated sums from accumulate
+    :param edges: array of the edges of the histogram bins
+    :param quantiles: list of quantiles, between 0 and 1
+    :return: dictionary of arrays (altitude) of the weighted 'mean', 'variance', 'count' of
+             points of non-zero weight and total 'weight', array (quantile x altitude) of the
+             'quantiles', interpolated within the bins of the weighted histogram, and the
+             'quantile_error', the width of the bins, which the quantiles are within
+    """
+    n_bins = len(edges) - 1
+    weight = sums['weight']
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = sums['weighted_sum']/weight
+        variance = np.maximum(sums['weighted_square_sum']/weight - mean**2, 0.)
+
+        histogram = sums['histogram'].reshape(-1, n_bins)
+        cumulative = np.cumsum(histogram, axis = 1)/weight[:, np.newaxis]
+
+        quantile_profiles = []
+        for quantile in quantiles:
+            bins = np.argmax(cumulative >= quantile - 1e-12, axis = 1)
+            # first bin of each level in which the cumulative weight reaches the quantile
+            below = np.where(bins > 0, cumulative[np.arange(len(bins)), bins - 1], 0.)
+            fraction = (quantile - below)/(cumulative[np.arange(len(bins)), bins] - below)
+            quantile_profiles.append(np.where(weight > 0, edges[bins] + np.clip(fraction, 0., 1.)*
+                                              (edges[bins + 1] - edges[bins]), np.nan))
+
+    return {'mean': mean, 'variance': variance, 'count': sums['count'], 'weight': weight,
+            'quantiles': np.array(quantile_profiles), 'quantile_error': edges[1] - edges[0]}
+
+
+def composite_batch(variables, station_codes, products, mask_dics = (ALL_DIC,),
+                    quantiles = (0.1, 0.5, 0.9), n_bins = 200, block_size = 256):
+    """
+    Composite profiles of every combination of variable, product and mask over the stations
+    :param variables: list of names of variables
+    :param station_codes: list of strings, source and station number, e.g. 'EMN_03882'
+    :param products: list of keys of re_grid.PRODUCTS
+    :param mask_dics: list of dictionaries specifying masks, see above
+    :param quantiles: list of quantiles, between 0 and 1
+    :param n_bins: number of histogram bins, spanning the range of each variable, from which
+                   the quantiles are found, to within the width of one bin, see above
+    :param block_size: number of ascents read from each memory map at once
+    :return: dictionary with keys (variable, product, index of mask in mask_dics) of the
+             dictionaries of statistics from statistics, with the tropopause-relative 'altitude'
+    """
+    results = {}
+
+    for variable in variables:
+        lowest, highest = value_range(variable, station_codes, products)
+        edges = np.linspace(lowest, highest, n_bins + 1)
+
+        for product in products:
+            sums = None
+            altitude = None
+
+            for station_code in station_codes:
+                data, station_altitude = station_array(station_code, product, variable)
+                if altitude is None:
+                    altitude = station_altitude
+                    sums = [new_sums(len(altitude), n_bins) for mask_dic in mask_dics]
+                elif not np.array_equal(altitude, station_altitude):
+                    raise ValueError(station_code + ' ' + product + ' is not on the same grid as '
+                                     + station_codes[0])
+
+                weights = [mask_weights(station_code, product, mask_dic) for mask_dic in mask_dics]
+                for n, mask_weight in enumerate(weights):
+                    if mask_weight is not None and mask_weight.shape != data.shape:
+                        raise ValueError('mask ' + str(n) + ' of ' + station_code + ' does not have the shape '
+                                         'of ' + product + ' ' + variable)
+
+                levels = np.arange(data.shape[1])*n_bins
+                for start in range(0, data.shape[0], block_size):
+                    block = np.asarray(data[start:start + block_size])
+                    # the only part of the array read into memory, shared by all masks
+                    valid = ~np.isnan(block)
+                    block = np.where(valid, block, 0.)
+                    bin_index = levels + np.clip(np.searchsorted(edges, block, 'right') - 1, 0, n_bins - 1)
+
+                    for mask_sums, mask_weight in zip(sums, weights):
+                        accumulate(mask_sums, block, valid,
+                                   None if mask_weight is None else mask_weight[start:start + block_size],
+                                   bin_index, n_bins)
+
+            for n, mask_sums in enumerate(sums):
+                results[(variable, product, n)] = statistics(mask_sums, edges, quantiles)
+                results[(variable, product, n)]['altitude'] = altitude
+
+    return results
+
+
+def composite(variable, station_codes, products, mask_dic = ALL_DIC, quantiles = (0.1, 0.5, 0.9),
+              n_bins = 200):
+    """
+    Composite profiles of one variable with one mask, see composite_batch
+    :return: dictionary with the product as keys of the dictionaries of statistics
+    """
+    results = composite_batch([variable], station_codes, products, [mask_dic], quantiles, n_bins)
+    return dict((product, results[(variable, product, 0)]) for product in products)
@@ -3,9 +3,16 @@ File to take dictionaries of cubelists across all time and concatenate them
 into one big dictionary of all data from a given single site in Sept/Oct 2016
 """
 import datetime
-import iris
-from re_grid import re_grid_trop_0
+import os
+from re_grid import re_grid_trop_0, GRID_DIC
 from process_data import add_gradient_fields
+import instrument
+import ragged as ragged_module
+import precision
+import write_files
+import summary
+from thread_pool import FILE_LOCK, shutdown_pools
+from read_files import output_folder
 import time
 import numpy as np
 
@@ -14,6 +21,15 @@ import numpy as np
 # these are fixes for merging and concatenation, but should not be needed if
 # cubes are prepared properly from reading in
 
+def file_list_folder():
+    """
+    Define the folder containing the lists of sonde files for each station, which can be
+    changed from the default by setting the environment variable NAWDEX_FILE_LISTS
+    :return: folder path, ending in '/'
+    """
+    return os.path.join(os.environ.get('NAWDEX_FILE_LISTS', '../File_lists/'), '')
+
+
 def create_datetime_list(source, station_number):
     """
     Create lists of datetime objects corresponding to the times of radiosonde launches
@@ -24,7 +40,7 @@ def create_datetime_list(source, station_number):
     :return: list of datetime objects corresponding to times of radiosonde 
              released for a given particular location
     """
-    with open('../File_lists/' + source + '_' + station_number + '_list.txt', 'r') as myfile:
+    with open(file_list_folder() + source + '_' + station_number + '_list.txt', 'r') as myfile:
         file_list = myfile.readlines()
     # create list of names of files for radiosonde data for herstmonceux
 
@@ -58,7 +74,8 @@ def create_datetime_list(source, station_number):
 
 
 def concatenate_cubelist_dictionary(source, station_number, filter_dic = {'name' : 'kernel', 
-                   'gaussian_half_width' : 50, 'window_half_width' : 200}, kind = 'linear'):
+                   'gaussian_half_width' : 50, 'window_half_width' : 200}, kind = 'linear',
+                   grid_dic = GRID_DIC, ragged = False):
     """
     Concatenate sondes from same location at different times into single object
     :param source: Code representing origin of data, options for which are: 
@@ -67,6 +84,8 @@ def concatenate_cubelist_dictionary(source, station_number, filter_dic = {'name'
                            sonde was released
     :param filter_dic: dictionary specifying filter name and necessary parameters
     :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see re_grid.grid_levels
+    :param ragged: if True, save ragged .npz files rather than netCDF, see save_station
     :return: dictionary of cubelists for the sonde, ukmo analysis and 1, 3 and 5 
              day forecasts, and ECMWF analyses, where cubes in cubelist have 
              dimensions of altitude and time
@@ -77,15 +96,20 @@ def concatenate_cubelist_dictionary(source, station_number, filter_dic = {'name'
     if not datetime_list:
         return source + '_' + station_number + ' ascents not found'
 
+    instrument.set_context(station = source + '_' + station_number)
+
     # for the first time, create first cubelist_dic
+    instrument.set_context(ascent = datetime_list[0].strftime('%Y%m%d_%H%M'))
     cubelist_dictionary = re_grid_trop_0(source, station_number, datetime_list[0], 
-                                                              filter_dic, kind)
+                                                              filter_dic, kind, grid_dic = grid_dic)
 
     # for the rest of the times
     for time in datetime_list[1:]:
 
         # create new cubelist_dic
-        new_cubelist_dic = re_grid_trop_0(source, station_number, time, filter_dic, kind)
+        instrument.set_context(ascent = time.strftime('%Y%m%d_%H%M'))
+        new_cubelist_dic = re_grid_trop_0(source, station_number, time, filter_dic, kind,
+                                          grid_dic = grid_dic)
         
         if new_cubelist_dic:
             # it will return False if there is no found tropopause
@@ -95,7 +119,38 @@ def concatenate_cubelist_dictionary(source, station_number, filter_dic = {'name'
                 # extend each cubelist in first dictionary by new one
                 cubelist_dictionary[key].extend(new_cubelist_dic[key])
 
+    instrument.clear_context('ascent')
+
+    save_station(source, station_number, cubelist_dictionary, ragged = ragged)
+
+    instrument.clear_context()
+
+    #return twoD_cubelist_dictionary
+    # but don't actually return if it has actually saved
+
+
+
+def save_station(source, station_number, cubelist_dictionary, merged = False, ragged = False,
+                 encoding_dic = None):
+    """
+    Merge the re-gridded cubelists of all ascents from a station along time, add
+    gradient fields and save one file for each product
+    :param source: Code representing origin of data, options for which are: 
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: 4-6 digit identifier of particular station from which 
+                           sonde was released
+    :param cubelist_dictionary: dictionary of cubelists containing the 1D cubes of all ascents
+    :param merged: if True, cubelist_dictionary already contains 2D cubes (e.g. from
+                   transport.assemble_station) and is not merged again
+    :param ragged: if True, save each product as a ragged .npz file (see ragged.save_cubelist),
+                   storing only the valid span of each profile, rather than as netCDF
+    :param encoding_dic: dictionary specifying the compression and chunking of the netCDF files,
+                         see write_files, by default that set by write_files.set_encoding
+    :return: dictionary of 2D cubelists which have been saved, with a table of the
+             scalar quantities of each ascent (see summary) saved alongside them
+    """
     twoD_cubelist_dictionary = {}
+    station = source + '_' + station_number
 
     # for each key in dictionary:
     for key in cubelist_dictionary:
@@ -103,24 +158,86 @@ def concatenate_cubelist_dictionary(source, station_number, filter_dic = {'name'
         # have been done prior in the re-gridding stage
         
         # concatenate cubelist along time dimension
-        twoD_cubelist_dictionary[key] = cubelist_dictionary[key].merge()
+        if merged:
+            twoD_cubelist_dictionary[key] = cubelist_dictionary[key]
+        else:
+            with instrument.stage('merge', product = key, station = station) as record:
+                twoD_cubelist_dictionary[key] = cubelist_dictionary[key].merge()
+                if instrument.is_enabled():
+                    record.update(instrument.cubelist_sizes(twoD_cubelist_dictionary[key]))
         # actually either need to use merge, or add new time dimension coord
         #assert len(twoD_cubelist_dictionary[key]) == len(new_cubelist_dic[key])
         
         # add gradient fields to cube list
-        twoD_cubelist_dictionary[key] = add_gradient_fields(twoD_cubelist_dictionary[key])
+        with instrument.stage('add_gradient_fields', product = key, station = station) as record:
+            twoD_cubelist_dictionary[key] = add_gradient_fields(twoD_cubelist_dictionary[key])
+            if instrument.is_enabled():
+                record.update(instrument.cubelist_sizes(twoD_cubelist_dictionary[key]))
 
-        save_folder = '/home/users/bn826011/PhD/radiosonde/NAWDEX_timeseries/high_res/' + source + '_' + station_number
+        save_folder = output_folder(source, station_number)
         # where do I actually have space to save one of these for each site???
+        if not os.path.isdir(save_folder):
+            os.makedirs(save_folder)
 
-        iris.save(twoD_cubelist_dictionary[key], save_folder + '/' + key + '_2D_trop_relative.nc')
+        if ragged:
+            with instrument.stage('ragged.save_cubelist', product = key, station = station) as record:
+                ragged_module.save_cubelist(twoD_cubelist_dictionary[key],
+                                            save_folder + '/' + key + '_2D_trop_relative.npz')
+                if instrument.is_enabled():
+                    record.update(instrument.file_sizes(save_folder + '/' + key + '_2D_trop_relative.npz'))
+            continue
 
-    #return twoD_cubelist_dictionary
-    # but don't actually return if it has actually saved
+        with instrument.stage('write_files.save_cubelist', product = key, station = station) as record:
+            with FILE_LOCK:
+                # as files may be read by another thread at the same time, see pipeline
+                write_files.save_cubelist(twoD_cubelist_dictionary[key],
+                                          save_folder + '/' + key + '_2D_trop_relative.nc', encoding_dic)
+            if instrument.is_enabled():
+                record.update(instrument.file_sizes(save_folder + '/' + key + '_2D_trop_relative.nc'))
+
+    with instrument.stage('summary.save_summary', station = station):
+        summary.save_summary(summary.station_summary(source, station_number, twoD_cubelist_dictionary,
+                                                     create_datetime_list(source, station_number)),
+                             os.path.join(output_folder(source, station_number), summary.SUMMARY_FILENAME))
+        # the release times are those of the file list, from which the ascents were read
 
+    return twoD_cubelist_dictionary
 
 
-def main_run_this():
+def main_run_this(metrics_file = None, pipelined = False, scratch = None,
+                  scratch_bytes = None, processes = None, batch = False, float_precision = 'float64',
+                  encoding_dic = None, stations = None, ragged = False):
+    """
+    Concatenate all stations with 2 second resolution sondes
+    :param metrics_file: JSON lines file to which the timings and sizes of each stage
+                         are appended, if None these are not recorded
+    :param pipelined: if True, read the files of the next ascents and save the previous
+                      station while processing, using pipeline.run_pipeline, which re-grids
+                      the ascents one at a time, so cannot be combined with processes or batch
+    :param scratch: local folder to which the input files are staged before processing,
+                    using staging.staged, if None they are read from the data root
+    :param scratch_bytes: maximum size of the scratch folder in bytes, or None for no limit
+    :param processes: if given, the number of worker processes re-gridding the ascents of
+                      each station, using transport.process_station_parallel
+    :param batch: if True, process all ascents of each station at once as 2D arrays,
+                  using station_batch.batch_station
+    :param float_precision: 'float64', or 'float32' to hold and save the data in float32,
+                            see precision.set_precision
+    :param encoding_dic: dictionary specifying the compression and chunking of the saved files,
+                         see write_files, e.g. write_files.COMPRESSED_DIC; if None the
+                         files are saved as by iris.save
+    :param stations: list of [source, station_number] pairs to process, by default all
+                     stations with 2 second resolution sondes
+    :param ragged: if True, save each product as a ragged .npz file rather than netCDF,
+                   see save_station
+    """
+    if pipelined and (processes or batch):
+        raise ValueError('pipelined processing cannot be combined with processes or batch')
+
+    if metrics_file:
+        instrument.enable()
+    precision.set_precision(float_precision)
+    write_files.set_encoding(encoding_dic or write_files.ENCODING_DIC)
     
     two_sec = [['EMN', '02365'], ['EMN', '02527'], 
         ['EMN', '03005'], ['EMN', '03238'], ['EMN', '03354'], ['EMN', '03808'],
@@ -131,14 +248,60 @@ def main_run_this():
         ['EMN', '10771'], ['EMN', '10868'], 
         ['DLR', '04018'], ['IMO', '04018'], ['NCAS', '03501']]
 
-    for pair in two_sec:
+    stations = stations or two_sec
+
+    try:
+        if scratch:
+            import staging
+            # imported here as staging itself imports from this file
+            for pair in stations:
+                # one station at a time, such that the scratch folder holds no more than scratch_bytes
+                with staging.staged(pair, scratch, max_bytes = scratch_bytes):
+                    run_stations([pair], metrics_file, pipelined, processes, batch, ragged)
+        else:
+            run_stations(stations, metrics_file, pipelined, processes, batch, ragged)
+    finally:
+        shutdown_pools()
+
+
+def run_stations(stations, metrics_file = None, pipelined = False, processes = None, batch = False,
+                 ragged = False):
+    """
+    Concatenate each station in turn, see main_run_this
+    :param stations: list of [source, station_number] pairs
+    """
+    if pipelined:
+        from pipeline import run_pipeline
+        # imported here as pipeline itself imports from this file
+        run_pipeline(stations, ragged = ragged)
+        if metrics_file:
+            instrument.write_records(metrics_file)
+            print instrument.summary_table()
+            instrument.reset()
+        return
+
+    for pair in stations:
         print pair
         startime = time.time()
         try:
-            concatenate_cubelist_dictionary(pair[0], pair[1])
+            if batch:
+                import station_batch
+                # imported here as station_batch itself imports from this file
+                station_batch.batch_station(pair[0], pair[1], ragged = ragged)
+            elif processes:
+                import transport
+                # imported here as transport itself imports from this file
+                transport.process_station_parallel(pair[0], pair[1], processes, ragged = ragged)
+            else:
+                concatenate_cubelist_dictionary(pair[0], pair[1], ragged = ragged)
         except Exception as e:
             print pair[0] + ' ' + pair[1] + ' concatenation has failed'
             print e
         endtime = time.time()
         elapsed = (endtime - startime)/60
-        print pair[1] + ' file has taken ' + str(elapsed) + ' minutes'
\ No newline at end of file
+        print pair[1] + ' file has taken ' + str(elapsed) + ' minutes'
+
+        if metrics_file:
+            instrument.write_records(metrics_file)
+            print instrument.summary_table(group_by = ('stage',))
+            instrument.reset()
\ No newline at end of file
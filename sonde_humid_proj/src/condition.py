@@ -8,9 +8,14 @@ import iris
 iris.FUTURE.cell_datetime_objects=True
 import numpy as np
 
+import os
 import pickle
 import datetime
 
+import calculate
+from make_cubes import cube_like
+from read_files import output_folder
+
 
 def low_static_stability_dictionary():
     """
@@ -81,16 +86,195 @@ def LSL_condition(LSL_dictionary, cubelist, SS_Lim = 2):
     return is_LSL
 
 
-def ridge_trough_condition(cubelist, trop_reference_height):
-    # need to first consider exactly how given the reference height we will define what is in a trough, and what is in a ridge
-    # thought also required r.e. edges & transitions
-    pass
+def station_cube(cubelist, name):
+    """
+    :param cubelist: a 2D cubelist
+    :param name: string, name of a cube with one value for each time, or of a coordinate
+                 of the altitude cube if there is no such cube
+    :return: array of one value for each time
+    """
+    altitude = cubelist.extract(iris.Constraint(name = 'altitude'))[0]
+    cubes = cubelist.extract(iris.Constraint(name = name))
+    if cubes and cubes[0].ndim <= 1:
+        values = np.ma.filled(np.asanyarray(cubes[0].data, dtype = float), np.nan)
+    else:
+        values = np.asarray(altitude.coord(name).points, dtype = float)
+    return np.broadcast_to(values, altitude.shape[:1])
+
+
+def station_position(cubelist):
+    """
+    :param cubelist: a 2D cubelist
+    :return: arrays of the latitude and of the longitude of the station for each time, from the
+             stationLatitude and stationLongitude attributes of the sonde, or from the latitude
+             and longitude cubes of a model product, which have one value for each time
+    """
+    altitude = cubelist.extract(iris.Constraint(name = 'altitude'))[0]
+    position = []
+    for name, attribute in [('latitude', 'stationLatitude'), ('longitude', 'stationLongitude')]:
+        cubes = [cube for cube in cubelist.extract(iris.Constraint(name = name))
+                 if cube.ndim <= 1 and cube.shape in [(), altitude.shape[:1]]]
+        # the latitude and longitude cubes of the sonde are profiles of its displacement, not the station
+        if attribute in altitude.attributes:
+            values = float(altitude.attributes[attribute])
+        elif cubes:
+            values = np.ma.filled(np.asanyarray(cubes[0].data, dtype = float), np.nan)
+        else:
+            raise ValueError('cubelist has neither the ' + attribute + ' attribute nor a ' + name +
+                             ' cube with one value for each time')
+        position.append(np.broadcast_to(values, altitude.shape[:1]))
+    return position
+
+
+def mask_cube(cubelist, data, name, long_name):
+    """
+    :param cubelist: a 2D cubelist
+    :param data: array of the mask, (time x altitude) or (time), which is repeated at all altitudes
+    :param name: string, name of the mask
+    :param long_name: string, description of the mask
+    :return: cube of the mask on the time & altitude coordinates of the altitude cube
+    """
+    altitude = cubelist.extract(iris.Constraint(name = 'altitude'))[0]
+    if data.ndim == 1:
+        data = np.repeat(data[:, np.newaxis], altitude.shape[1], axis = 1)
+    mask = cube_like(altitude, data)
+    mask.rename(name)
+    mask.long_name = long_name
+    mask.units = '1'
+    return mask
+
+
+def ridge_trough_condition(cubelist, trop_reference_height = None, threshold = 500.):
+    """
+    Create mask of whether each ascent is in a ridge or trough, by comparison of its
+    tropopause altitude with the mean tropopause altitude at the station
+    :param cubelist: a 2D cubelist, containing altitude and tropopause altitude
+    :param trop_reference_height: number, reference tropopause altitude in m, if None the
+                                  ERA-Interim climatological mean at the station position
+                                  (see station_position) is used
+    :param threshold: number, distance in m the tropopause must be above (ridge) or below
+                      (trough) the reference, such that transitions are neither
+    :return: cube (time x altitude), 1 in a ridge, -1 in a trough, 0 otherwise
+    """
+    if trop_reference_height is None:
+        from ERA_climatology import find_mean_trop_GPH
+        # imported here as it loads matplotlib
+        latitude, longitude = station_position(cubelist)
+        trop_reference_height = calculate.altitude_from_GPH(find_mean_trop_GPH(np.nanmean(latitude),
+                                                                              np.nanmean(longitude)))
+
+    difference = station_cube(cubelist, 'tropopause_altitude') - trop_reference_height
+    with np.errstate(invalid = 'ignore'):
+        ridge_trough = (difference > threshold).astype(float) - (difference < -threshold)
+
+    return mask_cube(cubelist, ridge_trough, 'mask_for_ridge_or_trough',
+                     'ridge_(1)_or_trough_(-1)_by_tropopause_altitude_compared_to_reference')
+
 
+def solar_elevation(times, latitude, longitude):
+    """
+    Solar elevation, from the declination and equation of time of Spencer (1971)
+    :param times: array of times in hours since 1970-01-01 00:00:00 (UTC)
+    :param latitude: array of latitudes, degrees
+    :param longitude: array of longitudes, degrees east
+    :return: array of solar elevation, degrees
+    """
+    times = np.asarray(times, dtype = float)
+    seconds = np.round(times*3600).astype('timedelta64[s]')
+    date_time = np.datetime64('1970-01-01T00:00:00') + seconds
+    day_of_year = (date_time.astype('datetime64[D]') - date_time.astype('datetime64[Y]')).astype(float)
+    hour = np.mod(times, 24)
+
+    gamma = 2*np.pi/365*(day_of_year + (hour - 12)/24)
+    # fractional year, radians
+    declination = (0.006918 - 0.399912*np.cos(gamma) + 0.070257*np.sin(gamma)
+                   - 0.006758*np.cos(2*gamma) + 0.000907*np.sin(2*gamma)
+                   - 0.002697*np.cos(3*gamma) + 0.00148*np.sin(3*gamma))
+    equation_of_time = 229.18*(0.000075 + 0.001868*np.cos(gamma) - 0.032077*np.sin(gamma)
+                               - 0.014615*np.cos(2*gamma) - 0.040849*np.sin(2*gamma))
+    # minutes
+
+    hour_angle = np.radians(15*(hour + equation_of_time/60 + np.asarray(longitude)/15 - 12))
+    latitude = np.radians(latitude)
+
+    return np.degrees(np.arcsin(np.sin(latitude)*np.sin(declination) +
+                                np.cos(latitude)*np.cos(declination)*np.cos(hour_angle)))
+
+
+def day_night_condition(cubelist, elevation_limit = 0.):
+    """
+    Create mask of whether each ascent was released during the day
+    :param cubelist: a 2D cubelist, containing altitude and the station position (see
+                     station_position), and for the sonde the release time as a cube named
+                     'time' (otherwise the time coordinate, the rounded verification time, is used)
+    :param elevation_limit: number, solar elevation in degrees above which it is day
+    :return: cube (time x altitude), 1 for day and 0 for night
+    """
+    latitude, longitude = station_position(cubelist)
+    elevation = solar_elevation(station_cube(cubelist, 'time'), latitude, longitude)
+
+    return mask_cube(cubelist, (elevation > elevation_limit).astype(float), 'mask_for_day',
+                     'day_(1)_or_night_(0)_by_solar_elevation_at_release')
+
+
+def cloud_condition(cubelist, rhi_threshold = 1., cloud_water_threshold = 1e-6):
+    """
+    Create mask of whether each point is in cloud, where the air is saturated with respect
+    to ice, or (for the models) the cloud ice and liquid water content is large enough
+    :param cubelist: a 2D cubelist, containing relative humidity with respect to ice
+    :param rhi_threshold: number, relative humidity with respect to ice, as a fraction,
+                          at and above which there is cloud
+    :param cloud_water_threshold: number, mass fraction of cloud ice and liquid water in kg/kg
+                                  at and above which there is cloud
+    :return: cube (time x altitude), 1 in cloud, 0 otherwise (including where there is no data)
+    """
+    rhi = cubelist.extract(iris.Constraint(name = 'relative_humidity_ice'))[0]
+    with np.errstate(invalid = 'ignore'):
+        cloud = np.ma.filled(np.asanyarray(rhi.data, dtype = float), np.nan) >= rhi_threshold
+
+        cloud_water = [np.ma.filled(np.asanyarray(cube.data, dtype = float), 0.) for cube in cubelist
+                       if cube.name() in ['mass_fraction_of_cloud_ice_in_air',
+                                          'mass_fraction_of_cloud_liquid_water_in_air']]
+        if cloud_water:
+            cloud |= np.nan_to_num(sum(cloud_water)) >= cloud_water_threshold
+
+    return mask_cube(cubelist, cloud.astype(float), 'mask_for_cloud',
+                     'cloud_(1)_by_ice_saturation_or_cloud_water_content')
+
+
+CONDITIONS = {'ridge_trough': ridge_trough_condition, 'day_night': day_night_condition,
+              'cloud': cloud_condition}
 
-def day_night_condition(cubelist):
-    pass
+_masks = {}
+# masks already calculated, by station, product, condition and parameters
 
 
-def cloud_condition(cubelist):
-    # much thought needed into how to decide what is a cloud
-    pass
+def station_mask(station_code, product, name, cubelist = None, **kwargs):
+    """
+    Mask of a condition for the 2D cubelist of one product of a station, calculated only
+    the first time it is asked for with the same parameters
+    :param station_code: string, source and station number, e.g. 'EMN_03882'
+    :param product: key of re_grid.PRODUCTS, e.g. 'sonde'
+    :param name: string, condition, one of the keys of CONDITIONS
+    :param cubelist: the 2D cubelist of the product, if None it is read from the saved file
+    :param kwargs: keyword arguments of the parameters of the condition
+    :return: cube of the mask
+    """
+    key = (station_code, product, name, tuple(sorted(kwargs.items())))
+    if key not in _masks:
+        if cubelist is None:
+            source, station_number = station_code.split('_')
+            cubelist = iris.load(os.path.join(output_folder(source, station_number),
+                                              product + '_2D_trop_relative.nc'))
+        _masks[key] = CONDITIONS[name](cubelist, **kwargs)
+    return _masks[key]
+
+
+def clear_masks(station_code = None):
+    """
+    Remove cached masks
+    :param station_code: string, if given only the masks of this station are removed
+    """
+    for key in list(_masks):
+        if station_code is None or key[0] == station_code:
+            del _masks[key]
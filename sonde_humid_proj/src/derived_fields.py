@@ -0,0 +1,115 @@
+"""
+Registry of the variables which can be derived from others by make_cubes, and a resolver
+which calculates only the variables asked for
+
+Each entry of DERIVED_FIELDS is a dictionary of:
+    'inputs':  list of the names of the variables from which it is calculated
+    'compute': function taking a CubeList of the inputs and returning the cube of the variable
+
+The same variable may be derivable in more than one direction (e.g. temperature from
+potential temperature or potential temperature from temperature); whichever variables a
+cubelist already has are used, so the sources differ only in what they start with
+"""
+import iris
+
+import make_cubes
+
+
+def relative_humidity(state):
+    """
+    :param state: state to calculate saturation vapour pressure with respect to
+    :return: function taking a cubelist and returning the cube of relative humidity
+    """
+    return lambda cubelist: make_cubes.relative_humidity_cube(cubelist, state)
+
+
+DERIVED_FIELDS = {'air_temperature' :
+                      {'inputs' : ['air_potential_temperature', 'air_pressure'],
+                       'compute' : make_cubes.temperature_cube},
+                  'air_potential_temperature' :
+                      {'inputs' : ['air_temperature', 'air_pressure'],
+                       'compute' : make_cubes.theta_cube},
+                  'specific_humidity' :
+                      {'inputs' : ['dew_point_temperature', 'air_temperature', 'air_pressure'],
+                       'compute' : make_cubes.specific_humidity_cube},
+                  'relative_humidity_liquid_water' :
+                      {'inputs' : ['specific_humidity', 'air_pressure', 'air_temperature'],
+                       'compute' : relative_humidity('liquid_water')},
+                  'relative_humidity_ice' :
+                      {'inputs' : ['specific_humidity', 'air_pressure', 'air_temperature'],
+                       'compute' : relative_humidity('ice')},
+                  'relative_humidity' :
+                      {'inputs' : ['specific_humidity', 'air_pressure', 'air_temperature'],
+                       'compute' : relative_humidity('mixed')},
+                  'potential_temperature_vertical_gradient' :
+                      {'inputs' : ['air_potential_temperature', 'altitude'],
+                       'compute' : make_cubes.theta_gradient_cube},
+                  'square_of_brunt_vaisala_frequency_in_air' :
+                      {'inputs' : ['potential_temperature_vertical_gradient', 'air_potential_temperature',
+                                   'altitude'],
+                       'compute' : make_cubes.Brunt_Vaisala_square_cube},
+                  'specific_humidity_vertical_gradient' :
+                      {'inputs' : ['specific_humidity', 'altitude'],
+                       'compute' : make_cubes.q_gradient_cube},
+                  'fractional_specific_humidity_gradient' :
+                      {'inputs' : ['specific_humidity_vertical_gradient', 'specific_humidity'],
+                       'compute' : make_cubes.fractional_humidity_gradient_measure_cube}}
+
+HUMIDITY_FIELDS = ['air_temperature', 'air_potential_temperature', 'specific_humidity',
+                   'relative_humidity_liquid_water', 'relative_humidity_ice', 'relative_humidity']
+# fields of every profile before re-gridding, in the order they have always been added
+
+GRADIENT_FIELDS = ['potential_temperature_vertical_gradient', 'square_of_brunt_vaisala_frequency_in_air',
+                   'specific_humidity_vertical_gradient', 'fractional_specific_humidity_gradient']
+# fields calculated from the 2D cubes of a station
+
+
+def resolve(names, available):
+    """
+    Find the variables to calculate to obtain those asked for
+    :param names: list of names of variables wanted
+    :param available: collection of names of variables already present
+    :return: list of names of variables to calculate, in an order in which the inputs of
+             each are present or calculated before it, each appearing once
+    """
+    available = set(available)
+    order = []
+
+    def visit(name, resolving):
+        if name in available:
+            return
+        if name not in DERIVED_FIELDS:
+            raise ValueError(name + ' is not present and cannot be derived')
+        if name in resolving:
+            raise ValueError(name + ' cannot be derived from the variables present')
+        for input_name in DERIVED_FIELDS[name]['inputs']:
+            visit(input_name, resolving + [name])
+        available.add(name)
+        order.append(name)
+
+    for name in names:
+        visit(name, [])
+
+    return order
+
+
+def add_derived_fields(cubelist, names):
+    """
+    Calculate the variables asked for which are not already in the cubelist, and any
+    variables they require, and add them to it
+    :param cubelist: CubeList
+    :param names: list of names of variables wanted
+    :return: the cubelist, extended by the calculated variables in the order they were calculated
+    """
+    cubes = {}
+    for cube in cubelist:
+        cubes.setdefault(cube.name(), cube)
+        # the first cube of each name, as cubelist.extract(...)[0]
+
+    for name in resolve(names, cubes):
+        inputs = iris.cube.CubeList([cubes[input_name] for input_name in DERIVED_FIELDS[name]['inputs']])
+        cube = DERIVED_FIELDS[name]['compute'](inputs)
+        cubes[name] = cube
+        cubelist.append(cube)
+
+    return cubelist
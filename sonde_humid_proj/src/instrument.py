@@ -0,0 +1,203 @@
+"""
+Collection of functions to record the wall time, number of calls, bytes read and
+array sizes of each stage of the processing pipeline, per ascent and per station
+
+Records are only kept once 'enable' has been called, so that the pipeline runs as
+before otherwise. They can be written to a JSON lines file and summarised in a table
+"""
+from __future__ import division
+
+import glob
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+_state = {'enabled': False, 'records': [], 'context': {}}
+
+
+def enable(enabled = True):
+    """
+    Switch recording of stages on or off
+    :param enabled: boolean, whether stages should be recorded
+    """
+    _state['enabled'] = enabled
+
+
+def is_enabled():
+    """
+    :return: True if stages are currently being recorded
+    """
+    return _state['enabled']
+
+
+def reset():
+    """
+    Remove all records and context labels
+    """
+    _state['records'] = []
+    _state['context'] = {}
+
+
+def set_context(**labels):
+    """
+    Set labels, such as station or ascent, to be attached to all following records
+    :param labels: keyword arguments of label names and values
+    """
+    _state['context'].update(labels)
+
+
+def clear_context(*names):
+    """
+    Remove labels previously set with set_context
+    :param names: names of labels to remove, if none are given all labels are removed
+    """
+    if not names:
+        _state['context'] = {}
+    for name in names:
+        _state['context'].pop(name, None)
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Context manager timing the code within it as a single call of a stage of the pipeline
+    Further values, such as sizes, can be added to the yielded dictionary
+    :param name: string, name of the stage, e.g. 'read_data'
+    :param labels: keyword arguments of labels for this record only, e.g. product = 'UKMO'
+    :return: dictionary which will be stored as the record of this call
+    """
+    if not _state['enabled']:
+        yield {}
+        return
+
+    record = {'stage': name}
+    record.update(_state['context'])
+    record.update(labels)
+
+    start = time.time()
+    try:
+        yield record
+    finally:
+        record['wall_time'] = time.time() - start
+        _state['records'].append(record)
+
+
+def cubelist_sizes(cubelist):
+    """
+    Number of values and bytes held in the cubes of a cubelist, found from the shape
+    and dtype so that lazy data is not loaded
+    :param cubelist: list of cubes (or a single cube)
+    :return: dictionary of 'array_values' and 'array_bytes'
+    """
+    if hasattr(cubelist, 'shape'):
+        cubelist = [cubelist]
+
+    values = 0
+    nbytes = 0
+    for cube in cubelist:
+        n = int(np.prod(cube.shape))
+        values += n
+        nbytes += n*np.dtype(cube.dtype).itemsize
+
+    return {'array_values': values, 'array_bytes': nbytes}
+
+
+def file_sizes(filepattern):
+    """
+    Total size of the files matching a glob pattern, as read by iris.load
+    :param filepattern: string, path to files, possibly including wildcards
+    :return: dictionary of 'files_read' and 'bytes_read'
+    """
+    filenames = glob.glob(filepattern)
+    return {'files_read': len(filenames),
+            'bytes_read': sum(os.path.getsize(filename) for filename in filenames)}
+
+
+def records():
+    """
+    :return: list of dictionaries, one for each recorded call of a stage
+    """
+    return list(_state['records'])
+
+
+def write_records(filename, append = True):
+    """
+    Write all records to a JSON lines file, one record per line
+    :param filename: string, path of file to write
+    :param append: if True add to the end of an existing file rather than overwriting it
+    """
+    with open(filename, 'a' if append else 'w') as metrics_file:
+        for record in _state['records']:
+            metrics_file.write(json.dumps(record, sort_keys = True, default = str) + '\n')
+
+
+def read_records(filename):
+    """
+    Read records from a JSON lines file written by write_records
+    :param filename: string, path of file
+    :return: list of dictionaries
+    """
+    with open(filename, 'r') as metrics_file:
+        return [json.loads(line) for line in metrics_file if line.strip()]
+
+
+def summarise(record_list = None, group_by = ('station', 'stage')):
+    """
+    Totals of each measured quantity for groups of records
+    :param record_list: list of records, by default all those recorded so far
+    :param group_by: names of labels whose values define the groups
+    :return: list of dictionaries, one per group, sorted by total wall time (largest first)
+    """
+    if record_list is None:
+        record_list = _state['records']
+
+    groups = {}
+    for record in record_list:
+        key = tuple(record.get(label) for label in group_by)
+        if key not in groups:
+            groups[key] = dict(zip(group_by, key))
+            groups[key].update({'calls': 0, 'wall_time': 0., 'max_wall_time': 0.,
+                                'bytes_read': 0, 'array_bytes': 0})
+        group = groups[key]
+        group['calls'] += 1
+        group['wall_time'] += record.get('wall_time', 0.)
+        group['max_wall_time'] = max(group['max_wall_time'], record.get('wall_time', 0.))
+        group['bytes_read'] += record.get('bytes_read', 0)
+        group['array_bytes'] += record.get('array_bytes', 0)
+
+    summary = list(groups.values())
+    for group in summary:
+        group['mean_wall_time'] = group['wall_time']/group['calls']
+
+    return sorted(summary, key = lambda group: -group['wall_time'])
+
+
+def summary_table(record_list = None, group_by = ('station', 'stage')):
+    """
+    Format the output of summarise as a plain text table
+    :param record_list: list of records, by default all those recorded so far
+    :param group_by: names of labels whose values define the groups
+    :return: string of table
+    """
+    summary = summarise(record_list, group_by)
+    columns = list(group_by) + ['calls', 'wall_time', 'mean_wall_time', 'max_wall_time',
+                                'bytes_read', 'array_bytes']
+
+    rows = [columns]
+    for group in summary:
+        row = []
+        for column in columns:
+            value = group[column]
+            if isinstance(value, float):
+                row.append('{:.3f}'.format(value))
+            else:
+                row.append(str(value))
+        rows.append(row)
+
+    widths = [max(len(row[n]) for row in rows) for n in range(len(columns))]
+
+    return '\n'.join('  '.join(entry.rjust(width) for entry, width in zip(row, widths))
+                     for row in rows)
@@ -6,6 +6,30 @@ from __future__ import division
 import iris
 import calculate
 
+
+def cube_like(parent, data):
+    """
+    Create a cube of new data with the metadata of a parent cube, without copying
+    the data of the parent, in place of parent.copy() followed by assigning the data
+    The coordinates are shared with the parent rather than copied, so should be replaced
+    rather than modified in place on either cube
+    :param parent: cube
+    :param data: array of the same shape as the data of the parent
+    :return: cube
+    """
+    cube = iris.cube.Cube(data, standard_name = parent.standard_name, long_name = parent.long_name,
+                          var_name = parent.var_name, units = parent.units,
+                          attributes = parent.attributes.copy(), cell_methods = parent.cell_methods,
+                          dim_coords_and_dims = [(coord, parent.coord_dims(coord)[0])
+                                                 for coord in parent.dim_coords],
+                          aux_coords_and_dims = [(coord, parent.coord_dims(coord))
+                                                 for coord in parent.aux_coords])
+    coords = dict((id(coord), coord) for coord in parent.coords())
+    for factory in parent.aux_factories:
+        cube.add_aux_factory(factory.updated(coords))
+    return cube
+
+
 def temperature_cube(cubelist):
     """
     Create cube of temperature
@@ -18,9 +42,8 @@ def temperature_cube(cubelist):
 
     temp = calculate.temp_from_theta(theta.data, pressure.data)
 
-    temperature = theta.copy()
+    temperature = cube_like(theta, temp)
     temperature.standard_name = 'air_temperature'
-    temperature.data = temp
 
     return temperature
 
@@ -37,9 +60,8 @@ def theta_cube(cubelist):
 
     pot_temp = calculate.theta_from_temp(temperature.data, pressure.data)
 
-    theta = temperature.copy()
+    theta = cube_like(temperature, pot_temp)
     theta.standard_name = 'air_potential_temperature'
-    theta.data = pot_temp
 
     return theta
 
@@ -61,10 +83,9 @@ def specific_humidity_cube(cubelist):
                                                      temperature.data, pressure.data)
     spec_hum = calculate.q_from_partialpressure(partial_pressure, pressure.data)
 
-    q = dew_point.copy()
+    q = cube_like(dew_point, spec_hum)
     q.standard_name = 'specific_humidity'
     q.units = 'kg kg-1'
-    q.data = spec_hum
 
     return q
 
@@ -83,13 +104,12 @@ def relative_humidity_cube(cubelist, state = 'mixed'):
     vapour_pres = calculate.vapour_pressure_from_q(specific_humidity.data, pressure.data)
     RH = calculate.RH_from_vapourpressure(vapour_pres, temperature.data, state)
 
-    RHs = specific_humidity.copy()
+    RHs = cube_like(specific_humidity, RH)
     if state == 'mixed':
         RHs.rename('relative_humidity')
     else:
         RHs.rename('relative_humidity_' + state)
         # the standard name would be 'relative_humidity', but to provide distinction
-    RHs.data = RH
 
     return RHs
 
@@ -106,10 +126,9 @@ def theta_gradient_cube(cubelist):
 
     dthetadz = calculate.array_gradient_axis1(theta.data, altitude.data)
 
-    theta_grad = theta.copy()
+    theta_grad = cube_like(theta, dthetadz)
     theta_grad.rename('potential_temperature_vertical_gradient')
     theta_grad.units = 'K m-1'
-    theta_grad.data = dthetadz
 
     return theta_grad
 
@@ -129,10 +148,9 @@ def Brunt_Vaisala_square_cube(cubelist):
 
     bvf2 = calculate.Nsquared_from_thetagrad(theta.data, theta_grad.data, g)
 
-    N2 = theta.copy()
+    N2 = cube_like(theta, bvf2)
     N2.rename('square_of_brunt_vaisala_frequency_in_air')
     N2.units = 's-2'
-    N2.data = bvf2
 
     return N2
 
@@ -149,10 +167,9 @@ def q_gradient_cube(cubelist):
 
     dqdz = calculate.array_gradient_axis1(spec_hum.data, altitude.data)
 
-    q_grad = spec_hum.copy()
+    q_grad = cube_like(spec_hum, dqdz)
     q_grad.rename('specific_humidity_vertical_gradient')
     q_grad.units = 'kg kg-1 m-1'
-    q_grad.data = dqdz
 
     return q_grad
 
@@ -225,9 +242,6 @@ def difference_fields_selective(cubelist, sonde_cubelist, variable_name):
     # expect either 'variable_difference', 'variable_fractional_difference' or
     # 'variable_normalised_difference'
 
-    print cubelist
-    print sonde_cubelist
-
     if 'fractional' in variable_name or 'normalised' in variable_name:
 
         variable = variable_name[:-22]
@@ -237,15 +251,10 @@ def difference_fields_selective(cubelist, sonde_cubelist, variable_name):
 
         variable = variable_name[:-11]
         # remove string '_difference' from the end
-        
-    print variable
-        
+
     cube = cubelist.extract(iris.Constraint(name=variable))[0]
     reference_cube = sonde_cubelist.extract(iris.Constraint(name=variable))[0]
     # extract cubes
-    
-    print cube
-    print reference_cube
 
     difference = cube - reference_cube
 
@@ -7,30 +7,38 @@ from __future__ import division
 from scipy.signal import savgol_filter
 import numpy as np
 
+import precision
+from thread_pool import thread_map
+
 import random
 import matplotlib.pyplot as plt
 #import Sophie_code.write_all_regions as swar
 
 
-def filter_cubelist(cubelist_original, altitude, filter_dic):
+def filter_cubelist(cubelist_original, altitude, filter_dic, threads = None):
     """
     Apply chosen filter to data in all cubes in CubeList
     :param cubelist_original: list of cubes whose data are to be filtered
     :param altitude:
     :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param threads: number of threads in which to filter the cubes, if None one after another
     :return: CubeList of cubes with smoothed data fields
     """
 
     cubelist = cubelist_original
 #    cubelist = cubelist_original.copy()
 
-    for cube in cubelist:
-        
-        if cube.shape == (1,) or cube.shape == ():
-            # these cubes do not have dimension
-            pass
-        else:            
-            cube.data = my_filter(cube.data, altitude.data, filter_dic)
+    profiles = [cube for cube in cubelist if not (cube.shape == (1,) or cube.shape == ())]
+    # cubes of shape (1,) or () do not have dimension
+
+    altitude_data = altitude.data
+    arrays = [cube.data for cube in profiles]
+    # read here, as reading files is not safe in several threads
+
+    smoothed = thread_map(lambda array: my_filter(array, altitude_data, filter_dic), arrays, threads)
+
+    for cube, array in zip(profiles, smoothed):
+        cube.data = array
 
     return cubelist
 
@@ -80,30 +88,72 @@ def gaussian_kernel_smooth(T, Z, d, whw):
     :param whw: window half width in points
     :return: smoothed array
     """  
-    lent = len(T)
-    
     T_smooth = np.zeros_like(T)
     
-    for j in xrange(lent):
-        
-        n = min(whw, j, lent-j-1)
-        # maximum of whw points either side of point, window half width
-        
-        top = 0
-        bottom = 0
-        
-        for i in xrange(j-n, j+n+1):
-            
-            weight = np.exp((-(Z[j]-Z[i])**2)/(2*d**2))
-            
-            bottom += weight
-            top += weight*T[i]
-            
-        T_smooth[j] = top/bottom
+    T_smooth[:] = gaussian_kernel_smooth_2d(T[np.newaxis], Z[np.newaxis], d, whw)[0]
+    # a single profile is a 2D array with one row
         
     return T_smooth
 
 
+def gaussian_kernel_smooth_2d(T, Z, d, whw, lengths = None):
+    """
+    Gaussian kernel smoothing of each row of a 2D array, equivalent to calling
+    gaussian_kernel_smooth on each row, with the same order of summation
+    Rather than looping over points, loops over the offsets within the window so
+    that each step is a single array operation on all points of all rows
+    :param T: array (rows x points) of data to be smoothed, or (variables x rows x points)
+              to smooth several variables with the same weights
+    :param Z: array (rows x points) correspoinding to length in the direction of smoothing
+    :param d: gaussian half width in metres
+    :param whw: window half width in points
+    :param lengths: array of the number of valid points at the start of each row, where
+                    rows are padded to the same length, None if all points are valid
+    :return: smoothed array of the same shape as T, masked where any point within the
+             window is masked if T or Z are masked arrays
+    """
+    original = T
+    masked = np.ma.isMaskedArray(T) or np.ma.isMaskedArray(Z)
+    mask = np.ma.getmaskarray(T) | np.ma.getmaskarray(Z)
+    T = np.ma.filled(T, np.nan).astype(float)
+    # weights and their sums are accumulated in float64, and the result returned in the precision of T
+    Z = np.ma.filled(Z, np.nan).astype(float)
+
+    lent = Z.shape[-1]
+    if lengths is None:
+        lengths = np.zeros(Z.shape[:-1], dtype = int) + lent
+    lengths = np.asarray(lengths)[..., np.newaxis]
+
+    top = np.zeros(T.shape)
+    bottom = np.zeros(Z.shape)
+    window_mask = np.zeros(mask.shape, dtype = bool)
+    j = np.arange(lent)
+
+    for k in range(-whw, whw + 1):
+        # pairs of points j and i = j + k in the same row, for points j with at least |k| points either side
+        lower = max(0, -k)
+        upper = lent - max(0, k)
+        if lower >= upper:
+            continue
+        in_window = (abs(k) <= j[lower:upper]) & (abs(k) <= lengths - j[lower:upper] - 1)
+
+        weight = np.exp((-(Z[..., lower:upper] - Z[..., lower+k:upper+k])**2)/(2*d**2))
+
+        bottom[..., lower:upper] += np.where(in_window, weight, 0)
+        top[..., lower:upper] += np.where(in_window, weight*T[..., lower+k:upper+k], 0)
+        window_mask[..., lower:upper] |= in_window & mask[..., lower+k:upper+k]
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        T_smooth = top/bottom
+    T_smooth[..., j >= lengths] = np.nan
+    # padding beyond the end of each row
+
+    T_smooth = precision.like(T_smooth, original)
+    if masked:
+        return np.ma.array(T_smooth, mask = window_mask)
+    return T_smooth
+
+
 
 
 
@@ -0,0 +1,157 @@
+"""
+Run the processing of stations as a pipeline of three stages connected by bounded queues,
+such that reading files from the shared filesystem overlaps with computation:
+
+    prefetch: reads the files of the next few ascents (sonde, four UKMO lead times, ECAN)
+    compute:  processes and re-grids each ascent, collecting the ascents of a station
+    write:    merges the ascents of a station, adds gradient fields and saves the files
+
+The queues are bounded, so at most 'prefetch' ascents and 'write_backlog' stations are
+held in memory waiting for the next stage
+"""
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from re_grid import read_products, re_grid_trop_0, GRID_DIC
+from concatenate import create_datetime_list, save_station
+import instrument
+
+_FINISHED = None
+# placed on a queue to indicate that there are no more items to come
+
+
+def prefetch_stage(stations, read_queue):
+    """
+    Read the files of every ascent of every station in turn, blocking when the queue is full
+    :param stations: list of [source, station_number] pairs
+    :param read_queue: Queue onto which (source, station_number, time, cubelists) are put,
+                       where cubelists is the exception raised if reading failed
+    """
+    for source, station_number in stations:
+        try:
+            datetime_list = create_datetime_list(source, station_number)
+        except Exception as e:
+            print(source + ' ' + station_number + ' file list could not be read')
+            print(e)
+            continue
+
+        for time in datetime_list:
+            try:
+                cubelists = read_products(source, station_number, time, realise = True)
+            except Exception as e:
+                cubelists = e
+            read_queue.put((source, station_number, time, cubelists))
+
+    read_queue.put(_FINISHED)
+
+
+def write_stage(write_queue, ragged = False):
+    """
+    Merge and save the ascents of each station taken from the queue
+    :param write_queue: Queue from which (source, station_number, cubelist_dictionary) are taken
+    :param ragged: if True, save ragged .npz files rather than netCDF, see concatenate.save_station
+    """
+    while True:
+        item = write_queue.get()
+        if item is _FINISHED:
+            break
+
+        source, station_number, cubelist_dictionary = item
+        try:
+            save_station(source, station_number, cubelist_dictionary, ragged = ragged)
+        except Exception as e:
+            print(source + ' ' + station_number + ' saving has failed')
+            print(e)
+
+
+def compute_stage(read_queue, write_queue, filter_dic, kind, grid_dic = GRID_DIC):
+    """
+    Process and re-grid each ascent taken from the read queue, putting the collected
+    ascents of a station on the write queue once all of them have been processed
+    :param read_queue: Queue filled by prefetch_stage
+    :param write_queue: Queue emptied by write_stage
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see re_grid.grid_levels
+    """
+    station = None
+    cubelist_dictionary = None
+    startime = time.time()
+
+    while True:
+        item = read_queue.get()
+
+        if item is _FINISHED or (station and item[:2] != station):
+            # the previous station is complete, so pass it on to be written
+            if cubelist_dictionary:
+                write_queue.put((station[0], station[1], cubelist_dictionary))
+            if station:
+                elapsed = (time.time() - startime)/60
+                print(station[1] + ' ascents have taken ' + str(elapsed) + ' minutes')
+            cubelist_dictionary = None
+            startime = time.time()
+            if item is _FINISHED:
+                break
+
+        source, station_number, ascent_time, cubelists = item
+        station = (source, station_number)
+        ascent = source + '_' + station_number + '_' + ascent_time.strftime('%Y%m%d_%H%M')
+
+        if isinstance(cubelists, Exception):
+            print(ascent + ' could not be read')
+            print(cubelists)
+            continue
+
+        instrument.set_context(station = source + '_' + station_number,
+                               ascent = ascent_time.strftime('%Y%m%d_%H%M'))
+        try:
+            new_cubelist_dic = re_grid_trop_0(source, station_number, ascent_time, filter_dic, kind,
+                                              cubelists = cubelists, grid_dic = grid_dic)
+        except Exception as e:
+            print(ascent + ' processing has failed')
+            print(e)
+            continue
+
+        if new_cubelist_dic:
+            # it will return False if there is no found tropopause
+            if cubelist_dictionary is None:
+                cubelist_dictionary = new_cubelist_dic
+            else:
+                for key in cubelist_dictionary:
+                    cubelist_dictionary[key].extend(new_cubelist_dic[key])
+
+    instrument.clear_context()
+
+
+def run_pipeline(stations, filter_dic = {'name' : 'kernel', 'gaussian_half_width' : 50,
+                                         'window_half_width' : 200},
+                 kind = 'linear', prefetch = 4, write_backlog = 1, grid_dic = GRID_DIC, ragged = False):
+    """
+    Pipelined equivalent of calling concatenate.concatenate_cubelist_dictionary for each station
+    :param stations: list of [source, station_number] pairs
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param prefetch: integer, maximum number of ascents read ahead of the one being processed
+    :param write_backlog: integer, maximum number of processed stations waiting to be saved
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see re_grid.grid_levels
+    :param ragged: if True, save ragged .npz files rather than netCDF, see concatenate.save_station
+    """
+    read_queue = queue.Queue(maxsize = prefetch)
+    write_queue = queue.Queue(maxsize = write_backlog)
+
+    reader = threading.Thread(target = prefetch_stage, args = (stations, read_queue))
+    writer = threading.Thread(target = write_stage, args = (write_queue, ragged))
+    reader.daemon = True
+    writer.daemon = True
+    reader.start()
+    writer.start()
+
+    try:
+        compute_stage(read_queue, write_queue, filter_dic, kind, grid_dic)
+    finally:
+        write_queue.put(_FINISHED)
+        writer.join()
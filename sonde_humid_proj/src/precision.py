@@ -0,0 +1,164 @@
+"""
+Pipeline-wide choice of floating point precision
+
+By default all data are float64, as read by iris. With set_precision('float32') the
+data read by read_data, the intermediate arrays and the re-gridded (and saved) fields
+are float32, halving memory and disk, while the steps sensitive to rounding accumulate
+in float64 and only return float32: saturation vapour pressure exponentials, gradients,
+kernel smoothing weight sums and tropopause lapse-rate averages
+
+validation_report compares the float32 output of re_grid_trop_0 with the float64 output
+"""
+from __future__ import division
+
+from contextlib import contextmanager
+
+import numpy as np
+
+PRECISIONS = {'float32': np.float32, 'float64': np.float64}
+
+_state = {'dtype': np.float64}
+
+
+def set_precision(name):
+    """
+    Set the precision in which data are held throughout the pipeline
+    :param name: string, 'float32' or 'float64'
+    """
+    _state['dtype'] = PRECISIONS[name]
+
+
+def get_dtype():
+    """
+    :return: numpy type in which data are currently held
+    """
+    return _state['dtype']
+
+
+def is_reduced():
+    """
+    :return: True if data are held in less than float64 precision
+    """
+    return _state['dtype'] != np.float64
+
+
+def is_float_array(array):
+    """
+    :return: True if array is a numpy array (or masked array) of floating point numbers
+    """
+    return isinstance(array, np.ndarray) and np.issubdtype(array.dtype, np.floating)
+
+
+def as_working(array):
+    """
+    :param array: array, or anything else, which is returned unchanged
+    :return: floating point array converted to the current precision, keeping any mask
+    """
+    if is_float_array(array) and array.dtype != _state['dtype']:
+        return array.astype(_state['dtype'])
+    return array
+
+
+def to_float64(array):
+    """
+    :param array: array, or anything else, which is returned unchanged
+    :return: floating point array in float64, for calculations which should accumulate in
+             float64 whatever the precision of the data; the same array if already float64
+    """
+    if is_float_array(array) and array.dtype != np.float64:
+        return array.astype(np.float64)
+    return array
+
+
+def like(result, reference):
+    """
+    :param result: array calculated in float64 from reference
+    :param reference: array from which result was calculated
+    :return: result in the precision of reference, if reference is a reduced precision array
+    """
+    if is_float_array(reference) and is_float_array(result) and reference.dtype != result.dtype:
+        return result.astype(reference.dtype)
+    return result
+
+
+@contextmanager
+def working_precision(name):
+    """
+    Context manager within which data are held in the precision given
+    :param name: string, 'float32' or 'float64'
+    """
+    previous = _state['dtype']
+    set_precision(name)
+    try:
+        yield
+    finally:
+        _state['dtype'] = previous
+
+
+def compare_cubelists(reference, test):
+    """
+    Differences between the cubes of the same name in two cubelists
+    :param reference: CubeList, e.g. in float64
+    :param test: CubeList, e.g. in float32
+    :return: list of dictionaries of the variable name, dtype of the test, maximum absolute
+             difference, maximum relative difference and root mean square difference
+    """
+    differences = []
+    for cube in reference:
+        matching = [test_cube for test_cube in test if test_cube.name() == cube.name()]
+        if not matching:
+            continue
+        reference_data = np.ma.filled(np.asanyarray(cube.data, dtype = np.float64), np.nan)
+        test_data = np.ma.filled(np.asanyarray(matching[0].data).astype(np.float64), np.nan)
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            difference = np.abs(test_data - reference_data)
+            relative = difference/np.abs(reference_data)
+        valid = ~np.isnan(difference)
+
+        differences.append({'variable': cube.name(), 'dtype': str(np.asanyarray(matching[0].data).dtype),
+                            'max_abs': float(np.max(difference[valid])) if valid.any() else np.nan,
+                            'max_rel': float(np.max(relative[valid & np.isfinite(relative)]))
+                                       if (valid & np.isfinite(relative)).any() else np.nan,
+                            'rms': float(np.sqrt(np.mean(difference[valid]**2))) if valid.any() else np.nan,
+                            'nan_mismatch': int(np.sum(np.isnan(test_data) != np.isnan(reference_data)))})
+    return differences
+
+
+def validation_report(source, station_number, time, filter_dic = {'name' : 'kernel', 'gaussian_half_width' : 50,
+                                                                  'window_half_width' : 200}, kind = 'linear'):
+    """
+    Process and re-grid a single ascent in float64 and in float32, and print the differences
+    of every variable of every product, including the tropopause altitude
+    :param source: Code representing origin of data, options for which are:
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: string, 4-6 digit identifier of particular station
+                           from which sonde was released
+    :param time: datetime object of the time of the release of the sonde
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :return: list of dictionaries of differences, as compare_cubelists, with the product
+    """
+    from re_grid import re_grid_trop_0
+    # imported here as re_grid itself (through read_files & calculate) imports this file
+
+    with working_precision('float64'):
+        reference = re_grid_trop_0(source, station_number, time, filter_dic, kind)
+    with working_precision('float32'):
+        test = re_grid_trop_0(source, station_number, time, filter_dic, kind)
+
+    if not reference or not test:
+        print('no tropopause found for ' + source + '_' + station_number + ' ' + time.strftime('%Y%m%d_%H%M'))
+        return []
+
+    report = []
+    print('{:>8} {:>42} {:>8} {:>11} {:>11} {:>11} {:>5}'.format('product', 'variable', 'dtype', 'max abs',
+                                                                  'max rel', 'rms', 'nans'))
+    for key in sorted(reference):
+        for difference in compare_cubelists(reference[key], test[key]):
+            difference['product'] = key
+            report.append(difference)
+            print('{:>8} {:>42} {:>8} {:>11.3e} {:>11.3e} {:>11.3e} {:>5}'.format(
+                key, difference['variable'], difference['dtype'], difference['max_abs'],
+                difference['max_rel'], difference['rms'], difference['nan_mismatch']))
+    return report
@@ -5,14 +5,16 @@ Sort of 'wrapper functions' for my_filters, calculate & make_cubes
 
 import iris
 
-from read_files import read_data
+from read_files import read_data, data_filepattern
 from my_filters import filter_cubelist
 import make_cubes
+import derived_fields
 import calculate
+import instrument
 
 
 def process_single_ascent(source, station_number, time, dtype, filter_dic, 
-                          flag, lead_time = 0, kind = 'linear'):
+                          flag, lead_time = 0, kind = 'linear', threads = None):
     """
     Produce list of filtered variables which can be calculated 
     without derivatives from given data
@@ -27,26 +29,76 @@ def process_single_ascent(source, station_number, time, dtype, filter_dic,
     :param filter_dic: dictionary specifying filter name and necessary parameters
     :param lead_time: time in days before the verification time that the forecast was started
     :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param threads: number of threads in which to filter the variables, if None one after another
     :return: CubeList of smoothed vertical profiles
     """
+    cubelist = read_ascent(source, station_number, time, dtype, lead_time)
+
+    return process_cubelist(cubelist, dtype, filter_dic, flag, lead_time, threads)
+
+
+def read_ascent(source, station_number, time, dtype, lead_time = 0, realise = False):
+    """
+    Read the variables used by process_single_ascent for a single ascent
+    :param source: Code representing origin of data, options for which are: 
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: string, 4-6 digit identifier of particular station 
+                           from which sonde was released
+    :param time: datetime object of the time of the release of the sonde
+    :param dtype: string, origin of data: 'sonde', 'UKMO', 'ECAN'
+    :param lead_time: time in days before the verification time that the forecast was started
+    :param realise: if True, load the data of all cubes now rather than when first used
+    :return: CubeList of vertical profiles
+    """
     variables = ['air_pressure', 'air_temperature', 'air_potential_temperature', 
                  'dew_point_temperature', 'specific_humidity', 'altitude', 
                  'mass_fraction_of_cloud_ice_in_air', 'mass_fraction_of_cloud_liquid_water_in_air',
                  'latitude', 'longitude']
     # not all types will have all variables, this will be dealt with later
 
-    cubelist = read_data(source, station_number, time, variables, dtype, lead_time)
+    with instrument.stage('read_data', product = dtype, lead_time = lead_time,
+                          station = source + '_' + station_number,
+                          ascent = time.strftime('%Y%m%d_%H%M')) as record:
+        cubelist = read_data(source, station_number, time, variables, dtype, lead_time)
+        if realise:
+            for cube in cubelist:
+                cube.data
+                # accessing the data of a cube loads it from file
+        if instrument.is_enabled():
+            record.update(instrument.file_sizes(data_filepattern(source, station_number, time, dtype)))
+            record.update(instrument.cubelist_sizes(cubelist))
 
+    return cubelist
+
+
+def process_cubelist(cubelist, dtype, filter_dic, flag, lead_time = 0, threads = None):
+    """
+    Produce list of filtered variables from the cubelist of a single ascent
+    :param cubelist: CubeList as returned by read_ascent
+    :param dtype: string, origin of data: 'sonde', 'UKMO', 'ECAN'
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param flag: number, 0 when things are working well, 
+                 and asigned to a number when somthing goes wrong
+    :param lead_time: time in days before the verification time that the forecast was started
+    :param threads: number of threads in which to filter the variables, if None one after another
+    :return: CubeList of smoothed vertical profiles
+    """
     # calculate variables such that all profiles will have, as a minimum, 
     # fields of altitude, p, T, theta, q, RHi and RHw
-    cubelist = add_humidity_fields(cubelist, dtype)
+    with instrument.stage('add_humidity_fields', product = dtype, lead_time = lead_time) as record:
+        cubelist = add_humidity_fields(cubelist, dtype)
+        if instrument.is_enabled():
+            record.update(instrument.cubelist_sizes(cubelist))
 
     altitude = cubelist.extract(iris.Constraint(name='altitude'))[0]
     # filter all variables using kernel smoothing [only sonde]
     if dtype == 'sonde':
         cubelist.remove(altitude)
         # as the vertical coordinate I don't think we want this smoothed (?) (can always remove this line)
-        cubelist_smooth = filter_cubelist(cubelist, altitude, filter_dic)
+        with instrument.stage('filter_cubelist', product = dtype, lead_time = lead_time) as record:
+            cubelist_smooth = filter_cubelist(cubelist, altitude, filter_dic, threads)
+            if instrument.is_enabled():
+                record.update(instrument.cubelist_sizes(cubelist_smooth))
         cubelist_smooth.append(altitude)
     else:
         cubelist_smooth = cubelist
@@ -54,7 +106,10 @@ def process_single_ascent(source, station_number, time, dtype, filter_dic,
     # calculate the tropopause height
     # add trop_height_m as cube to list
     temperature = cubelist_smooth.extract(iris.Constraint(name='air_temperature'))[0]
-    trop_alt, flag = calculate.tropopause_height(temperature.data, altitude.data, flag)[:-1]
+    with instrument.stage('tropopause_height', product = dtype, lead_time = lead_time) as record:
+        trop_alt, flag = calculate.tropopause_height(temperature.data, altitude.data, flag)[:-1]
+        if instrument.is_enabled():
+            record.update(instrument.cubelist_sizes(temperature))
     cubelist_smooth.append(iris.cube.Cube(trop_alt, standard_name = 'tropopause_altitude', 
                                           units = 'm', aux_coords_and_dims = 
                                           [(altitude.coord('time'), None)]))
@@ -68,21 +123,10 @@ def add_humidity_fields(cubelist, dtype):
     fields of altitude, p, T, theta, q, RHi, RHw and RH
     :param cubelist: list of cubes
     :param dtype: string, origin of data: 'sonde', 'UKMO', 'ECAN'
+                  (which fields are calculated follows from those the cubelist already has)
     :return: extended list of cubes with specified minimum fields
     """
-    if dtype == 'UKMO':
-        cubelist.append(make_cubes.temperature_cube(cubelist))
-    else:
-        cubelist.append(make_cubes.theta_cube(cubelist))
-
-    if dtype == 'sonde':
-        cubelist.append(make_cubes.specific_humidity_cube(cubelist))
-
-    cubelist.append(make_cubes.relative_humidity_cube(cubelist, 'liquid_water'))
-    cubelist.append(make_cubes.relative_humidity_cube(cubelist, 'ice'))
-    cubelist.append(make_cubes.relative_humidity_cube(cubelist, 'mixed'))
-
-    return cubelist
+    return derived_fields.add_derived_fields(cubelist, derived_fields.HUMIDITY_FIELDS)
 
 
 def process_concatenated(cubelist_dic):
@@ -118,14 +162,9 @@ def add_gradient_fields(cubelist):
     :param cubelist: list of cubes containing altitude, theta & specific_humidity
     :return: longer list of cubes with gradient fields
     """
-    cubelist.append(make_cubes.theta_gradient_cube(cubelist))
-    cubelist.append(make_cubes.Brunt_Vaisala_square_cube(cubelist))
-    cubelist.append(make_cubes.q_gradient_cube(cubelist))
-    cubelist.append(make_cubes.fractional_humidity_gradient_measure_cube(cubelist))
+    return derived_fields.add_derived_fields(cubelist, derived_fields.GRADIENT_FIELDS)
     # I'm sure there was another useful derivative, that I forgot to write down
 
-    return cubelist
-
 
 def add_difference_fields(cubelist, sonde_cubelist):
     """
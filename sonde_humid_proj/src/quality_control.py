@@ -0,0 +1,180 @@
+"""
+Quality control of the sonde profile of each ascent, carried out straight after reading,
+before any filtering and before the model data of the ascent are read
+
+Each check sets one bit of an integer of flags for the ascent, which is kept as a scalar
+cube of the sonde cubelist alongside the tropopause altitude, and so is saved with the
+re-gridded fields. Levels found to be bad are dropped from all profiles of the ascent,
+and ascents whose remaining profile is unusable are rejected
+
+The checks are specified by a dictionary, in the same way as the filters:
+    {'name' : 'standard', 'spike_threshold' : , 'superadiabatic_drop' : ,
+     'boundary_layer_top' : , 'max_missing_run' : , 'min_top' : , 'min_levels' : }
+    {'name' : 'none'}
+        no checks, the cubelist is returned unchanged with no flags cube
+
+Quality control is opt-in: re_grid.re_grid_trop_0 and station_batch.batch_station carry out
+no checks unless they are given a dictionary such as QC_DIC
+"""
+from __future__ import division
+
+import iris
+import numpy as np
+
+import calculate
+import instrument
+
+QC_FLAGS = [('missing_levels', 1), ('non_monotonic_altitude', 2), ('duplicate_levels', 4),
+            ('temperature_spikes', 8), ('superadiabatic_layer', 16), ('long_missing_run', 32),
+            ('low_profile_top', 64), ('too_few_levels', 128)]
+# name and bit of each flag, in the order of the CF flag_masks and flag_meanings attributes
+
+QC_BITS = dict(QC_FLAGS)
+
+REJECT_MASK = QC_BITS['low_profile_top'] | QC_BITS['too_few_levels']
+# ascents with any of these flags set cannot be used
+
+QC_DIC = {'name' : 'standard', 'spike_threshold' : 5., 'superadiabatic_drop' : 2.,
+          'boundary_layer_top' : 1000., 'max_missing_run' : 50, 'min_top' : 6000.,
+          'min_levels' : 3}
+# spikes are single levels more than 5 K warmer or colder than the levels either side of them;
+# superadiabatic layers are where theta falls more than 2 K below that of any level beneath,
+# above the lowest 1 km; missing runs are of consecutive levels without altitude, temperature
+# or pressure, or with temperature or pressure not above zero; profiles must reach 6 km, as
+# calculate.tropopause_height looks for the tropopause from 4 km with 2 km of profile above
+# it, with at least the 3 levels needed for a lapse rate left, so that no ascent is rejected
+# which could otherwise have been used
+
+NO_QC_DIC = {'name' : 'none'}
+# the default of re_grid.re_grid_trop_0 and station_batch.batch_station
+
+
+def missing_runs(missing):
+    """
+    :param missing: boolean array
+    :return: array of the lengths of each run of consecutive True values
+    """
+    changes = np.diff(np.concatenate([[0], missing.astype(int), [0]]))
+    return np.nonzero(changes == -1)[0] - np.nonzero(changes == 1)[0]
+
+
+def check_profile(altitude, temperature, pressure, qc_dic = QC_DIC):
+    """
+    Carry out all checks on the arrays of a single profile
+    :param altitude: array of altitudes, m, from the bottom of the profile upwards
+    :param temperature: array of temperatures, K
+    :param pressure: array of pressures, Pa
+    :param qc_dic: dictionary specifying the checks, see above
+    :return: boolean array, True for the levels to keep, and integer of flags
+    """
+    z = np.ma.filled(np.asanyarray(altitude, dtype = float), np.nan)
+    T = np.ma.filled(np.asanyarray(temperature, dtype = float), np.nan)
+    p = np.ma.filled(np.asanyarray(pressure, dtype = float), np.nan)
+    flags = 0
+
+    with np.errstate(invalid = 'ignore'):
+        missing = np.isnan(z) | np.isnan(T) | np.isnan(p) | (T <= 0) | (p <= 0)
+        # non-physical values are missing values, e.g. fill values of -999
+    if missing.any():
+        flags |= QC_BITS['missing_levels']
+        if missing_runs(missing).max() > qc_dic['max_missing_run']:
+            flags |= QC_BITS['long_missing_run']
+
+    # highest altitude of all valid levels below each level
+    highest_below = np.concatenate([[-np.inf], np.maximum.accumulate(np.where(missing, -np.inf, z))[:-1]])
+    duplicate = ~missing & (z == highest_below)
+    non_monotonic = ~missing & (z < highest_below)
+    if duplicate.any():
+        flags |= QC_BITS['duplicate_levels']
+    if non_monotonic.any():
+        flags |= QC_BITS['non_monotonic_altitude']
+    keep = ~(missing | duplicate | non_monotonic)
+
+    # spikes are levels warmer (or colder) than both the levels kept either side by more than the threshold
+    index = np.nonzero(keep)[0]
+    if index.size > 2:
+        above = T[index[1:-1]] - T[index[2:]]
+        below = T[index[1:-1]] - T[index[:-2]]
+        spikes = (np.sign(above) == np.sign(below)) & (np.minimum(np.abs(above), np.abs(below)) >
+                                                       qc_dic['spike_threshold'])
+        if spikes.any():
+            flags |= QC_BITS['temperature_spikes']
+            keep[index[1:-1][spikes]] = False
+
+    index = np.nonzero(keep)[0]
+    if index.size:
+        theta = calculate.theta_from_temp(T[index], p[index])
+        drop = np.maximum.accumulate(theta) - theta
+        if np.any((drop > qc_dic['superadiabatic_drop']) & (z[index] > qc_dic['boundary_layer_top'])):
+            flags |= QC_BITS['superadiabatic_layer']
+            # flagged only, as the levels may be genuine
+
+    if not index.size or z[index].max() < qc_dic['min_top']:
+        flags |= QC_BITS['low_profile_top']
+    if index.size < qc_dic['min_levels']:
+        flags |= QC_BITS['too_few_levels']
+
+    return keep, flags
+
+
+def is_rejected(flags):
+    """
+    :param flags: integer of flags from check_profile
+    :return: True if the ascent cannot be used
+    """
+    return bool(flags & REJECT_MASK)
+
+
+def flag_names(flags):
+    """
+    :param flags: integer of flags from check_profile
+    :return: list of the names of the flags set
+    """
+    return [name for name, bit in QC_FLAGS if flags & bit]
+
+
+def flags_cube(flags, time):
+    """
+    :param flags: integer of flags from check_profile
+    :param time: time coordinate of the ascent
+    :return: scalar cube of the flags, with CF flag attributes
+    """
+    return iris.cube.Cube(np.array(flags, dtype = np.int32), long_name = 'quality_control_flags', units = '1',
+                          attributes = {'flag_masks' : tuple(bit for name, bit in QC_FLAGS),
+                                        'flag_meanings' : ' '.join(name for name, bit in QC_FLAGS)},
+                          aux_coords_and_dims = [(time, None)])
+
+
+def quality_control(cubelist, qc_dic = QC_DIC):
+    """
+    Check the profile of a single ascent, drop its bad levels and record its flags
+    :param cubelist: CubeList as returned by read_ascent
+    :param qc_dic: dictionary specifying the checks, see above
+    :return: CubeList with the bad levels removed from every profile and the cube of
+             the flags added, and integer of flags
+    """
+    if qc_dic['name'] == 'none':
+        return cubelist, 0
+
+    with instrument.stage('quality_control') as record:
+        altitude = cubelist.extract(iris.Constraint(name = 'altitude'))[0]
+        pressure = cubelist.extract(iris.Constraint(name = 'air_pressure'))[0]
+        temperature = cubelist.extract(iris.Constraint(name = 'air_temperature'))
+        if temperature:
+            temperature = temperature[0].data
+        else:
+            theta = cubelist.extract(iris.Constraint(name = 'air_potential_temperature'))[0]
+            temperature = calculate.temp_from_theta(theta.data, pressure.data)
+
+        keep, flags = check_profile(altitude.data, temperature, pressure.data, qc_dic)
+
+        if not keep.all():
+            index = np.nonzero(keep)[0]
+            cubelist = iris.cube.CubeList([cube[index] if cube.shape == altitude.shape else cube
+                                           for cube in cubelist])
+        cubelist.append(flags_cube(flags, altitude.coord('time')))
+
+        if instrument.is_enabled():
+            record.update({'levels_dropped': int(keep.size - keep.sum()), 'flags': flags})
+
+    return cubelist, flags
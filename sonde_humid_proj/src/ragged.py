@@ -0,0 +1,197 @@
+"""
+Collection of functions to store 2D (time x altitude) arrays which are mostly nan, such
+as the tropopause-relative profiles, keeping only the span of each row between its first
+and last valid value
+
+A ragged array is a dictionary of:
+    'values':  1D array of the valid span of every row, one row after another
+    'offsets': array (rows + 1) of the index in values at which each row starts
+    'starts':  array (rows) of the column of the first valid value of each row
+    'shape':   tuple, shape of the dense array
+
+Rows can be read as views of 'values' with 'row', reduced without expanding them with
+'nansum', 'nanmean' and 'count', and expanded to a dense array with 'to_dense'
+"""
+from __future__ import division
+
+import json
+
+import numpy as np
+
+
+def from_dense(array):
+    """
+    :param array: 2D array, with nan outside the valid span of each row
+    :return: ragged array dictionary
+    """
+    array = np.ma.filled(array, np.nan)
+    valid = ~np.isnan(array)
+    n_rows, n_columns = array.shape
+
+    any_valid = valid.any(axis = 1)
+    starts = np.where(any_valid, np.argmax(valid, axis = 1), 0)
+    ends = np.where(any_valid, n_columns - np.argmax(valid[:, ::-1], axis = 1), 0)
+    # one beyond the last valid value of each row, and empty rows have zero length
+
+    columns = np.arange(n_columns)
+    span = (columns >= starts[:, np.newaxis]) & (columns < ends[:, np.newaxis])
+
+    return {'values': array[span], 'offsets': np.concatenate([[0], np.cumsum(ends - starts)]),
+            'starts': starts, 'shape': (n_rows, n_columns)}
+
+
+def lengths(ragged):
+    """
+    :param ragged: ragged array dictionary
+    :return: array of the number of stored values of each row
+    """
+    return np.diff(ragged['offsets'])
+
+
+def row(ragged, n):
+    """
+    :param ragged: ragged array dictionary
+    :param n: integer, index of row
+    :return: view of the stored values of the row, and the column of the first of these
+    """
+    return ragged['values'][ragged['offsets'][n]:ragged['offsets'][n+1]], ragged['starts'][n]
+
+
+def columns(ragged):
+    """
+    :param ragged: ragged array dictionary
+    :return: array of the column of each stored value
+    """
+    row_lengths = lengths(ragged)
+    return np.arange(len(ragged['values'])) - np.repeat(ragged['offsets'][:-1] - ragged['starts'], row_lengths)
+
+
+def rows(ragged):
+    """
+    :param ragged: ragged array dictionary
+    :return: array of the row of each stored value
+    """
+    return np.repeat(np.arange(ragged['shape'][0]), lengths(ragged))
+
+
+def to_dense(ragged, row_indices = None):
+    """
+    :param ragged: ragged array dictionary
+    :param row_indices: list of rows to expand, by default all rows
+    :return: 2D array, with nan outside the stored span of each row
+    """
+    if row_indices is not None:
+        row_indices = np.atleast_1d(row_indices)
+        dense = np.zeros((len(row_indices), ragged['shape'][1])) + np.nan
+        for n, index in enumerate(row_indices):
+            values, start = row(ragged, index)
+            dense[n, start:start + len(values)] = values
+        return dense
+
+    dense = np.zeros(ragged['shape']) + np.nan
+    dense[rows(ragged), columns(ragged)] = ragged['values']
+    return dense
+
+
+def nansum(ragged, axis = 0):
+    """
+    Equivalent of np.nansum of the dense array, only visiting stored values
+    :param ragged: ragged array dictionary
+    :param axis: 0 to sum over rows (e.g. times) at each column, 1 to sum each row
+    :return: array of sums
+    """
+    values = np.where(np.isnan(ragged['values']), 0, ragged['values'])
+    if axis == 0:
+        return np.bincount(columns(ragged), weights = values, minlength = ragged['shape'][1])
+    return np.bincount(rows(ragged), weights = values, minlength = ragged['shape'][0])
+
+
+def count(ragged, axis = 0):
+    """
+    :param ragged: ragged array dictionary
+    :param axis: 0 to count over rows at each column, 1 to count each row
+    :return: array of the number of values which are not nan
+    """
+    valid = ~np.isnan(ragged['values'])
+    if axis == 0:
+        return np.bincount(columns(ragged)[valid], minlength = ragged['shape'][1])
+    return np.bincount(rows(ragged)[valid], minlength = ragged['shape'][0])
+
+
+def nanmean(ragged, axis = 0):
+    """
+    Equivalent of np.nanmean of the dense array, only visiting stored values
+    :param ragged: ragged array dictionary
+    :param axis: 0 for the mean over rows (e.g. times) at each column, 1 for the mean of each row
+    :return: array of means, nan where there are no values
+    """
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return nansum(ragged, axis)/count(ragged, axis)
+
+
+def metadata(cube):
+    """
+    :param cube: cube
+    :return: dictionary of the names, units and attributes of a cube, which can be saved as JSON
+    """
+    return {'standard_name': cube.standard_name, 'long_name': cube.long_name,
+            'var_name': cube.var_name, 'units': str(cube.units),
+            'attributes': dict((key, str(value)) for key, value in cube.attributes.items())}
+
+
+def save_cubelist(cubelist, filename):
+    """
+    Save a CubeList of 2D (time x altitude) cubes to an .npz file, storing the 2D cubes as
+    ragged arrays and any 1D cubes (e.g. tropopause altitude) as they are
+    :param cubelist: CubeList, as saved by concatenate.save_station
+    :param filename: string, .npz file to write
+    """
+    arrays = {}
+    cube_metadata = {}
+
+    for cube in cubelist:
+        name = cube.name()
+        cube_metadata[name] = metadata(cube)
+
+        if cube.ndim == 2:
+            ragged = from_dense(cube.data)
+            for key in ['values', 'offsets', 'starts']:
+                arrays[name + '/' + key] = ragged[key]
+            arrays[name + '/shape'] = np.array(ragged['shape'])
+            if 'altitude_levels' not in arrays:
+                arrays['altitude_levels'] = cube.coord(dimensions = 1).points
+        else:
+            arrays[name + '/data'] = np.ma.filled(cube.data, np.nan)
+
+        if 'time' not in arrays:
+            arrays['time'] = cube.coord('time').points
+            cube_metadata['time'] = {'units': str(cube.coord('time').units)}
+
+    arrays['metadata'] = np.array(json.dumps(cube_metadata))
+    np.savez(filename, **arrays)
+
+
+def load(filename):
+    """
+    Read a file written by save_cubelist
+    :param filename: string, .npz file
+    :return: dictionary with a ragged array dictionary, or 1D array, for each variable, the
+             arrays of 'time' and 'altitude_levels', and the 'metadata' of each variable
+    """
+    contents = {}
+    with np.load(filename) as npz:
+        for key in npz.files:
+            if '/' in key:
+                name, part = key.split('/')
+                contents.setdefault(name, {})[part] = npz[key]
+            else:
+                contents[key] = npz[key]
+
+    contents['metadata'] = json.loads(str(contents['metadata']))
+    for name in list(contents):
+        if isinstance(contents[name], dict) and 'data' in contents[name]:
+            contents[name] = contents[name]['data']
+        elif isinstance(contents[name], dict) and 'shape' in contents[name]:
+            contents[name]['shape'] = tuple(contents[name]['shape'])
+
+    return contents
@@ -1,13 +1,79 @@
 """
-Collection of functions to re-grid data to specified uniform height scale
+Collection of functions to re-grid data to specified uniform height scale,
+or to other scales given by a dictionary specifying the grid (see grid_levels)
 """
 
+import json
+
 import iris
+import numpy as np
 from scipy.interpolate import interp1d
 
-from process_data import process_single_ascent
+from process_data import read_ascent, process_cubelist
+from make_cubes import cube_like
+import instrument
+import precision
+import quality_control
+from thread_pool import thread_map, FILE_LOCK
+
+# keys of the dictionary of cubelists produced for each ascent, with the data type
+# and lead time in days from which each is read
+PRODUCTS = [('sonde', 'sonde', 0), ('ukmo', 'UKMO', 0), ('ukmo1', 'UKMO', 1),
+            ('ukmo3', 'UKMO', 3), ('ukmo5', 'UKMO', 5), ('ecan', 'ECAN', 0)]
+
+# default tropopause-relative grid, 10 m from 10 km below to 10 km above the tropopause
+GRID_DIC = {'name' : 'uniform', 'lower' : -10000, 'upper' : 10000, 'spacing' : 10}
+
 
-def re_grid_1d(variables, dimension, lower, upper, spacing, kind = 'linear'):
+def grid_levels(grid_dic):
+    """
+    Levels of the grid specified by a dictionary, options for which are:
+        {'name' : 'uniform', 'lower' : , 'upper' : , 'spacing' : }
+            evenly spaced levels from lower to upper (the default, GRID_DIC)
+        {'name' : 'stretched', 'lower' : , 'upper' : , 'spacing' : , 'factor' : , 'max_spacing' : }
+            levels either side of zero, starting with spacing at zero and growing by factor
+            from each level to the next, up to max_spacing, ending at lower and upper
+        {'name' : 'levels', 'levels' : }
+            the levels given, in any order
+    :param grid_dic: dictionary specifying grid name and necessary parameters
+    :return: list or array of levels in increasing order
+    """
+    if grid_dic['name'] == 'uniform':
+
+        return range(grid_dic['lower'], grid_dic['upper']+1, int(grid_dic['spacing']))
+
+    elif grid_dic['name'] == 'stretched':
+
+        halves = []
+        for bound in [grid_dic['upper'], -grid_dic['lower']]:
+            levels = [0.]
+            spacing = grid_dic['spacing']
+            while levels[-1] < bound:
+                levels.append(min(levels[-1] + spacing, bound))
+                spacing = min(spacing*grid_dic['factor'], grid_dic['max_spacing'])
+            halves.append(levels)
+        # levels above zero, then the distance below zero of levels below it
+
+        return np.array([-level for level in halves[1][:0:-1]] + halves[0])
+
+    elif grid_dic['name'] == 'levels':
+
+        return np.unique(grid_dic['levels']).astype(float)
+
+    else:
+
+        raise ValueError("grid_levels has three options for grid name: 'uniform', 'stretched' or 'levels'")
+
+
+def grid_attribute(grid_dic):
+    """
+    :param grid_dic: dictionary specifying grid name and necessary parameters
+    :return: string describing the grid, to be saved as an attribute of the cubes on it
+    """
+    return json.dumps(grid_dic, sort_keys = True)
+
+
+def re_grid_1d(variables, dimension, lower, upper, spacing, kind = 'linear', threads = None):
     """
     Take a set of variables defined along a dimension and re-grid them to a uniform scale
     :param variables: list of cubes for the variables
@@ -16,11 +82,25 @@ def re_grid_1d(variables, dimension, lower, upper, spacing, kind = 'linear'):
     :param upper: number, upper bound of uniform scale
     :param spacing: number, spacing of uniform scale
     :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param threads: number of threads in which to interpolate the variables, if None one after another
     :return: list of cubes of new variables
     """
     new_dimension = range(lower, upper+1, int(spacing))
     # create evenly spaced array for new dimension
 
+    return re_grid_levels(variables, dimension, new_dimension, kind, threads)
+
+
+def re_grid_levels(variables, dimension, new_dimension, kind = 'linear', threads = None):
+    """
+    Take a set of variables defined along a dimension and re-grid them to given levels
+    :param variables: list of cubes for the variables
+    :param dimension: cube of previous dimension: monotonic and of the same length as variables
+    :param new_dimension: list or array of levels of the new dimension, in increasing order
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param threads: number of threads in which to interpolate the variables, if None one after another
+    :return: list of cubes of new variables
+    """
     new_dim = iris.coords.DimCoord(new_dimension, standard_name = dimension.standard_name,
                                    units = dimension.units)
 
@@ -31,6 +111,17 @@ def re_grid_1d(variables, dimension, lower, upper, spacing, kind = 'linear'):
 
     new_cubes = iris.cube.CubeList([])
 
+    dimension_data = dimension.data
+    arrays = [cube.data for cube in variables if not (cube.shape == (1,) or cube.shape == ())]
+    # read here, as reading files is not safe in several threads
+
+    def interpolate(data):
+        interp_2_new_dim = interp1d(dimension_data, data, kind, bounds_error = False)
+        return precision.as_working(interp_2_new_dim(new_dimension))
+        # interpolate to new dimension array, held in the precision set by precision.set_precision
+
+    new_arrays = iter(thread_map(interpolate, arrays, threads))
+
     for cube in variables:
 
         if cube.shape == (1,) or cube.shape == ():
@@ -39,9 +130,7 @@ def re_grid_1d(variables, dimension, lower, upper, spacing, kind = 'linear'):
             # just add them to new cube
         else:
 
-            interp_2_new_dim = interp1d(dimension.data, cube.data, kind, bounds_error = False)
-            new_data = interp_2_new_dim(new_dimension)
-            # interpolate to new dimension array
+            new_data = next(new_arrays)
 
             new_cubes.append(iris.cube.Cube(new_data, standard_name=cube.standard_name, 
                                             long_name=cube.long_name, var_name=cube.var_name, 
@@ -53,7 +142,41 @@ def re_grid_1d(variables, dimension, lower, upper, spacing, kind = 'linear'):
     return new_cubes
 
 
-def re_grid_trop_0(source, station_number, time, filter_dic, kind = 'linear', throw_flag = True):
+def read_products(source, station_number, time, realise = True):
+    """
+    Read the data of all products for a single ascent, without any processing
+    :param source: Code representing origin of data, options for which are: 
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: string, 4-6 digit identifier of particular station 
+                           from which sonde was released
+    :param time: datetime object of the time of the release of the sonde
+    :param realise: if True, load the data of all cubes now rather than when first used
+    :return: dictionary of cubelists with the keys of PRODUCTS
+    """
+    cubelists = {}
+    for key, dtype, lead_time in PRODUCTS:
+        with FILE_LOCK:
+            # as files may be written by another thread at the same time, see pipeline
+            cubelists[key] = read_ascent(source, station_number, time, dtype, lead_time, realise)
+    return cubelists
+
+
+def product_cubelist(cubelists, key, source, station_number, time):
+    """
+    Return the cubelist of a product, from cubelists if it has already been read,
+    otherwise by reading it now
+    :param cubelists: dictionary of cubelists with the keys of PRODUCTS, or None
+    :param key: string, one of the keys of PRODUCTS
+    :return: CubeList of vertical profiles
+    """
+    if cubelists and key in cubelists:
+        return cubelists[key]
+    dtype, lead_time = [product[1:] for product in PRODUCTS if product[0] == key][0]
+    return read_ascent(source, station_number, time, dtype, lead_time)
+
+
+def re_grid_trop_0(source, station_number, time, filter_dic, kind = 'linear', throw_flag = True,
+                   cubelists = None, grid_dic = GRID_DIC, threads = None, qc_dic = quality_control.NO_QC_DIC):
     """
     Take data from all sources
     :param source: Code representing origin of data, options for which are: 
@@ -66,22 +189,43 @@ def re_grid_trop_0(source, station_number, time, filter_dic, kind = 'linear', th
     :param filter_dic: dictionary specifying filter name and necessary parameters
     :param kind: integer specifying the order of the spline interpolator to use, default is linear
     :param throw_flag: if True, return False if flag is raised by sonde ascent.
+    :param cubelists: optional dictionary of cubelists already read by read_products,
+                      products not in it are read when needed
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see grid_levels
+    :param threads: number of threads in which to filter the variables of the sonde and to
+                    re-grid the products, if None one after another
+    :param qc_dic: dictionary specifying the quality control of the sonde, see quality_control,
+                   default none, e.g. quality_control.QC_DIC for the standard checks;
+                   if throw_flag, ascents it rejects are disregarded before any model data are read
     :return: dictionary of cubelists for the sonde, ukmo analysis and 1, 3 and 5 
              day forecasts, and ECMWF analyses
     """
+    def processed(key, cubelist = None):
+        dtype, lead_time = [product[1:] for product in PRODUCTS if product[0] == key][0]
+        if cubelist is None:
+            cubelist = product_cubelist(cubelists, key, source, station_number, time)
+        return process_cubelist(cubelist, dtype, filter_dic, 0, lead_time, threads)
+
+    sonde, qc_flags = quality_control.quality_control(product_cubelist(cubelists, 'sonde', source,
+                                                                       station_number, time), qc_dic)
+
+    if throw_flag and quality_control.is_rejected(qc_flags):
+        print(source + '_' + station_number + '_' + time.strftime('%Y%m%d_%H%M') +
+              ' sonde rejected by quality control: ' + ', '.join(quality_control.flag_names(qc_flags)))
+        return False
 
-    sonde, flag_sonde = process_single_ascent(source, station_number, time, 'sonde', filter_dic, 0)
+    sonde, flag_sonde = processed('sonde', sonde)
 
     if throw_flag:
         if flag_sonde:
             return False
     # if throw_flag, disregard the ascent if any error occurred in the processing of sonde data
 
-    ukmo, flag_ukmo = process_single_ascent(source, station_number, time, 'UKMO', filter_dic, 0)
-    ukmo1 = process_single_ascent(source, station_number, time, 'UKMO', filter_dic, 0, lead_time = 1)[0]
-    ukmo3 = process_single_ascent(source, station_number, time, 'UKMO', filter_dic, 0, lead_time=3)[0]
-    ukmo5 = process_single_ascent(source, station_number, time, 'UKMO', filter_dic, 0, lead_time=5)[0]
-    ecan, flag_ecan = process_single_ascent(source, station_number, time, 'ECAN', filter_dic, 0)
+    ukmo, flag_ukmo = processed('ukmo')
+    ukmo1 = processed('ukmo1')[0]
+    ukmo3 = processed('ukmo3')[0]
+    ukmo5 = processed('ukmo5')[0]
+    ecan, flag_ecan = processed('ecan')
 
     trop_const = iris.Constraint(name = 'tropopause_altitude')
     alt_const = iris.Constraint(name = 'altitude')
@@ -138,16 +282,35 @@ def re_grid_trop_0(source, station_number, time, filter_dic, kind = 'linear', th
 
     cubelist_dic = {'sonde':sonde, 'ukmo':ukmo, 'ukmo1':ukmo1, 'ukmo3':ukmo3, 'ukmo5':ukmo5, 'ecan':ecan}
 
-    for key in cubelist_dic:
+    levels = grid_levels(grid_dic)
+
+    def re_grid_product(key):
         
         cubelist = cubelist_dic[key]
 
-        reference_altitude = cubelist.extract(alt_const)[0].copy()
-        # this .copy() is important s.t. geometric altitude is preserved as a cube
-
-        reference_altitude.data = reference_altitude.data - trop_alt
-
-        cubelist_dic[key] = re_grid_1d(cubelist, reference_altitude, -10000, 10000, 10, kind)
+        altitude = cubelist.extract(alt_const)[0]
+        reference_altitude = cube_like(altitude, altitude.data - trop_alt)
+        # a new cube is important s.t. geometric altitude is preserved as a cube
+
+        with instrument.stage('re_grid_1d', product = key) as record:
+            new_cubelist = re_grid_levels(cubelist, reference_altitude, levels, kind)
+            for cube in new_cubelist:
+                cube.attributes['tropopause_relative_grid'] = grid_attribute(grid_dic)
+                # such that the grid is recorded in the saved files
+            if instrument.is_enabled():
+                record.update(instrument.cubelist_sizes(new_cubelist))
+
+        return new_cubelist
+
+    if threads:
+        for cubelist in cubelist_dic.values():
+            for cube in cubelist:
+                cube.data
+                # accessing the data of a cube loads it from file, which is not safe in several threads
+
+    keys = list(cubelist_dic)
+    cubelist_dic = dict(zip(keys, thread_map(re_grid_product, keys, threads)))
+    # the products are re-gridded in threads, rather than the variables of each product
 
     return cubelist_dic
     # it would be nice to produce a plot of superimposed temperature profiles, with dotted tropopauses to compare
\ No newline at end of file
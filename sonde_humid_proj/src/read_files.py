@@ -6,6 +6,10 @@ The actually useful function 'read_data' is right at the end
 """
 from __future__ import division
 
+import os
+import glob
+import threading
+from collections import OrderedDict
 import iris
 iris.FUTURE.cell_datetime_objects=True
 import numpy as np
@@ -15,6 +19,25 @@ from iris.coord_systems import GeogCS
 
 from re_name_vars import change_names_from_CF, re_name_to_CF
 import calculate
+from make_cubes import cube_like
+import precision
+
+_cache = {'max_bytes': 0, 'bytes': 0, 'entries': OrderedDict(), 'hits': 0, 'misses': 0,
+          'lock': threading.Lock()}
+# decoded cubes of files read by load_cached, most recently used last
+# max_bytes of 0 means that nothing is cached, see set_cache_size
+
+
+def data_root():
+    """
+    Define the folder containing the radiosonde and model data, which can be changed
+    from the default for this particular case by setting the environment variable
+    NAWDEX_DATA_ROOT (e.g. to the folder written by synthetic_data.generate_dataset)
+    :return: folder path, ending in '/'
+    """
+    return os.path.join(os.environ.get('NAWDEX_DATA_ROOT',
+                                       '/home/users/pr902839/datasets/nawdex/radiosondes/'), '')
+
 
 def sonde_filepath(source):
     """
@@ -23,7 +46,7 @@ def sonde_filepath(source):
                    'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
     :return: file path
     """
-    return '/home/users/pr902839/datasets/nawdex/radiosondes/' + source + '/netcdf/'
+    return data_root() + source + '/netcdf/'
 
 
 def model_filepath(model):
@@ -32,7 +55,22 @@ def model_filepath(model):
     :param model: Code representing model, options for which are: 'UKMO', 'ECAN'
     :return:
     """
-    return '/home/users/pr902839/datasets/nawdex/radiosondes/' + model + '/'
+    return data_root() + model + '/'
+
+
+def output_folder(source, station_number):
+    """
+    Define the folder to which the 2D files for a station are saved, whose parent can be
+    changed from the default by setting the environment variable NAWDEX_OUTPUT_ROOT
+    :param source: Code representing origin of data, options for which are: 
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: 4-6 digit identifier of particular station from which 
+                           sonde was released
+    :return: folder path
+    """
+    return os.path.join(os.environ.get('NAWDEX_OUTPUT_ROOT',
+                                       '/home/users/bn826011/PhD/radiosonde/NAWDEX_timeseries/high_res/'),
+                        source + '_' + station_number)
 
 
 def def_filename(source, station_number, time):
@@ -47,6 +85,119 @@ def def_filename(source, station_number, time):
     :return: file name
     """
     return source + '_' + station_number + '_' + time.strftime('%Y%m%d_%H%M') + '*.nc'
+
+
+def set_cache_size(max_bytes):
+    """
+    Set the memory available to the cache of decoded files below read_data, evicting the
+    least recently used files if it is now too full
+    :param max_bytes: number, maximum size in bytes of the cached arrays, 0 to switch off caching
+    """
+    with _cache['lock']:
+        _cache['max_bytes'] = max_bytes
+        evict_cache()
+
+
+def clear_cache():
+    """
+    Remove all files from the cache and reset its counts of hits and misses
+    """
+    with _cache['lock']:
+        _cache['entries'] = OrderedDict()
+        _cache['bytes'] = 0
+        _cache['hits'] = 0
+        _cache['misses'] = 0
+
+
+def cache_info():
+    """
+    :return: dictionary of the number of entries, bytes used, maximum bytes, hits and misses of the cache
+    """
+    return {'entries': len(_cache['entries']), 'bytes': _cache['bytes'], 'max_bytes': _cache['max_bytes'],
+            'hits': _cache['hits'], 'misses': _cache['misses']}
+
+
+def evict_cache():
+    """
+    Remove the least recently used files from the cache until it fits within its maximum size
+    Should be called with the cache lock held
+    """
+    while _cache['entries'] and _cache['bytes'] > _cache['max_bytes']:
+        key, (cubelist, nbytes) = _cache['entries'].popitem(last = False)
+        _cache['bytes'] -= nbytes
+
+
+def cubelist_nbytes(cubelist):
+    """
+    :param cubelist: CubeList whose data have been loaded
+    :return: number of bytes of the data and coordinate points of all cubes
+    """
+    nbytes = 0
+    for cube in cubelist:
+        nbytes += cube.data.nbytes
+        for coord in cube.coords():
+            nbytes += coord.points.nbytes
+    return nbytes
+
+
+def load_cached(filepattern, variables):
+    """
+    Equivalent of iris.load which keeps the decoded cubes in memory, such that files read
+    repeatedly (UKMO files once per lead time, reruns of single ascents) are only decoded once
+    Cached files are identified by the paths and modification times of the files matching
+    the pattern and by the variables, and copies are returned so that changes made to the
+    cubes afterwards (units, names, filtering) do not change the cached cubes
+    :param filepattern: file path and name, including wildcards
+    :param variables: list of names of variables to load, as for iris.load
+    :return: CubeList
+    """
+    if not _cache['max_bytes']:
+        return iris.load(filepattern, variables)
+
+    filenames = sorted(glob.glob(filepattern))
+    if not filenames:
+        return iris.load(filepattern, variables)
+        # which raises the usual error if there are no such files
+
+    key = (tuple((filename, os.path.getmtime(filename)) for filename in filenames),
+           None if variables is None else tuple(variables))
+
+    with _cache['lock']:
+        if key in _cache['entries']:
+            cubelist, nbytes = _cache['entries'].pop(key)
+            _cache['entries'][key] = (cubelist, nbytes)
+            # re-inserted as the most recently used
+            _cache['hits'] += 1
+            return iris.cube.CubeList([cube.copy() for cube in cubelist])
+        _cache['misses'] += 1
+
+    cubelist = iris.load(filenames, variables)
+    nbytes = cubelist_nbytes(cubelist)
+    # also loads the data of each cube, so that decoded arrays are cached
+
+    with _cache['lock']:
+        if nbytes <= _cache['max_bytes'] and key not in _cache['entries']:
+            _cache['entries'][key] = (cubelist, nbytes)
+            _cache['bytes'] += nbytes
+            evict_cache()
+
+    return iris.cube.CubeList([cube.copy() for cube in cubelist])
+
+
+def data_filepattern(source, station_number, time, model = None):
+    """
+    Full path, including wildcards, of the file read by read_data for a single ascent
+    :param source: Code representing origin of data, options for which are: 
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: 4-6 digit identifier of particular station 
+                           from which sonde was released
+    :param time: datetime object of the time of the release of the sonde
+    :param model: None or 'sonde' for sonde data, otherwise 'UKMO' or 'ECAN'
+    :return: file path and name
+    """
+    if model == None or model == 'sonde':
+        return sonde_filepath(source) + def_filename(source, station_number, time)
+    return model_filepath(model) + def_filename(source, station_number, time)
     
     
 def UKMO_pressure_double_fix(cubelist):
@@ -156,7 +307,7 @@ def add_ECAN_metadata(filepath, filename, cubelist_original, a = 6371229.0):
     #cubelist = cubelist_original.copy()
     cubelist = cubelist_original
     
-    metalist = iris.load(filepath+filename, ['AN_TIME', 'LAT', 'LON'])
+    metalist = load_cached(filepath+filename, ['AN_TIME', 'LAT', 'LON'])
     
     T = metalist[0].data
     # list of strings detailing the time of launch
@@ -301,11 +452,10 @@ def make_alt_cube(test_cube):
     :return: cube of altitude
     """
     
-    alt = test_cube.copy()
-    
     alt_coord = test_cube.coord('altitude')
     
-    alt.data = alt_coord.points
+    alt = cube_like(test_cube, alt_coord.points.copy())
+    # a copy, as the points of the coordinate must not change with the data of the cube
     alt.standard_name = alt_coord.standard_name
     alt.units = alt_coord.units
     alt.var_name = alt_coord.var_name
@@ -341,7 +491,8 @@ def read_data(source, station_number, time, cf_variables = None, model = None, l
     variables = change_names_from_CF(cf_variables, model)
     # change the array of names to those names in the source file
 
-    cubelist = iris.load(filepath + filename, variables)
+    cubelist = load_cached(filepath + filename, variables)
+    # same as iris.load unless the cache has been switched on by set_cache_size
 
     # extract appropriate data & metatata
     if model == 'UKMO':
@@ -388,5 +539,9 @@ def read_data(source, station_number, time, cf_variables = None, model = None, l
         cube.attributes['station_number'] = station_number
         # as files are identified by these strings, it is useful to identify
         # the cubes with them also
+
+        if precision.is_reduced():
+            cube.data = precision.as_working(cube.data)
+            # hold the data in the precision set by precision.set_precision
     
     return cubelist
\ No newline at end of file
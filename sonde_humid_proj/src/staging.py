@@ -0,0 +1,218 @@
+"""
+Collection of functions to stage the input files of a set of stations from the shared
+filesystem onto local scratch disk, such that repeated processing reads from local disk
+
+Files are hardlinked where possible and otherwise copied, several at a time, and are
+checked against the size and modification time of the original. read_data is pointed at
+the staged copies by setting the data root (see read_files.data_root). Least recently
+used files are evicted when the scratch folder grows beyond a set size
+
+Usage:
+    with staging.staged(['EMN', '03808'], '/scratch/nawdex', max_bytes = 50e9):
+        concatenate.concatenate_cubelist_dictionary('EMN', '03808')
+"""
+import os
+import glob
+import shutil
+import time
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from read_files import data_root, data_filepattern
+from concatenate import create_datetime_list
+
+MODELS = [None, 'UKMO', 'ECAN']
+# None indicates sonde data, as in read_data
+
+
+def station_files(source, station_number):
+    """
+    List the input files read when processing all ascents of a station
+    :param source: Code representing origin of data, options for which are:
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: string, 4-6 digit identifier of particular station
+                           from which sonde was released
+    :return: list of file paths relative to the data root
+    """
+    root = data_root()
+    files = []
+    for time_release in create_datetime_list(source, station_number):
+        for model in MODELS:
+            for filename in sorted(glob.glob(data_filepattern(source, station_number, time_release, model))):
+                files.append(os.path.relpath(filename, root))
+    return files
+
+
+def is_verified(original, copy):
+    """
+    Check that a staged copy matches the original by size and modification time
+    :param original: string, path of original file
+    :param copy: string, path of staged copy
+    :return: True if the copy exists and matches
+    """
+    if not os.path.exists(copy):
+        return False
+    original_stat = os.stat(original)
+    copy_stat = os.stat(copy)
+    return (original_stat.st_size == copy_stat.st_size and
+            abs(original_stat.st_mtime - copy_stat.st_mtime) < 1)
+
+
+def mark_used(path):
+    """
+    Set the access time of a file to now, leaving its modification time unchanged,
+    so that it counts as recently used for eviction
+    :param path: string, file path
+    """
+    os.utime(path, (time.time(), os.stat(path).st_mtime))
+
+
+def stage_file(relative_path, root, scratch, link = True):
+    """
+    Hardlink or copy a single file from root to scratch, unless a verified copy is already there
+    :param relative_path: string, path of file relative to root
+    :param root: string, folder of original data
+    :param scratch: string, local folder to stage data to
+    :param link: if True, try to hardlink before copying
+    :return: number of bytes copied (zero if the file was already staged or was hardlinked)
+    """
+    original = os.path.join(root, relative_path)
+    copy = os.path.join(scratch, relative_path)
+
+    if is_verified(original, copy):
+        mark_used(copy)
+        return 0
+
+    folder = os.path.dirname(copy)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # another thread may have made the same folder in the meantime
+            if not os.path.isdir(folder):
+                raise
+    if os.path.exists(copy):
+        os.remove(copy)
+
+    copied = 0
+    if link:
+        try:
+            os.link(original, copy)
+        except OSError:
+            # hardlinks are not possible between different filesystems
+            link = False
+    if not link:
+        temporary = copy + '.part'
+        shutil.copy2(original, temporary)
+        os.rename(temporary, copy)
+        copied = os.path.getsize(copy)
+
+    if not is_verified(original, copy):
+        raise IOError('staged copy of ' + original + ' does not match the original')
+    mark_used(copy)
+
+    return copied
+
+
+def scratch_files(scratch):
+    """
+    :param scratch: string, local folder of staged data
+    :return: list of (access time, size, path) of all files in the folder, oldest first
+    """
+    files = []
+    for folder, subfolders, filenames in os.walk(scratch):
+        for filename in filenames:
+            path = os.path.join(folder, filename)
+            stat = os.stat(path)
+            files.append((stat.st_atime, stat.st_size, path))
+    return sorted(files)
+
+
+def evict(scratch, max_bytes, keep = ()):
+    """
+    Remove the least recently used files until the scratch folder is no larger than max_bytes
+    :param scratch: string, local folder of staged data
+    :param max_bytes: number, maximum total size of files in bytes
+    :param keep: collection of paths which should not be removed, e.g. those currently in use
+    :return: number of bytes removed
+    """
+    files = scratch_files(scratch)
+    total = sum(size for atime, size, path in files)
+    removed = 0
+    keep = set(os.path.abspath(path) for path in keep)
+
+    for atime, size, path in files:
+        if total - removed <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        os.remove(path)
+        removed += size
+
+    return removed
+
+
+def stage_stations(stations, scratch, threads = 8, link = True, max_bytes = None):
+    """
+    Stage the input files of several stations to local scratch disk, one station at a time
+    If max_bytes is given, least recently used files are evicted before each station is staged,
+    to leave room for it, keeping only the files of that station; so files of earlier stations
+    in the list may be evicted, and stations should be staged one at a time as they are used
+    :param stations: list of [source, station_number] pairs
+    :param scratch: string, local folder to stage data to
+    :param threads: integer, number of files staged at once
+    :param link: if True, hardlink files where possible rather than copying them
+    :param max_bytes: number, maximum size of the scratch folder in bytes, or None for no limit
+    :return: list of paths of staged files relative to the scratch folder
+    """
+    root = data_root()
+    files = []
+    copied = 0
+
+    pool = ThreadPool(threads)
+    try:
+        for source, station_number in stations:
+            station = station_files(source, station_number)
+
+            if max_bytes is not None:
+                needed = sum(os.path.getsize(os.path.join(root, relative_path)) for relative_path in station
+                             if not is_verified(os.path.join(root, relative_path),
+                                                os.path.join(scratch, relative_path)))
+                evict(scratch, max(max_bytes - needed, 0),
+                      keep = [os.path.join(scratch, relative_path) for relative_path in station])
+
+            copied += sum(pool.map(lambda relative_path: stage_file(relative_path, root, scratch, link),
+                                   station))
+            files += station
+    finally:
+        pool.close()
+        pool.join()
+
+    print('staged ' + str(len(files)) + ' files, copying ' + str(copied) + ' bytes')
+    return files
+
+
+@contextmanager
+def staged(stations, scratch, threads = 8, link = True, max_bytes = None):
+    """
+    Context manager staging the input files of stations, within which read_data reads the staged copies
+    :param stations: list of [source, station_number] pairs, or a single pair
+    :param scratch: string, local folder to stage data to
+    :param threads: integer, number of files staged at once
+    :param link: if True, hardlink files where possible rather than copying them
+    :param max_bytes: number, maximum size of the scratch folder in bytes, or None for no limit
+    """
+    if stations and not isinstance(stations[0], (list, tuple)):
+        stations = [stations]
+
+    stage_stations(stations, scratch, threads, link, max_bytes)
+
+    previous = os.environ.get('NAWDEX_DATA_ROOT')
+    os.environ['NAWDEX_DATA_ROOT'] = scratch
+    try:
+        yield scratch
+    finally:
+        if previous is None:
+            del os.environ['NAWDEX_DATA_ROOT']
+        else:
+            os.environ['NAWDEX_DATA_ROOT'] = previous
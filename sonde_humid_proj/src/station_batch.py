@@ -0,0 +1,394 @@
+"""
+Station-batch mode: process all ascents of a station at once, held as NaN-padded 2D arrays
+(ascents x levels) with the number of valid levels of each ascent, rather than one profile
+at a time through process_single_ascent and re_grid_trop_0
+
+Humidity fields, smoothing, tropopause detection and re-gridding relative to the tropopause
+are each carried out as array operations on all ascents together. One ascent of each product
+is also processed in the usual way, to provide the names, units, attributes and order of the
+cubes, so that the files saved are the same as those of concatenate_cubelist_dictionary
+"""
+from __future__ import division
+
+import numpy as np
+import iris
+from scipy.interpolate import interp1d
+from scipy.signal import savgol_filter
+
+import calculate
+from my_filters import gaussian_kernel_smooth_2d
+from make_cubes import cube_like
+from process_data import read_ascent, process_cubelist
+from re_grid import PRODUCTS, GRID_DIC, grid_levels, grid_attribute, re_grid_levels
+from concatenate import create_datetime_list, save_station
+from transport import cube_descriptor, station_coords
+import instrument
+import precision
+import quality_control
+
+
+def is_profile(cube):
+    """
+    :param cube: cube
+    :return: True if the cube is a vertical profile, rather than a scalar
+    """
+    return not (cube.shape == (1,) or cube.shape == ())
+
+
+def pad_profiles(cubelists):
+    """
+    Put the vertical profiles of each variable from several ascents into one 2D array
+    Masked values are replaced by nan, and the arrays are in the precision set by
+    precision.set_precision
+    :param cubelists: list of CubeLists, one for each ascent
+    :return: dictionary of arrays (ascents x levels) padded with nan, with the names
+             of the cubes as keys, and array of the number of valid levels of each ascent
+    """
+    lengths = np.array([max([cube.shape[0] for cube in cubelist if is_profile(cube)])
+                        for cubelist in cubelists])
+    arrays = {}
+
+    for row, cubelist in enumerate(cubelists):
+        for cube in cubelist:
+            if is_profile(cube):
+                if cube.name() not in arrays:
+                    arrays[cube.name()] = np.zeros((len(cubelists), lengths.max()),
+                                                   dtype = precision.get_dtype()) + np.nan
+                arrays[cube.name()][row, :cube.shape[0]] = np.ma.filled(cube.data.astype(float), np.nan)
+
+    return arrays, lengths
+
+
+def add_humidity_fields_2d(arrays, dtype):
+    """
+    Equivalent of process_data.add_humidity_fields for the arrays of all ascents
+    :param arrays: dictionary of arrays (ascents x levels) from pad_profiles
+    :param dtype: string, origin of data: 'sonde', 'UKMO', 'ECAN'
+    :return: dictionary of arrays with fields of altitude, p, T, theta, q, RHi, RHw and RH
+    """
+    pressure = arrays['air_pressure']
+    # only the new fields are allocated, with temporaries held in the workspace of calculate
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+
+        if dtype == 'UKMO':
+            arrays['air_temperature'] = calculate.temp_from_theta(arrays['air_potential_temperature'],
+                                                                  pressure, out = np.empty_like(pressure))
+        else:
+            arrays['air_potential_temperature'] = calculate.theta_from_temp(arrays['air_temperature'],
+                                                                            pressure, out = np.empty_like(pressure))
+
+        if dtype == 'sonde':
+            partial_pressure = calculate.workspace('add_humidity_fields_2d', 'partial_pressure',
+                                                   pressure.shape, pressure.dtype)
+            calculate.svpw_from_temp(arrays['dew_point_temperature'], out = partial_pressure)
+            calculate.partial_from_vapour(partial_pressure, arrays['air_temperature'], pressure,
+                                          out = partial_pressure)
+            arrays['specific_humidity'] = calculate.q_from_partialpressure(partial_pressure, pressure,
+                                                                           out = np.empty_like(pressure))
+
+        vapour_pres = calculate.vapour_pressure_from_q(arrays['specific_humidity'], pressure,
+                                                       out = calculate.workspace('add_humidity_fields_2d',
+                                                                                 'vapour_pressure', pressure.shape,
+                                                                                 pressure.dtype))
+        for state in ['liquid_water', 'ice', 'mixed']:
+            name = 'relative_humidity' if state == 'mixed' else 'relative_humidity_' + state
+            arrays[name] = calculate.RH_from_vapourpressure(vapour_pres, arrays['air_temperature'], state,
+                                                            out = np.empty_like(pressure))
+
+    return arrays
+
+
+def filter_arrays(arrays, lengths, filter_dic):
+    """
+    Equivalent of my_filters.filter_cubelist for the arrays of all ascents, smoothing
+    every variable except altitude
+    :param arrays: dictionary of arrays (ascents x levels) from pad_profiles
+    :param lengths: array of the number of valid levels of each ascent
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :return: dictionary of smoothed arrays
+    """
+    names = [name for name in arrays if name != 'altitude']
+
+    if filter_dic['name'] == 'kernel':
+
+        smoothed = gaussian_kernel_smooth_2d(np.array([arrays[name] for name in names]), arrays['altitude'],
+                                             filter_dic['gaussian_half_width'],
+                                             filter_dic['window_half_width'], lengths)
+        # all variables are smoothed together, as the weights depend only on altitude
+        for name, array in zip(names, smoothed):
+            arrays[name] = array
+
+    elif filter_dic['name'] == 'savgol':
+
+        for name in names:
+            for row, length in enumerate(lengths):
+                arrays[name][row, :length] = savgol_filter(arrays[name][row, :length],
+                                                           filter_dic['window'], filter_dic['order'])
+
+    else:
+
+        print('No filter')
+
+    return arrays
+
+
+def process_arrays(cubelists, dtype, filter_dic, lead_time = 0):
+    """
+    Equivalent of process_data.process_cubelist for all ascents of a station
+    :param cubelists: list of CubeLists as returned by read_ascent, one for each ascent
+    :param dtype: string, origin of data: 'sonde', 'UKMO', 'ECAN'
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param lead_time: time in days before the verification time that the forecast was started
+    :return: dictionary of arrays (ascents x levels), array of the number of valid levels,
+             and arrays of the tropopause altitude and flag of each ascent
+    """
+    arrays, lengths = pad_profiles(cubelists)
+
+    with instrument.stage('add_humidity_fields_2d', product = dtype, lead_time = lead_time):
+        arrays = add_humidity_fields_2d(arrays, dtype)
+
+    if dtype == 'sonde':
+        with instrument.stage('filter_arrays', product = dtype, lead_time = lead_time):
+            arrays = filter_arrays(arrays, lengths, filter_dic)
+
+    with instrument.stage('tropopause_height_2d', product = dtype, lead_time = lead_time):
+        trop_alt, flags = calculate.tropopause_height_2d(arrays['air_temperature'], arrays['altitude'], lengths)
+
+    return arrays, lengths, trop_alt, flags
+
+
+def re_grid_arrays(arrays, lengths, dimension, new_dimension, kind = 'linear'):
+    """
+    Equivalent of re_grid.re_grid_levels for the arrays of all ascents
+    Linear interpolation is carried out for all variables and ascents at once, with the
+    same arithmetic as scipy's interp1d; other kinds use interp1d for each ascent
+    :param arrays: dictionary of arrays (ascents x levels) of the variables
+    :param lengths: array of the number of valid levels of each ascent
+    :param dimension: array (ascents x levels) of previous dimension
+    :param new_dimension: list or array of levels of the new dimension, in increasing order
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :return: dictionary of arrays (ascents x new levels) of the variables
+    """
+    new_dimension = np.asarray(new_dimension)
+    names = list(arrays)
+    values = np.array([arrays[name] for name in names])
+    rows = np.arange(len(lengths))[:, np.newaxis]
+
+    if kind != 'linear':
+        new_values = np.zeros((len(names), len(lengths), len(new_dimension))) + np.nan
+        for row, length in enumerate(lengths):
+            new_values[:, row] = interp1d(dimension[row, :length], values[:, row, :length], kind,
+                                          bounds_error = False)(new_dimension)
+        return dict(zip(names, precision.as_working(new_values)))
+
+    order = np.zeros(dimension.shape, dtype = int)
+    sorted_dimension = np.zeros(dimension.shape) + np.nan
+    upper_index = np.zeros((len(lengths), len(new_dimension)), dtype = int)
+
+    for row, length in enumerate(lengths):
+        # only the sorting and searching of each ascent's dimension are done ascent by ascent
+        order[row, :length] = np.argsort(dimension[row, :length], kind = 'mergesort')
+        sorted_dimension[row, :length] = dimension[row, order[row, :length]]
+        upper_index[row] = np.clip(np.searchsorted(sorted_dimension[row, :length], new_dimension),
+                                   1, length - 1)
+    lower_index = upper_index - 1
+
+    x_lo = sorted_dimension[rows, lower_index]
+    x_hi = sorted_dimension[rows, upper_index]
+    y_lo = values[:, rows, order[rows, lower_index]]
+    y_hi = values[:, rows, order[rows, upper_index]]
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        slope = (y_hi - y_lo)/(x_hi - x_lo)
+        new_values = slope*(new_dimension - x_lo) + y_lo
+
+    outside = ((new_dimension < sorted_dimension[:, :1]) |
+               (new_dimension > sorted_dimension[rows[:, 0], lengths - 1][:, np.newaxis]))
+    new_values[:, outside] = np.nan
+    # as interp1d with bounds_error = False
+
+    return dict(zip(names, precision.as_working(new_values)))
+
+
+def template_cubelist(cubelist, dtype, filter_dic, kind, trop_alt, lead_time = 0, grid_dic = GRID_DIC):
+    """
+    Process and re-grid a copy of a single ascent in the usual way, to give the cubes
+    of the output of the batch
+    :param cubelist: CubeList as returned by read_ascent
+    :param dtype: string, origin of data: 'sonde', 'UKMO', 'ECAN'
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param kind: integer specifying the order of the spline interpolator to use
+    :param trop_alt: number, tropopause altitude of the ascent
+    :param lead_time: time in days before the verification time that the forecast was started
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see re_grid.grid_levels
+    :return: CubeList of re-gridded cubes, as in the output of re_grid_trop_0
+    """
+    cubelist = iris.cube.CubeList([cube.copy() for cube in cubelist])
+    cubelist = process_cubelist(cubelist, dtype, filter_dic, 0, lead_time)[0]
+
+    altitude = cubelist.extract(iris.Constraint(name = 'altitude'))[0]
+    reference_altitude = cube_like(altitude, altitude.data - trop_alt)
+
+    cubelist = re_grid_levels(cubelist, reference_altitude, grid_levels(grid_dic), kind)
+    for cube in cubelist:
+        cube.attributes['tropopause_relative_grid'] = grid_attribute(grid_dic)
+
+    return cubelist
+
+
+def station_cubelist(template, gridded, trop_alt, cubelists):
+    """
+    Build the 2D cubes of a product from the re-gridded arrays of all ascents
+    :param template: CubeList of one re-gridded ascent from template_cubelist
+    :param gridded: dictionary of re-gridded arrays (ascents x levels)
+    :param trop_alt: array of the tropopause altitude of each ascent found from this product
+    :param cubelists: list of CubeLists as returned by read_ascent, one for each ascent,
+                      from which the values of scalar cubes and times are taken
+    :return: CubeList of 2D cubes in time & alt, as produced by merging the re-gridded
+             cubelists of each ascent
+    """
+    time = template.extract(iris.Constraint(name = 'altitude'))[0].coord('time')
+    time_points = [cubelist.extract(iris.Constraint(name = 'altitude'))[0].coord('time').points[0]
+                   for cubelist in cubelists]
+    time_coord = iris.coords.DimCoord(time_points, standard_name = time.standard_name,
+                                      long_name = time.long_name, var_name = time.var_name,
+                                      units = time.units)
+
+    twoD_cubelist = iris.cube.CubeList([])
+
+    for cube in template:
+
+        if is_profile(cube):
+            data = gridded[cube.name()]
+            dim_coords = [(time_coord, 0), (cube.coord(dimensions = 0), 1)]
+            aux_coords = []
+        elif cube.name() == 'tropopause_altitude':
+            data = trop_alt
+            dim_coords = [(time_coord, 0)]
+            aux_coords = []
+        else:
+            ascent_cubes = [cubelist.extract(iris.Constraint(name = cube.name()))[0] for cubelist in cubelists]
+            data = np.array([np.asarray(ascent_cube.data) for ascent_cube in ascent_cubes])
+            coords = station_coords([cube_descriptor(ascent_cube) for ascent_cube in ascent_cubes])
+            dim_coords = coords[:1]
+            aux_coords = coords[1:]
+
+        twoD_cubelist.append(iris.cube.Cube(data, standard_name = cube.standard_name,
+                                            long_name = cube.long_name, var_name = cube.var_name,
+                                            units = cube.units, attributes = cube.attributes,
+                                            dim_coords_and_dims = dim_coords,
+                                            aux_coords_and_dims = aux_coords))
+
+    return twoD_cubelist
+
+
+def read_ascents(source, station_number, times, dtype, lead_time = 0, qc_dic = None):
+    """
+    Read one product for several ascents
+    :param qc_dic: dictionary specifying the quality control of each ascent, see quality_control,
+                   if None there is none
+    :return: list of CubeLists, with None for ascents which could not be read or were
+             rejected by quality control
+    """
+    cubelists = []
+    for time in times:
+        try:
+            cubelist = read_ascent(source, station_number, time, dtype, lead_time)
+        except Exception as e:
+            print(source + '_' + station_number + '_' + time.strftime('%Y%m%d_%H%M') + ' ' +
+                  dtype + ' could not be read')
+            print(e)
+            cubelists.append(None)
+            continue
+        if qc_dic is not None:
+            cubelist, qc_flags = quality_control.quality_control(cubelist, qc_dic)
+            if quality_control.is_rejected(qc_flags):
+                print(source + '_' + station_number + '_' + time.strftime('%Y%m%d_%H%M') + ' ' + dtype +
+                      ' rejected by quality control: ' + ', '.join(quality_control.flag_names(qc_flags)))
+                cubelist = None
+        cubelists.append(cubelist)
+    return cubelists
+
+
+def batch_station(source, station_number, filter_dic = {'name' : 'kernel', 'gaussian_half_width' : 50,
+                                                        'window_half_width' : 200},
+                  kind = 'linear', save = True, grid_dic = GRID_DIC, qc_dic = quality_control.NO_QC_DIC,
+                  ragged = False):
+    """
+    Station-batch equivalent of concatenate.concatenate_cubelist_dictionary
+    As there, ascents for which no tropopause is found from the sonde are not used
+    :param source: Code representing origin of data, options for which are:
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: 4-6 digit identifier of particular station from which
+                           sonde was released
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param save: if True, add gradient fields and save the files, as save_station
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see re_grid.grid_levels
+    :param qc_dic: dictionary specifying the quality control of the sondes, see quality_control,
+                   default none, e.g. quality_control.QC_DIC for the standard checks;
+                   ascents it rejects are not used
+    :param ragged: if True, save ragged .npz files rather than netCDF, see concatenate.save_station
+    :return: dictionary of 2D cubelists for the sonde, ukmo analysis and 1, 3 and 5 day
+             forecasts, and ECMWF analyses
+    """
+    datetime_list = create_datetime_list(source, station_number)
+
+    if not datetime_list:
+        return source + '_' + station_number + ' ascents not found'
+
+    instrument.set_context(station = source + '_' + station_number)
+
+    # sondes first, such that model data are only read for ascents which can be used
+    sondes = read_ascents(source, station_number, datetime_list, 'sonde', qc_dic = qc_dic)
+    read = [n for n in range(len(datetime_list)) if sondes[n] is not None]
+    sonde_arrays = process_arrays([sondes[n] for n in read], 'sonde', filter_dic)
+    usable = [n for n, flag in zip(read, sonde_arrays[3]) if flag == 0]
+    # as re_grid_trop_0 with throw_flag, disregard the ascent if the sonde raised a flag
+
+    cubelists = {'sonde': sondes}
+    for key, dtype, lead_time in PRODUCTS:
+        if key != 'sonde':
+            cubelists[key] = [None]*len(datetime_list)
+            times = [datetime_list[n] for n in usable]
+            for n, cubelist in zip(usable, read_ascents(source, station_number, times, dtype, lead_time)):
+                cubelists[key][n] = cubelist
+    usable = [n for n in usable if all(cubelists[key][n] is not None for key in cubelists)]
+
+    if not usable:
+        instrument.clear_context()
+        return source + '_' + station_number + ' no ascents could be used'
+
+    twoD_cubelist_dictionary = {}
+    trop_alt = None
+
+    for key, dtype, lead_time in PRODUCTS:
+        # sonde is first, giving the tropopause altitude to which all products are re-gridded
+        product_cubelists = [cubelists[key][n] for n in usable]
+        if key == 'sonde':
+            rows = [read.index(n) for n in usable]
+            arrays, lengths, product_trop_alt = [dict((name, array[rows]) for name, array in
+                                                      sonde_arrays[0].items()),
+                                                 sonde_arrays[1][rows], sonde_arrays[2][rows]]
+            # already processed above, so only the usable ascents are selected
+            trop_alt = product_trop_alt
+        else:
+            arrays, lengths, product_trop_alt, flags = process_arrays(product_cubelists, dtype, filter_dic,
+                                                                      lead_time)
+
+        with instrument.stage('re_grid_arrays', product = key):
+            gridded = re_grid_arrays(arrays, lengths, arrays['altitude'] - trop_alt[:, np.newaxis],
+                                     grid_levels(grid_dic), kind)
+
+        template = template_cubelist(product_cubelists[0], dtype, filter_dic, kind, trop_alt[0], lead_time,
+                                     grid_dic)
+        twoD_cubelist_dictionary[key] = station_cubelist(template, gridded, product_trop_alt,
+                                                         product_cubelists)
+
+    if save:
+        twoD_cubelist_dictionary = save_station(source, station_number, twoD_cubelist_dictionary,
+                                                merged = True, ragged = ragged)
+
+    instrument.clear_context()
+
+    return twoD_cubelist_dictionary
@@ -0,0 +1,247 @@
+"""
+Per-ascent table of the scalar quantities of each station, saved alongside the 2D files,
+so that tropopause timeseries and other scalar analyses need not load the 2D fields
+
+The table is a dictionary of columns, one row for each ascent of each product, saved as an
+.npz file of 1D arrays with the names of SUMMARY_COLUMNS. Times are in hours since
+1970-01-01 00:00:00, as the time coordinates of the cubes
+    'station':                       source and station number, e.g. 'EMN_03882'
+    'product':                       key of re_grid.PRODUCTS, e.g. 'ukmo3'
+    'lead_time':                     days before the verification time that the forecast was started
+    'release_time':                  time of release of the sonde
+    'time':                          verification time
+    'latitude', 'longitude':         position of the station, degrees, the same for every product
+    'tropopause_altitude':           tropopause altitude found from the product, m
+    'reference_tropopause_altitude': altitude of the tropopause to which the product was re-gridded, m
+    'tropopause_source':             product providing the reference tropopause: 'sonde', 'ukmo', 'ecan'
+    'profile_bottom', 'profile_top': altitude of the lowest and highest valid re-gridded levels, m
+    'quality_control_flags':         flags of the sonde of the ascent, see quality_control
+    'wall_time':                     total time of all recorded stages of the ascent, s (nan if not recorded)
+
+Tables of several stations are joined by load_summary, and rows chosen by select
+"""
+from __future__ import division
+
+import datetime
+import warnings
+
+import iris
+import numpy as np
+
+import instrument
+
+SUMMARY_COLUMNS = ['station', 'product', 'lead_time', 'release_time', 'time', 'latitude', 'longitude',
+                   'tropopause_altitude', 'reference_tropopause_altitude', 'tropopause_source',
+                   'profile_bottom', 'profile_top', 'quality_control_flags', 'wall_time']
+
+SUMMARY_FILENAME = 'ascent_summary.npz'
+
+LEAD_TIMES = [('sonde', 0), ('ukmo', 0), ('ukmo1', 1), ('ukmo3', 3), ('ukmo5', 5), ('ecan', 0)]
+# products in order, with lead times in days, as re_grid.PRODUCTS, which is not imported
+# so that reading tables does not need the pipeline
+
+TROPOPAUSE_SOURCES = ['sonde', 'ukmo', 'ecan']
+# in the order re_grid_trop_0 falls back from one to the next
+
+
+def cube_data(cubelist, name):
+    """
+    :param cubelist: CubeList
+    :param name: string, name of cube
+    :return: array of the data of the first cube of that name as float, or None if there is none
+    """
+    cubes = cubelist.extract(iris.Constraint(name = name))
+    if not cubes:
+        return None
+    return np.ma.filled(np.asanyarray(cubes[0].data, dtype = float), np.nan)
+
+
+def station_position(twoD_cubelist_dictionary):
+    """
+    :param twoD_cubelist_dictionary: dictionary of 2D cubelists of each product
+    :return: latitude and longitude of the station, from the stationLatitude and stationLongitude
+             attributes of the sonde, or else the mean of the latitude and longitude cubes of a
+             model product, which have one value for each ascent, nan if there are neither
+    """
+    for key, lead_time in LEAD_TIMES:
+        cubelist = twoD_cubelist_dictionary.get(key)
+        if cubelist is None:
+            continue
+        attributes = cubelist.extract(iris.Constraint(name = 'altitude'))[0].attributes
+        if 'stationLatitude' in attributes and 'stationLongitude' in attributes:
+            return float(attributes['stationLatitude']), float(attributes['stationLongitude'])
+        latitude = cube_data(cubelist, 'latitude')
+        longitude = cube_data(cubelist, 'longitude')
+        if (latitude is not None and longitude is not None and latitude.ndim <= 1 and longitude.ndim <= 1
+                and not np.isnan(latitude).all() and not np.isnan(longitude).all()):
+            # the latitude and longitude cubes of the sonde are 2D profiles of its displacement
+            return np.nanmean(latitude), np.nanmean(longitude)
+    return np.nan, np.nan
+
+
+def reference_tropopause(altitude):
+    """
+    :param altitude: 2D cube (time x tropopause-relative altitude) of the re-gridded altitude
+    :return: array of the altitude of the tropopause relative to which each ascent was re-gridded,
+             which is the altitude less the tropopause-relative level at every valid level
+    """
+    levels = altitude.coord(dimensions = 1).points
+    data = np.ma.filled(np.asanyarray(altitude.data, dtype = float), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # ascents with no valid levels give nan
+        return np.nanmedian(data - levels, axis = 1)
+
+
+def tropopause_source(reference, product_tropopauses, tolerance = 0.5):
+    """
+    :param reference: array of the reference tropopause altitude of each ascent
+    :param product_tropopauses: dictionary of arrays of the tropopause altitude found from each product
+    :param tolerance: number, m, within which altitudes are taken to be the same
+    :return: array of the name of the first product (as re_grid_trop_0) whose tropopause is the
+             reference, '' where none is
+    """
+    source = np.array([''] * len(reference), dtype = 'U5')
+    for key in TROPOPAUSE_SOURCES[::-1]:
+        if product_tropopauses.get(key) is not None and product_tropopauses[key].size == reference.size:
+            with np.errstate(invalid = 'ignore'):
+                source[np.abs(product_tropopauses[key].reshape(-1) - reference) < tolerance] = key
+    return source
+
+
+def hours_since_1970(time):
+    """
+    :param time: datetime object
+    :return: hours since 1970-01-01 00:00:00, as the time coordinates of the cubes
+    """
+    elapsed = time - datetime.datetime(1970, 1, 1)
+    return elapsed.days*24 + elapsed.seconds/3600
+
+
+def ascent_release_times(times, release_datetimes):
+    """
+    :param times: array of the verification times of the ascents, hours since 1970
+    :param release_datetimes: list of datetime objects of the release of the sondes, as used to
+                              read the ascents (see concatenate.create_datetime_list), or None
+    :return: array of the release time of each ascent, hours since 1970, that of the release
+             whose nearest 6-hourly verification time (as read_files.add_sonde_metadata) is the
+             time of the ascent, nan if there is none
+    """
+    release_times = np.zeros(len(times)) + np.nan
+    for release in np.array([hours_since_1970(time) for time in release_datetimes or []]):
+        release_times[(release - times >= -3) & (release - times < 3)] = release
+        # releases are up to 3 hours before or less than 3 hours after the verification time
+    return release_times
+
+
+def ascent_wall_times(station, release_times):
+    """
+    :param station: string, source and station number
+    :param release_times: array of release times, hours since 1970
+    :return: array of the total wall time of the recorded stages of each ascent, nan if none
+    """
+    wall_times = np.zeros(len(release_times)) + np.nan
+    for group in instrument.summarise(group_by = ('station', 'ascent')):
+        if group['station'] != station or not group['ascent']:
+            continue
+        hours = hours_since_1970(datetime.datetime.strptime(group['ascent'], '%Y%m%d_%H%M'))
+        # ascents are labelled by the time in the file name, as are the release times
+        wall_times[np.isclose(release_times, hours, rtol = 0, atol = 1e-3)] = group['wall_time']
+    return wall_times
+
+
+def station_summary(source, station_number, twoD_cubelist_dictionary, release_datetimes = None):
+    """
+    :param source: Code representing origin of data, options for which are:
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: 4-6 digit identifier of particular station from which
+                           sonde was released
+    :param twoD_cubelist_dictionary: dictionary of 2D cubelists of each product, as saved
+                                     by concatenate.save_station
+    :param release_datetimes: list of datetime objects of the release of the sondes, see
+                              ascent_release_times; if None the release times are nan
+    :return: dictionary of columns, one row for each ascent of each product
+    """
+    station = source + '_' + station_number
+    sonde = twoD_cubelist_dictionary.get('sonde')
+    tropopauses = dict((key, cube_data(cubelist, 'tropopause_altitude'))
+                       for key, cubelist in twoD_cubelist_dictionary.items())
+
+    latitude, longitude = station_position(twoD_cubelist_dictionary)
+
+    columns = dict((name, []) for name in SUMMARY_COLUMNS)
+    lead_times = dict(LEAD_TIMES)
+
+    for key in [key for key, lead_time in LEAD_TIMES if key in twoD_cubelist_dictionary]:
+        cubelist = twoD_cubelist_dictionary[key]
+        altitude = cubelist.extract(iris.Constraint(name = 'altitude'))[0]
+        times = altitude.coord('time').points
+        n_ascents = len(times)
+
+        def ascent_column(cubelist, name, fill):
+            # the rows of all products are the same ascents in order of time
+            data = cube_data(cubelist, name) if cubelist is not None else None
+            if data is None or data.size != n_ascents:
+                return np.zeros(n_ascents) + fill
+            return data.reshape(-1)
+
+        release_times = ascent_release_times(np.asarray(times, dtype = float), release_datetimes)
+        reference = reference_tropopause(altitude)
+        altitude_data = np.ma.filled(np.asanyarray(altitude.data, dtype = float), np.nan)
+
+        columns['station'].append(np.array([station] * n_ascents, dtype = 'U'))
+        columns['product'].append(np.array([key] * n_ascents, dtype = 'U'))
+        columns['lead_time'].append(np.zeros(n_ascents, dtype = int) + lead_times[key])
+        columns['release_time'].append(release_times)
+        columns['time'].append(np.asarray(times, dtype = float))
+        columns['latitude'].append(np.zeros(n_ascents) + latitude)
+        columns['longitude'].append(np.zeros(n_ascents) + longitude)
+        columns['tropopause_altitude'].append(ascent_column(cubelist, 'tropopause_altitude', np.nan))
+        columns['reference_tropopause_altitude'].append(reference)
+        columns['tropopause_source'].append(tropopause_source(reference, tropopauses))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            columns['profile_bottom'].append(np.nanmin(altitude_data, axis = 1))
+            columns['profile_top'].append(np.nanmax(altitude_data, axis = 1))
+        columns['quality_control_flags'].append(ascent_column(sonde, 'quality_control_flags', 0).astype(int))
+        columns['wall_time'].append(ascent_wall_times(station, release_times))
+
+    return dict((name, np.concatenate(column)) for name, column in columns.items())
+
+
+def save_summary(table, filename):
+    """
+    :param table: dictionary of columns, as from station_summary
+    :param filename: string, .npz file to write
+    """
+    np.savez(filename, **table)
+
+
+def load_summary(filenames):
+    """
+    Read and join the tables of one or more stations
+    :param filenames: string or list of strings, .npz files written by save_summary
+    :return: dictionary of columns
+    """
+    if not isinstance(filenames, (list, tuple)):
+        filenames = [filenames]
+
+    tables = []
+    for filename in filenames:
+        with np.load(filename) as npz:
+            tables.append(dict((name, npz[name]) for name in npz.files))
+
+    return dict((name, np.concatenate([table[name] for table in tables])) for name in tables[0])
+
+
+def select(table, **criteria):
+    """
+    :param table: dictionary of columns
+    :param criteria: keyword arguments of column names and the value, or list of values, of rows to keep,
+                     e.g. product = 'sonde' or station = ['EMN_03882', 'EMN_03005']
+    :return: dictionary of columns of the rows matching all criteria
+    """
+    rows = np.ones(len(table['station']), dtype = bool)
+    for name, value in criteria.items():
+        rows &= np.isin(table[name], np.atleast_1d(value))
+    return dict((name, column[rows]) for name, column in table.items())
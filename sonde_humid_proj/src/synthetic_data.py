@@ -0,0 +1,376 @@
+"""
+Collection of functions to write synthetic radiosonde, UKMO and ECAN files in the
+same format as the NAWDEX data read by read_files, together with matching file lists,
+so that the processing pipeline can be run and benchmarked away from the original data
+
+Usage, from a shell in this folder:
+    python -c "import synthetic_data; synthetic_data.generate_dataset('/tmp/nawdex')"
+    export NAWDEX_DATA_ROOT=/tmp/nawdex NAWDEX_FILE_LISTS=/tmp/nawdex/File_lists
+    export NAWDEX_OUTPUT_ROOT=/tmp/nawdex/output
+"""
+from __future__ import division
+
+import datetime
+import os
+
+import numpy as np
+from netCDF4 import Dataset, stringtochar
+
+import calculate
+from re_name_vars import CF_to_source_dict
+
+TIME_UNITS = 'hours since 1970-01-01 00:00:00'
+
+
+def hours_since_1970(time):
+    """
+    :param time: datetime object
+    :return: number of hours between 1970-01-01 00:00 and time
+    """
+    elapsed = time - datetime.datetime(1970, 1, 1)
+    return elapsed.days*24 + elapsed.seconds/(60*60)
+
+
+def verification_time(time):
+    """
+    Round a release time to the nearest 6-hourly verification time, as in read_files.select_lead_time
+    :param time: datetime object of the time of the release of the sonde
+    :return: datetime object of verification time
+    """
+    t = np.mod(time.hour, 6)
+    return time + datetime.timedelta(minutes = ((3-np.abs(t-3))*np.sign(t-2.5)*60-time.minute))
+
+
+def temperature_profile(altitude, surface_temperature, trop_altitude):
+    """
+    Temperature decreasing at 6.5 K/km up to the tropopause and increasing slowly above
+    :param altitude: array of altitude in m
+    :param surface_temperature: number, temperature at 0 m in K
+    :param trop_altitude: number, tropopause altitude in m
+    :return: array of temperature in K
+    """
+    trop_temperature = surface_temperature - 6.5e-3*trop_altitude
+    return np.where(altitude < trop_altitude, surface_temperature - 6.5e-3*altitude,
+                    trop_temperature + 1.5e-3*(altitude - trop_altitude))
+
+
+def pressure_profile(altitude, temperature, surface_pressure = 101325., R = 287.05, g = 9.80665):
+    """
+    Integrate the hydrostatic equation for pressure with the trapezium rule
+    :param altitude: array of altitude in m, increasing
+    :param temperature: corresponding array of temperature in K
+    :param surface_pressure: number, pressure at 0 m in Pa
+    :return: array of pressure in Pa
+    """
+    integrand = g/(R*temperature)
+    log_pressure = np.concatenate([[0], np.cumsum(0.5*(integrand[1:] + integrand[:-1])*np.diff(altitude))])
+    return surface_pressure*np.exp(-log_pressure - integrand[0]*altitude[0])
+
+
+def relative_humidity_profile(altitude, trop_altitude, rng):
+    """
+    Relative humidity with respect to liquid water, moist near the surface and dry in the
+    stratosphere, with a few randomly placed moist and dry layers
+    :param altitude: array of altitude in m
+    :param trop_altitude: number, tropopause altitude in m
+    :param rng: numpy RandomState
+    :return: array of relative humidity as a fraction
+    """
+    RH = 0.85*np.exp(-altitude/6000.) + 0.1
+    for layer in range(3):
+        centre = rng.uniform(500, trop_altitude)
+        RH += rng.uniform(-0.3, 0.3)*np.exp(-((altitude - centre)/rng.uniform(200, 1000))**2)
+    RH = np.where(altitude > trop_altitude, 0.02 + 0.1*np.exp(-(altitude - trop_altitude)/1000.), RH)
+    return np.clip(RH, 0.01, 1.)
+
+
+def dew_point_from_vapour_pressure(vapour_pressure, temperature, iterations = 6):
+    """
+    Invert calculate.svpw_from_temp by Newton's method on its logarithm
+    :param vapour_pressure: array of vapour pressure in Pa
+    :param temperature: array of temperature in K, used as first guess
+    :return: array of dew point temperature in K
+    """
+    dew_point = np.array(temperature, dtype = float)
+    for iteration in range(iterations):
+        dlogsvp = (6096.9385/dew_point**2 - 2.711193e-2 + 2*1.673952e-5*dew_point
+                   + 2.433502/dew_point)
+        dew_point -= (np.log(calculate.svpw_from_temp(dew_point)) - np.log(vapour_pressure))/dlogsvp
+    return dew_point
+
+
+def atmosphere(altitude, surface_temperature, trop_altitude, rng, temperature_noise = 0.):
+    """
+    Synthetic profile of the variables provided by the sonde and models
+    :param altitude: array of altitude in m, increasing
+    :param surface_temperature: number, temperature at 0 m in K
+    :param trop_altitude: number, tropopause altitude in m
+    :param rng: numpy RandomState
+    :param temperature_noise: standard deviation of random noise added to temperature in K
+    :return: dictionary of arrays with CF standard names as keys
+    """
+    T = temperature_profile(altitude, surface_temperature, trop_altitude)
+    T = T + temperature_noise*rng.standard_normal(len(altitude))
+    p = pressure_profile(altitude, T)
+    RH = relative_humidity_profile(altitude, trop_altitude, rng)
+    e = RH*calculate.svpw_from_temp(T)
+    jet = np.exp(-((altitude - trop_altitude)/3000.)**2)
+
+    return {'air_temperature': T,
+            'air_pressure': p,
+            'dew_point_temperature': dew_point_from_vapour_pressure(e, T),
+            'specific_humidity': calculate.q_from_partialpressure(e, p),
+            'air_potential_temperature': calculate.theta_from_temp(T, p),
+            'mass_fraction_of_cloud_liquid_water_in_air': np.where((RH > 0.9) & (T > 258.), 1e-4*(RH - 0.9), 0.),
+            'mass_fraction_of_cloud_ice_in_air': np.where((RH > 0.7) & (T < 258.), 2e-5*(RH - 0.7), 0.),
+            'x_wind': 8. + 30.*jet,
+            'y_wind': 5.*np.sin(altitude/4000.),
+            'upward_air_velocity': 0.1*np.sin(altitude/2000.)}
+
+
+def add_variable(dataset, name, dimensions, data, units = None, **attributes):
+    """
+    Write a variable to an open netCDF4 Dataset
+    :param dataset: netCDF4 Dataset open for writing
+    :param name: string, variable name
+    :param dimensions: tuple of names of dimensions
+    :param data: array of data
+    :param units: string, units of data
+    :param attributes: further attributes, e.g. standard_name
+    """
+    variable = dataset.createVariable(name, np.asarray(data).dtype, dimensions)
+    if units is not None:
+        variable.units = units
+    for key in attributes:
+        setattr(variable, key, attributes[key])
+    variable[:] = data
+
+
+def data_filename(source, station_number, time):
+    """
+    :return: name of file for a single ascent, matching read_files.def_filename
+    """
+    return source + '_' + station_number + '_' + time.strftime('%Y%m%d_%H%M') + '.nc'
+
+
+def write_sonde_file(folder, source, station_number, time, latitude, longitude,
+                     surface_temperature, trop_altitude, rng, spacing = 10., a = 6371229.0):
+    """
+    Write a synthetic radiosonde file, with variables named as for 'sonde' in re_name_vars
+    :param folder: string, folder in which to write file
+    :param source: Code representing origin of data, e.g. 'EMN'
+    :param station_number: string identifier of station
+    :param time: datetime object of the time of the release of the sonde
+    :param latitude: number, station latitude
+    :param longitude: number, station longitude
+    :param surface_temperature: number, temperature at 0 m in K
+    :param trop_altitude: number, tropopause altitude in m
+    :param rng: numpy RandomState
+    :param spacing: number, vertical resolution in m (10 m is approximately a 2 second sonde)
+    :param a: radius of the earth
+    """
+    names = CF_to_source_dict()['sonde']
+
+    burst = rng.uniform(max(trop_altitude + 4000., 20000.), 32000.)
+    altitude = np.arange(rng.uniform(5., 150.), burst, spacing)
+    profile = atmosphere(altitude, surface_temperature, trop_altitude, rng, temperature_noise = 0.2)
+
+    wind_speed = np.hypot(profile['x_wind'], profile['y_wind'])
+    elapsed = altitude/5.
+    # sondes rise at approximately 5 m/s
+
+    dataset = Dataset(os.path.join(folder, data_filename(source, station_number, time)), 'w')
+    dataset.createDimension('obs', len(altitude))
+    dataset.launchTime = time.strftime('%Y-%m-%d %H:%M:%SZ')
+    dataset.stationLatitude = latitude
+    dataset.stationLongitude = longitude
+
+    add_variable(dataset, names['time'], ('obs',), elapsed, 's')
+    add_variable(dataset, names['air_pressure'], ('obs',), profile['air_pressure'], 'Pa')
+    add_variable(dataset, names['air_temperature'], ('obs',), profile['air_temperature'], 'K')
+    add_variable(dataset, names['dew_point_temperature'], ('obs',), profile['dew_point_temperature'], 'K')
+    add_variable(dataset, names['altitude'], ('obs',), a*altitude/(a + altitude), 'm')
+    # the file holds geopotential height, the inverse of calculate.altitude_from_GPH
+    add_variable(dataset, names['wind_speed'], ('obs',), wind_speed, 'm s-1')
+    add_variable(dataset, names['wind_to_direction'], ('obs',),
+                 np.mod(np.degrees(np.arctan2(profile['x_wind'], profile['y_wind'])), 360), 'degree')
+    add_variable(dataset, names['latitude'], ('obs',), np.cumsum(profile['y_wind']*2.)/111e3, 'degrees')
+    add_variable(dataset, names['longitude'], ('obs',),
+                 np.cumsum(profile['x_wind']*2.)/(111e3*np.cos(np.radians(latitude))), 'degrees')
+    dataset.close()
+
+
+def model_levels(n_levels, top):
+    """
+    Altitudes of model levels, closer together near the surface
+    :param n_levels: integer, number of levels
+    :param top: number, altitude of highest level in m
+    :return: array of altitude in m
+    """
+    return 20. + (top - 20.)*(np.arange(n_levels)/(n_levels - 1))**2
+
+
+def write_UKMO_file(folder, source, station_number, time, latitude, longitude,
+                    surface_temperature, trop_altitude, rng, lead_times = (0, 1, 3, 5), n_levels = 51):
+    """
+    Write a synthetic UKMO file, on 51 levels with one forecast_reference_time per lead time
+    Errors in the tropopause altitude and temperature grow with lead time
+    :param folder: string, folder in which to write file
+    :param lead_times: lead times in days of the forecasts in the file
+    :param n_levels: integer, number of levels, which must be 51 for read_files.UKMO_pressure_double_fix
+    other parameters as for write_sonde_file
+    """
+    names = CF_to_source_dict()['UKMO']
+    altitude = model_levels(n_levels, 39000.)
+    rho_altitude = np.concatenate([[0.], 0.5*(altitude[1:] + altitude[:-1]), [40000.]])
+    ver_time = verification_time(time)
+
+    fields = dict((name, np.zeros((len(lead_times), n_levels)))
+                  for name in ['air_pressure', 'air_potential_temperature', 'specific_humidity',
+                               'mass_fraction_of_cloud_ice_in_air',
+                               'mass_fraction_of_cloud_liquid_water_in_air', 'x_wind', 'y_wind'])
+    rho_pressure = np.zeros((len(lead_times), len(rho_altitude)))
+
+    for n, lead_time in enumerate(lead_times):
+        profile = atmosphere(altitude, surface_temperature + 0.3*lead_time*rng.standard_normal(),
+                             trop_altitude + 150.*lead_time*rng.standard_normal(), rng)
+        for name in fields:
+            fields[name][n] = profile[name]
+        rho_pressure[n] = np.exp(np.interp(rho_altitude, altitude, np.log(profile['air_pressure'])))
+
+    dataset = Dataset(os.path.join(folder, data_filename(source, station_number, time)), 'w')
+    dataset.createDimension('forecast_reference_time', len(lead_times))
+    dataset.createDimension('altitude', n_levels)
+    dataset.createDimension('altitude_1', len(rho_altitude))
+
+    add_variable(dataset, 'forecast_reference_time', ('forecast_reference_time',),
+                 np.array([hours_since_1970(ver_time - datetime.timedelta(days = lead))
+                           for lead in lead_times]), TIME_UNITS,
+                 standard_name = 'forecast_reference_time', calendar = 'gregorian')
+    add_variable(dataset, 'altitude', ('altitude',), altitude, 'm', standard_name = 'altitude', positive = 'up')
+    add_variable(dataset, 'altitude_1', ('altitude_1',), rho_altitude, 'm', standard_name = 'altitude', positive = 'up')
+    add_variable(dataset, 'time', (), np.array(hours_since_1970(ver_time)), TIME_UNITS,
+                 standard_name = 'time', calendar = 'gregorian')
+    add_variable(dataset, 'latitude', (), np.array(latitude), 'degrees', standard_name = 'latitude')
+    add_variable(dataset, 'longitude', (), np.array(longitude), 'degrees', standard_name = 'longitude')
+
+    units = {'air_pressure': 'Pa', 'air_potential_temperature': 'K', 'specific_humidity': 'kg kg-1',
+             'mass_fraction_of_cloud_ice_in_air': 'kg kg-1',
+             'mass_fraction_of_cloud_liquid_water_in_air': 'kg kg-1', 'x_wind': 'm s-1', 'y_wind': 'm s-1'}
+    for name in fields:
+        add_variable(dataset, names[name], ('forecast_reference_time', 'altitude'), fields[name],
+                     units[name], standard_name = name, coordinates = 'time latitude longitude')
+    add_variable(dataset, names['air_pressure'] + '_0', ('forecast_reference_time', 'altitude_1'),
+                 rho_pressure, 'Pa', standard_name = 'air_pressure', coordinates = 'time latitude longitude')
+    # UKMO files contain a second pressure variable, on different levels
+    dataset.close()
+
+
+def write_ECAN_file(folder, source, station_number, time, latitude, longitude,
+                    surface_temperature, trop_altitude, rng, n_levels = 91, a = 6371229.0):
+    """
+    Write a synthetic ECMWF analysis file, with variables named as for 'ECAN' in re_name_vars
+    and in the units of the original files (pressure in hPa, specific humidity in g/kg)
+    :param folder: string, folder in which to write file
+    :param n_levels: integer, number of levels
+    other parameters as for write_sonde_file
+    """
+    names = CF_to_source_dict()['ECAN']
+    altitude = model_levels(n_levels, 30000.)
+    profile = atmosphere(altitude, surface_temperature + 0.1*rng.standard_normal(),
+                         trop_altitude + 50.*rng.standard_normal(), rng)
+
+    dataset = Dataset(os.path.join(folder, data_filename(source, station_number, time)), 'w')
+    dataset.createDimension('level', n_levels)
+    dataset.createDimension('string_length', 11)
+
+    add_variable(dataset, names['air_pressure'], ('level',), profile['air_pressure']/100., 'hPa')
+    add_variable(dataset, names['air_temperature'], ('level',), profile['air_temperature'], 'K')
+    add_variable(dataset, names['specific_humidity'], ('level',), profile['specific_humidity']*1e3, 'g kg-1')
+    add_variable(dataset, names['altitude'], ('level',), a*altitude/(a + altitude), 'm')
+    for name in ['mass_fraction_of_cloud_ice_in_air', 'mass_fraction_of_cloud_liquid_water_in_air']:
+        add_variable(dataset, names[name], ('level',), profile[name], 'kg kg-1')
+    add_variable(dataset, names['x_wind'], ('level',), profile['x_wind'], 'm s-1')
+    add_variable(dataset, names['y_wind'], ('level',), profile['y_wind'], 'm s-1')
+    add_variable(dataset, names['upward_air_velocity'], ('level',), profile['upward_air_velocity'], 'Pa s-1')
+
+    add_variable(dataset, 'AN_TIME', ('string_length',),
+                 stringtochar(np.array([verification_time(time).strftime('%Y%m%d_%H')], 'S11'))[0])
+    add_variable(dataset, 'LAT', (), np.array(latitude), 'degrees')
+    add_variable(dataset, 'LON', (), np.array(longitude), 'degrees')
+    dataset.close()
+
+
+def release_times(start, n_ascents, rng):
+    """
+    Release times twice a day, shortly after 11 and 23 UTC, as selected by concatenate.create_datetime_list
+    :param start: datetime object of first day
+    :param n_ascents: integer, number of ascents
+    :param rng: numpy RandomState
+    :return: list of datetime objects
+    """
+    times = []
+    for n in range(n_ascents):
+        day = start + datetime.timedelta(days = n//2)
+        times.append(datetime.datetime(day.year, day.month, day.day, 11 + 12*(n % 2), rng.randint(5, 30)))
+    return times
+
+
+def write_file_list(folder, source, station_number, times):
+    """
+    Write list of sonde files for a station, in the format of File_lists/*_list.txt
+    :param folder: string, folder in which to write list
+    :param times: list of datetime objects of release times
+    """
+    with open(os.path.join(folder, source + '_' + station_number + '_list.txt'), 'w') as myfile:
+        for time in times:
+            myfile.write(source + '/netcdf/' + data_filename(source, station_number, time) + '\n')
+
+
+def generate_dataset(data_root, file_list_folder = None, source = 'EMN', n_stations = 3, n_ascents = 20,
+                     sonde_spacing = 10., ecan_levels = 91, start = datetime.datetime(2016, 9, 20), seed = 0):
+    """
+    Write a complete synthetic dataset: sonde, UKMO and ECAN files and file lists for several stations
+    :param data_root: string, folder to use as NAWDEX_DATA_ROOT
+    :param file_list_folder: string, folder to use as NAWDEX_FILE_LISTS, default data_root/File_lists
+    :param source: Code representing origin of data
+    :param n_stations: integer, number of stations
+    :param n_ascents: integer, number of ascents per station
+    :param sonde_spacing: number, vertical resolution of sondes in m
+    :param ecan_levels: integer, number of levels in ECAN files
+    :param start: datetime object of first day of ascents
+    :param seed: integer, seed for random numbers, such that datasets are reproducible
+    :return: list of [source, station_number] pairs, as used in concatenate.main_run_this
+    """
+    rng = np.random.RandomState(seed)
+
+    if file_list_folder is None:
+        file_list_folder = os.path.join(data_root, 'File_lists')
+    folders = {'sonde': os.path.join(data_root, source, 'netcdf'),
+               'UKMO': os.path.join(data_root, 'UKMO'),
+               'ECAN': os.path.join(data_root, 'ECAN')}
+    for folder in list(folders.values()) + [file_list_folder]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    stations = []
+    for n in range(n_stations):
+        station_number = '{:05d}'.format(90001 + n)
+        latitude = rng.uniform(45., 70.)
+        longitude = rng.uniform(-30., 20.)
+        times = release_times(start, n_ascents, rng)
+
+        for time in times:
+            surface_temperature = 300. - 0.5*(latitude - 30.) + rng.standard_normal()
+            trop_altitude = 13000. - 100.*(latitude - 45.) + 800.*rng.standard_normal()
+            arguments = (source, station_number, time, latitude, longitude,
+                         surface_temperature, trop_altitude, rng)
+
+            write_sonde_file(folders['sonde'], *arguments, spacing = sonde_spacing)
+            write_UKMO_file(folders['UKMO'], *arguments)
+            write_ECAN_file(folders['ECAN'], *arguments, n_levels = ecan_levels)
+
+        write_file_list(file_list_folder, source, station_number, times)
+        stations.append([source, station_number])
+
+    return stations
@@ -0,0 +1,56 @@
+"""
+Thread pools for the loops over the variables and products of a single ascent, which
+can run in threads as numpy & scipy release the GIL for most of their array operations
+
+The data of cubes should be read before being passed to threads, as reading files
+(through netCDF4 & HDF5) is not safe in several threads at once; where files are read and
+written by different threads (as in pipeline), each access is made holding FILE_LOCK
+"""
+import atexit
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+_pools = {}
+# one pool for each number of threads, kept until shutdown_pools, in each process
+
+FILE_LOCK = threading.Lock()
+# held while netCDF files are read by re_grid.read_products or written by concatenate.save_station
+
+
+def thread_map(function, items, threads = None):
+    """
+    Equivalent of [function(item) for item in items], carried out in a pool of threads
+    Calls should not be nested, as a pool waiting on its own tasks never finishes
+    :param function: function of one argument
+    :param items: list of arguments
+    :param threads: number of threads, if None or 1 the items are done in this thread
+    :return: list of results, in the order of items
+    """
+    items = list(items)
+    if not threads or threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    key = (os.getpid(), threads)
+    if key not in _pools:
+        for inherited in [other for other in _pools if other[0] != key[0]]:
+            del _pools[inherited]
+            # a pool inherited from the parent by a worker process has no threads running
+        _pools[key] = ThreadPool(threads)
+    return _pools[key].map(function, items)
+
+
+def shutdown_pools():
+    """
+    Close the pools of this process and wait for their threads to finish, such that no idle
+    threads are left; pools are made again by thread_map when next needed
+    Called when the interpreter exits, and at the end of concatenate.main_run_this
+    """
+    for key in list(_pools):
+        pool = _pools.pop(key)
+        if key[0] == os.getpid():
+            pool.close()
+            pool.join()
+
+
+atexit.register(shutdown_pools)
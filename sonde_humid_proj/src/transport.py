@@ -0,0 +1,303 @@
+"""
+Collection of functions to pass the re-gridded ascents of a station from worker processes
+back to the parent process without pickling the cubes
+
+Each worker writes the data of its ascent into memory-mapped scratch files, one for each
+product and variable, laid out as (ascent x level) so that the file of a variable holds the
+2D array of the whole station. Only small descriptors (names, units, attributes, scalar
+values, file name, shape, dtype and offset) are returned through the pool, and the parent
+builds the 2D cubes of the station as views of these files, in place of merging 1D cubes
+
+multiprocessing.shared_memory would need python 3.8, so numpy memory maps are used instead
+"""
+import os
+import re
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import iris
+import numpy as np
+from iris.unit import Unit
+
+from re_grid import re_grid_trop_0, GRID_DIC
+from concatenate import create_datetime_list, save_station
+
+
+def buffer_filename(folder, key, name):
+    """
+    :param folder: string, scratch folder of the station
+    :param key: string, product, one of the keys of re_grid.PRODUCTS
+    :param name: string, name of variable or coordinate
+    :return: file name of the buffer of the variable
+    """
+    return os.path.join(folder, key + '_' + re.sub('[^0-9a-zA-Z_]', '_', name) + '.dat')
+
+
+def open_buffer(filename, dtype, shape):
+    """
+    Open a memory-mapped buffer for writing, creating it if it does not yet exist
+    Several workers may open the same file at once, which is safe as the file is
+    only ever extended to the same size
+    :param filename: string, buffer file
+    :param dtype: numpy dtype of data
+    :param shape: tuple, shape of the whole buffer
+    :return: np.memmap
+    """
+    nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+    with open(filename, 'ab') as buffer_file:
+        if os.path.getsize(filename) < nbytes:
+            buffer_file.truncate(nbytes)
+    return np.memmap(filename, dtype = dtype, mode = 'r+', shape = shape)
+
+
+def units_descriptor(units):
+    """
+    :param units: Unit
+    :return: tuple of units string and calendar, which can be pickled cheaply
+    """
+    return (str(units), getattr(units, 'calendar', None))
+
+
+def coord_descriptor(coord):
+    """
+    :param coord: scalar coordinate
+    :return: dictionary describing the coordinate
+    """
+    return {'standard_name': coord.standard_name, 'long_name': coord.long_name,
+            'var_name': coord.var_name, 'units': units_descriptor(coord.units),
+            'point': coord.points[0]}
+
+
+def cube_descriptor(cube):
+    """
+    :param cube: cube
+    :return: dictionary describing the metadata and scalar coordinates of the cube
+    """
+    return {'name': cube.name(), 'standard_name': cube.standard_name, 'long_name': cube.long_name,
+            'var_name': cube.var_name, 'units': units_descriptor(cube.units),
+            'attributes': dict(cube.attributes),
+            'scalar_coords': [coord_descriptor(coord) for coord in cube.coords(dimensions = ())]}
+
+
+def write_cubelist(cubelist, folder, key, ascent, n_ascents):
+    """
+    Write the data of the cubes of one product of an ascent to the buffers of the station
+    :param cubelist: CubeList of 1D cubes, as produced by re_grid.re_grid_1d
+    :param folder: string, scratch folder of the station
+    :param key: string, product, one of the keys of re_grid.PRODUCTS
+    :param ascent: integer, index of the ascent within the station
+    :param n_ascents: integer, number of ascents of the station
+    :return: list of dictionaries describing each cube
+    """
+    descriptors = []
+
+    for cube in cubelist:
+        descriptor = cube_descriptor(cube)
+
+        if cube.ndim == 1 and cube.shape != (1,):
+            n_levels = cube.shape[0]
+            data = np.ma.filled(cube.data, np.nan)
+            filename = buffer_filename(folder, key, cube.name())
+
+            buffer = open_buffer(filename, data.dtype, (n_ascents, n_levels))
+            buffer[ascent] = data
+            buffer.flush()
+            del buffer
+
+            descriptor['buffer'] = {'filename': filename, 'dtype': data.dtype.str,
+                                    'shape': (n_ascents, n_levels),
+                                    'offset': ascent*n_levels*data.dtype.itemsize}
+
+            dim_coord = cube.coord(dimensions = 0)
+            # written by every ascent, as the re-gridded levels are the same for all of them
+            coord_filename = buffer_filename(folder, key, 'coord_' + dim_coord.name())
+            points = open_buffer(coord_filename, dim_coord.points.dtype, (n_levels,))
+            points[:] = dim_coord.points
+            points.flush()
+            del points
+
+            descriptor['dim_coord'] = {'standard_name': dim_coord.standard_name,
+                                       'long_name': dim_coord.long_name, 'var_name': dim_coord.var_name,
+                                       'units': units_descriptor(dim_coord.units),
+                                       'filename': coord_filename, 'dtype': dim_coord.points.dtype.str,
+                                       'shape': (n_levels,)}
+        else:
+            descriptor['data'] = np.asarray(cube.data).tolist()
+
+        descriptors.append(descriptor)
+
+    return descriptors
+
+
+def write_cubelist_dictionary(cubelist_dictionary, folder, ascent, n_ascents):
+    """
+    Write all products of an ascent to the buffers of the station
+    :param cubelist_dictionary: dictionary of cubelists, as produced by re_grid.re_grid_trop_0
+    :param folder: string, scratch folder of the station
+    :param ascent: integer, index of the ascent within the station
+    :param n_ascents: integer, number of ascents of the station
+    :return: dictionary describing the ascent, to be passed to assemble_station
+    """
+    return {'ascent': ascent,
+            'products': dict((key, write_cubelist(cubelist_dictionary[key], folder, key, ascent, n_ascents))
+                             for key in cubelist_dictionary)}
+
+
+def make_units(descriptor):
+    """
+    :param descriptor: tuple from units_descriptor
+    :return: Unit
+    """
+    name, calendar = descriptor
+    if calendar:
+        return Unit(name, calendar = calendar)
+    return Unit(name)
+
+
+def station_coords(cube_descriptors):
+    """
+    Coordinates along time of the cubes of one variable from every ascent, as produced
+    by merging; scalar coordinates which are the same for every ascent remain scalar
+    :param cube_descriptors: list of dictionaries from cube_descriptor, one for each ascent in order
+    :return: list of (coordinate, dimension) pairs, with the time coordinate first
+    """
+    coords = []
+    for n, coord in enumerate(cube_descriptors[0]['scalar_coords']):
+        points = np.array([descriptor['scalar_coords'][n]['point'] for descriptor in cube_descriptors])
+        kwargs = {'standard_name': coord['standard_name'], 'long_name': coord['long_name'],
+                  'var_name': coord['var_name'], 'units': make_units(coord['units'])}
+
+        if coord['standard_name'] == 'time':
+            coords.insert(0, (iris.coords.DimCoord(points, **kwargs), 0))
+        elif np.all(points == points[0]):
+            coords.append((iris.coords.AuxCoord(points[0], **kwargs), None))
+        else:
+            coords.append((iris.coords.AuxCoord(points, **kwargs), 0))
+    return coords
+
+
+def assemble_station(ascent_descriptors):
+    """
+    Build the 2D cubes of a station from the buffers written by its ascents
+    The data of the cubes are copy-on-write views of the buffers, unless some ascents are
+    missing (e.g. no tropopause was found), in which case only the written rows are copied
+    :param ascent_descriptors: list of dictionaries from write_cubelist_dictionary
+    :return: dictionary of 2D cubelists in time & alt, as produced by merging the cubelists
+             of each ascent
+    """
+    ascent_descriptors = sorted(ascent_descriptors, key = lambda descriptor: descriptor['ascent'])
+    rows = [descriptor['ascent'] for descriptor in ascent_descriptors]
+
+    twoD_cubelist_dictionary = {}
+    for key in ascent_descriptors[0]['products']:
+        cubelist = iris.cube.CubeList([])
+
+        for first in ascent_descriptors[0]['products'][key]:
+            cube_descriptors = [[cube for cube in descriptor['products'][key]
+                                 if cube['name'] == first['name']][0]
+                                for descriptor in ascent_descriptors]
+            coords = station_coords(cube_descriptors)
+
+            if 'buffer' in first:
+                buffer = first['buffer']
+                data = np.memmap(buffer['filename'], dtype = buffer['dtype'], mode = 'c',
+                                 shape = buffer['shape'])
+                if rows != list(range(buffer['shape'][0])):
+                    data = data[rows]
+
+                dim = first['dim_coord']
+                points = np.memmap(dim['filename'], dtype = dim['dtype'], mode = 'r', shape = dim['shape'])
+                altitude = iris.coords.DimCoord(np.array(points), standard_name = dim['standard_name'],
+                                                long_name = dim['long_name'], var_name = dim['var_name'],
+                                                units = make_units(dim['units']))
+                dim_coords = [coords[0], (altitude, 1)]
+            else:
+                data = np.array([descriptor['data'] for descriptor in cube_descriptors])
+                dim_coords = [coords[0]]
+
+            cubelist.append(iris.cube.Cube(data, standard_name = first['standard_name'],
+                                           long_name = first['long_name'], var_name = first['var_name'],
+                                           units = make_units(first['units']),
+                                           attributes = first['attributes'],
+                                           dim_coords_and_dims = dim_coords,
+                                           aux_coords_and_dims = coords[1:]))
+
+        twoD_cubelist_dictionary[key] = cubelist
+
+    return twoD_cubelist_dictionary
+
+
+def process_ascent(args):
+    """
+    Re-grid a single ascent in a worker process and write it to the buffers of the station
+    :param args: tuple of (source, station_number, time, ascent, n_ascents, folder, filter_dic, kind,
+                 grid_dic)
+    :return: dictionary describing the ascent, or None if it could not be used
+    """
+    source, station_number, time, ascent, n_ascents, folder, filter_dic, kind, grid_dic = args
+    try:
+        cubelist_dictionary = re_grid_trop_0(source, station_number, time, filter_dic, kind,
+                                             grid_dic = grid_dic)
+    except Exception as e:
+        print(source + '_' + station_number + '_' + time.strftime('%Y%m%d_%H%M') + ' processing has failed')
+        print(e)
+        return None
+
+    if not cubelist_dictionary:
+        # it will return False if there is no found tropopause
+        return None
+    return write_cubelist_dictionary(cubelist_dictionary, folder, ascent, n_ascents)
+
+
+def process_station_parallel(source, station_number, processes = None, folder = None,
+                             filter_dic = {'name' : 'kernel', 'gaussian_half_width' : 50,
+                                           'window_half_width' : 200}, kind = 'linear',
+                             grid_dic = GRID_DIC, ragged = False):
+    """
+    Equivalent of concatenate.concatenate_cubelist_dictionary, re-gridding the ascents of a
+    station in worker processes and assembling them through memory-mapped buffers
+    :param source: Code representing origin of data, options for which are:
+                   'EMN', 'CAN', 'DLR', 'IMO', 'NCAS'
+    :param station_number: 4-6 digit identifier of particular station from which
+                           sonde was released
+    :param processes: integer, number of worker processes, by default the number of cpus
+    :param folder: string, scratch folder for the buffers, by default a temporary folder
+                   which is removed once the station has been saved
+    :param filter_dic: dictionary specifying filter name and necessary parameters
+    :param kind: integer specifying the order of the spline interpolator to use, default is linear
+    :param grid_dic: dictionary specifying the tropopause-relative grid, see re_grid.grid_levels
+    :param ragged: if True, save ragged .npz files rather than netCDF, see concatenate.save_station
+    :return: dictionary of 2D cubelists which have been saved
+    """
+    datetime_list = create_datetime_list(source, station_number)
+
+    if not datetime_list:
+        return source + '_' + station_number + ' ascents not found'
+
+    remove = folder is None
+    if remove:
+        folder = tempfile.mkdtemp(prefix = 'nawdex_transport_')
+    elif not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    tasks = [(source, station_number, time, ascent, len(datetime_list), folder, filter_dic, kind, grid_dic)
+             for ascent, time in enumerate(datetime_list)]
+
+    pool = Pool(processes)
+    try:
+        ascent_descriptors = [descriptor for descriptor in pool.imap_unordered(process_ascent, tasks)
+                              if descriptor]
+    finally:
+        pool.close()
+        pool.join()
+
+    try:
+        if not ascent_descriptors:
+            return source + '_' + station_number + ' no ascents could be used'
+        twoD_cubelist_dictionary = assemble_station(ascent_descriptors)
+        return save_station(source, station_number, twoD_cubelist_dictionary, merged = True,
+                            ragged = ragged)
+    finally:
+        if remove:
+            shutil.rmtree(folder)
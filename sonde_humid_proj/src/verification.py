@@ -0,0 +1,153 @@
+"""
+Growth of forecast error with lead time, from the 2D (time x tropopause-relative altitude)
+files of each station
+
+The variables of all products are read into one array (variable x product x time x altitude),
+from which the differences of every product from the sonde, of every kind, are calculated
+in one broadcast operation, and then their statistics over time, giving a profile of each
+statistic for each variable and product. As the products include the UKMO analysis and its
+1, 3 and 5 day forecasts, these show how the error grows with lead time
+
+The kinds of difference, with the names used by make_cubes.difference_fields_selective, are:
+    'difference':            product - sonde
+    'fractional_difference': (product - sonde)/sonde
+    'normalised_difference': (product - sonde)/(product**2 + sonde**2)**0.5, between -1 and 1
+and the statistics of each over time, ignoring nan, are:
+    'bias': mean, 'mae': mean absolute value, 'rms': root mean square, 'count': number of values
+"""
+from __future__ import division
+
+import os
+import warnings
+
+import iris
+import numpy as np
+
+from read_files import output_folder
+from re_grid import PRODUCTS
+import precision
+
+VERIFICATION_PRODUCTS = ['ukmo', 'ukmo1', 'ukmo3', 'ukmo5', 'ecan']
+# compared with the sonde, which is the reference
+
+DIFFERENCE_KINDS = ['difference', 'fractional_difference', 'normalised_difference']
+
+VERIFICATION_VARIABLES = ['air_temperature', 'air_potential_temperature', 'specific_humidity',
+                          'relative_humidity', 'relative_humidity_ice', 'relative_humidity_liquid_water']
+
+
+def station_arrays(station_code, variables, products = VERIFICATION_PRODUCTS):
+    """
+    Read the 2D fields of the sonde and each product of a station into one array,
+    keeping only the times at which every product has an ascent
+    :param station_code: string, source and station number, e.g. 'EMN_03882'
+    :param variables: list of names of variables
+    :param products: list of keys of re_grid.PRODUCTS to compare with the sonde
+    :return: array (variable x product x time x altitude), with the sonde as the first product,
+             in the precision set by precision.set_precision, array of times and array of
+             tropopause-relative altitudes
+    """
+    source, station_number = station_code.split('_')
+    folder = output_folder(source, station_number)
+
+    cubes = {}
+    for key in ['sonde'] + list(products):
+        cubelist = iris.load(os.path.join(folder, key + '_2D_trop_relative.nc'), variables)
+        cubes[key] = [cubelist.extract(iris.Constraint(name = variable))[0] for variable in variables]
+
+    product_times = [cubes[key][0].coord('time').points for key in cubes]
+    times = product_times[0]
+    for points in product_times[1:]:
+        times = np.intersect1d(times, points)
+    # ascents missing from any product cannot be compared
+
+    altitude = cubes['sonde'][0].coord(dimensions = 1).points
+    data = np.zeros((len(variables), len(products) + 1, len(times), len(altitude)),
+                    dtype = precision.get_dtype())
+
+    for p, key in enumerate(['sonde'] + list(products)):
+        for v, cube in enumerate(cubes[key]):
+            rows = np.nonzero(np.isin(cube.coord('time').points, times))[0]
+            data[v, p] = np.ma.filled(np.asanyarray(cube.data, dtype = float)[rows], np.nan)
+
+    return data, times, altitude
+
+
+def differences(data, kinds = DIFFERENCE_KINDS):
+    """
+    :param data: array (... x product x time x altitude), with the sonde as the first product
+    :param kinds: list of kinds of difference, see above
+    :return: dictionary of arrays (... x product x time x altitude) of each kind of difference
+             of every other product from the sonde
+    """
+    reference = data[..., :1, :, :]
+    products = data[..., 1:, :, :]
+    difference = products - reference
+
+    result = {}
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for kind in kinds:
+            if kind == 'difference':
+                result[kind] = difference
+            elif kind == 'fractional_difference':
+                result[kind] = difference/reference
+            elif kind == 'normalised_difference':
+                result[kind] = difference/np.sqrt(products**2 + reference**2)
+            else:
+                raise ValueError("differences has three kinds: 'difference', 'fractional_difference' "
+                                 "or 'normalised_difference'")
+    return result
+
+
+def statistics(difference, axis = -2):
+    """
+    :param difference: array of differences, with nan where there are none
+    :param axis: axis over which the statistics are taken, by default time
+    :return: dictionary of arrays of 'bias', 'mae', 'rms' and 'count', with that axis removed
+    """
+    difference = np.where(np.isfinite(difference), difference, np.nan)
+    # fractional differences from zero are infinite
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # all nan columns give nan
+        return {'bias': np.nanmean(difference, axis = axis),
+                'mae': np.nanmean(np.abs(difference), axis = axis),
+                'rms': np.sqrt(np.nanmean(difference**2, axis = axis)),
+                'count': np.sum(~np.isnan(difference), axis = axis)}
+
+
+def error_growth(station_codes, variables = VERIFICATION_VARIABLES, products = VERIFICATION_PRODUCTS,
+                 kinds = DIFFERENCE_KINDS):
+    """
+    Profiles of the statistics of the differences of each product from the sonde, pooling
+    the ascents of all stations given
+    :param station_codes: string or list of strings, source and station number, e.g. 'EMN_03882'
+    :param variables: list of names of variables
+    :param products: list of keys of re_grid.PRODUCTS to compare with the sonde
+    :param kinds: list of kinds of difference, see above
+    :return: dictionary of:
+                 'statistics': dictionary, for each variable name suffixed by the kind (e.g.
+                               'specific_humidity_fractional_difference'), of dictionaries of
+                               arrays (product x altitude) of each statistic
+                 'products':   list of the products, in order
+                 'lead_times': array of the lead time of each product, days
+                 'altitude':   array of tropopause-relative altitudes
+    """
+    if not isinstance(station_codes, (list, tuple)):
+        station_codes = [station_codes]
+
+    station_data = [station_arrays(code, variables, products) for code in station_codes]
+    data = np.concatenate([station[0] for station in station_data], axis = 2)
+    # ascents of all stations together along time
+
+    result = {'statistics': {}, 'products': list(products), 'altitude': station_data[0][2],
+              'lead_times': np.array([[product[2] for product in PRODUCTS if product[0] == key][0]
+                                      for key in products])}
+
+    for kind, difference in differences(data, kinds).items():
+        stats = statistics(difference)
+        for v, variable in enumerate(variables):
+            result['statistics'][variable + '_' + kind] = dict((name, value[v]) for name, value in stats.items())
+
+    return result
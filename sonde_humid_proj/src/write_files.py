@@ -0,0 +1,113 @@
+"""
+Collection of functions to write the 2D (time x altitude) station files
+
+The encoding of the files is specified by a dictionary, in the same way as the filters:
+    {'name' : 'plain'}
+        as iris.save, with no compression or chunking
+    {'name' : 'compressed', 'complevel' : 4, 'shuffle' : True, 'time_chunk' : 64,
+     'least_significant_digit' : {}}
+        zlib compression, with the shuffle filter, in chunks of 'time_chunk' ascents by all
+        altitudes, so that reading a range of times only decompresses the chunks holding it
+        'least_significant_digit' is a dictionary of the number of decimal places to keep of
+        each variable, by name; variables not in it are stored losslessly. QUANTISED_DIGITS
+        is a suitable choice for the re-gridded products
+
+The encoding used by concatenate.save_station is set by set_encoding
+"""
+import iris
+import iris.fileformats.netcdf
+import numpy as np
+
+ENCODING_DIC = {'name' : 'plain'}
+
+COMPRESSED_DIC = {'name' : 'compressed', 'complevel' : 4, 'shuffle' : True, 'time_chunk' : 64,
+                  'least_significant_digit' : {}}
+
+QUANTISED_DIGITS = {'air_pressure' : 1, 'air_temperature' : 3, 'air_potential_temperature' : 3,
+                    'dew_point_temperature' : 3, 'specific_humidity' : 8, 'relative_humidity' : 4,
+                    'relative_humidity_liquid_water' : 4, 'relative_humidity_ice' : 4}
+# decimal places, in the units of the saved files: 0.1 Pa, 1 mK, 1e-8 kg/kg and 1e-4 of
+# saturation, each well below the precision of the measurements
+
+_state = {'encoding_dic': ENCODING_DIC}
+
+
+def set_encoding(encoding_dic):
+    """
+    Set the encoding of the files written by save_cubelist when none is given
+    :param encoding_dic: dictionary specifying the encoding, see above
+    """
+    _state['encoding_dic'] = encoding_dic
+
+
+def get_encoding():
+    """
+    :return: dictionary specifying the encoding currently used by save_cubelist
+    """
+    return _state['encoding_dic']
+
+
+def chunk_sizes(cube, time_chunk):
+    """
+    :param cube: cube whose first dimension is time
+    :param time_chunk: integer, number of times in each chunk
+    :return: tuple of chunk sizes of (time block x the whole of the other dimensions),
+             or None for a scalar cube
+    """
+    if cube.ndim == 0:
+        return None
+    return (max(1, min(time_chunk, cube.shape[0])),) + tuple(cube.shape[1:])
+
+
+def local_attribute_keys(cubelist):
+    """
+    Attributes which are not the same for every cube, and so are written to each variable
+    rather than to the file, as iris.save
+    :param cubelist: CubeList
+    :return: set of attribute names
+    """
+    local_keys = set()
+    attributes = cubelist[0].attributes
+    common_keys = set(attributes)
+
+    for cube in cubelist[1:]:
+        keys = set(cube.attributes)
+        local_keys.update(keys.symmetric_difference(common_keys))
+        common_keys.intersection_update(keys)
+        different_value_keys = [key for key in common_keys
+                                if np.any(attributes[key] != cube.attributes[key])]
+        common_keys.difference_update(different_value_keys)
+        local_keys.update(different_value_keys)
+
+    return local_keys
+
+
+def save_cubelist(cubelist, filename, encoding_dic = None):
+    """
+    Save a CubeList of station cubes to netCDF
+    :param cubelist: CubeList, as saved by concatenate.save_station
+    :param filename: string, netCDF file to write
+    :param encoding_dic: dictionary specifying the encoding, see above, by default
+                         that set by set_encoding
+    """
+    if encoding_dic is None:
+        encoding_dic = _state['encoding_dic']
+
+    if encoding_dic['name'] == 'plain':
+        iris.save(cubelist, filename)
+        return
+
+    if encoding_dic['name'] != 'compressed':
+        raise ValueError('unknown encoding: ' + str(encoding_dic['name']))
+
+    digits = encoding_dic.get('least_significant_digit', {})
+    local_keys = local_attribute_keys(cubelist)
+
+    with iris.fileformats.netcdf.Saver(filename, 'NETCDF4') as saver:
+        for cube in cubelist:
+            saver.write(cube, local_keys, zlib = True,
+                        complevel = encoding_dic.get('complevel', 4),
+                        shuffle = encoding_dic.get('shuffle', True),
+                        chunksizes = chunk_sizes(cube, encoding_dic.get('time_chunk', 64)),
+                        least_significant_digit = digits.get(cube.name()))
+        saver.update_global_attributes(Conventions = iris.fileformats.netcdf.CF_CONVENTIONS_VERSION)
@@ -0,0 +1,168 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import calculate
+
+TABLE_ERRORS = {'linear' : 9e-7, 'cubic' : 1.1e-13}
+# largest relative errors of the saturation vapour pressure tables, as in set_svp_method
+
+
+def table_temperatures(seed = 0):
+    """
+    :return: array of temperatures spanning the saturation vapour pressure tables, including
+             the edges of the tables, the ends of the mixed blend and points between table entries
+    """
+    rng = np.random.RandomState(seed)
+    return np.concatenate([np.linspace(calculate.SVP_TABLE['lower'], calculate.SVP_TABLE['upper'], 190001),
+                           rng.uniform(calculate.SVP_TABLE['lower'], calculate.SVP_TABLE['upper'], 100000),
+                           [250.16, 273.16, 250.165, 273.155]])
+
+
+def test_svp_table_error():
+    """
+    Tests that interpolating the saturation vapour pressure tables is within the errors stated
+    by set_svp_method, over the whole range of the tables
+    """
+    T = table_temperatures()
+    for phase in ['water', 'ice', 'mixed']:
+        exact = calculate.SVP_FUNCTIONS[phase](T)
+        for method in ['linear', 'cubic']:
+            error = np.max(np.abs(calculate.svp_from_table(phase, T, method)/exact - 1))
+            assert error <= TABLE_ERRORS[method], \
+                   method + " table of " + phase + " has a relative error of " + str(error)
+            assert calculate.svp_table_error(phase, method) <= TABLE_ERRORS[method], \
+                   "svp_table_error of the " + method + " table of " + phase + " is larger than stated"
+
+    outside = np.array([100., 149.99, 340.01, 400., np.nan])
+    assert np.allclose(calculate.svp_from_table('mixed', outside, 'cubic'), calculate.svpm_exact(outside),
+                       equal_nan = True), "svp_from_table does not use the exact formula outside the table"
+
+
+def test_svpm_from_temp_blend():
+    """
+    Tests that the blend of svpm_from_temp with T0 & Ti other than the defaults is within the
+    errors of the tables, keeps the precision and mask of the temperature, and is the same for
+    the exact method as svpm_exact
+    """
+    T = table_temperatures()
+    T0, Ti = 270., 240.
+    exact = calculate.svpm_exact(T, T0, Ti)
+    assert np.array_equal(calculate.svpm_from_temp(T, T0, Ti, 'exact'), exact), \
+           "svpm_from_temp differs from svpm_exact"
+    for method in ['linear', 'cubic']:
+        error = np.max(np.abs(calculate.svpm_from_temp(T, T0, Ti, method)/exact - 1))
+        assert error <= 2*TABLE_ERRORS[method], \
+               "blend of the " + method + " tables has a relative error of " + str(error)
+
+    temp = np.ma.masked_invalid(np.array([200., 245., np.nan, 265., 290.], dtype = np.float32))
+    for method in ['exact', 'linear', 'cubic']:
+        for T0, Ti in [(273.16, 250.16), (270., 240.)]:
+            svp = calculate.svpm_from_temp(temp, T0, Ti, method)
+            assert svp.dtype == np.float32, "svpm_from_temp does not keep the precision for " + method
+            assert np.array_equal(np.ma.getmaskarray(svp), np.ma.getmaskarray(temp)), \
+                   "svpm_from_temp does not keep the mask for " + method
+            out = np.zeros(temp.shape, dtype = np.float32)
+            calculate.svpm_from_temp(temp.filled(250.), T0, Ti, method, out = out)
+            assert np.allclose(out, calculate.svpm_from_temp(temp.filled(250.), T0, Ti, method)), \
+                   "svpm_from_temp with out differs from without for " + method
+
+
+def thermodynamic_arrays(dtype, seed = 0):
+    """
+    :param dtype: numpy dtype of the arrays
+    :param seed: integer, seed for random numbers
+    :return: dictionary of 2D arrays of temperature, pressure, potential temperature, dew point,
+             vapour pressure and specific humidity spanning the atmosphere
+    """
+    rng = np.random.RandomState(seed)
+    shape = (7, 300)
+    T = rng.uniform(180., 310., shape)
+    p = rng.uniform(1e3, 1.05e5, shape)
+    arrays = {'T': T, 'p': p, 'theta': calculate.theta_from_temp(T, p),
+              'dew_point': T - rng.uniform(0., 30., shape), 'q': rng.uniform(1e-6, 2e-2, shape)}
+    arrays['e'] = calculate.vapour_pressure_from_q(arrays['q'], p)
+    return dict((name, array.astype(dtype)) for name, array in arrays.items())
+
+
+def out_functions(a):
+    """
+    :param a: dictionary of arrays from thermodynamic_arrays
+    :return: dictionary of functions of out, calling each function of calculate with an out
+             argument on the arrays
+    """
+    functions = {'temp_from_theta': lambda out: calculate.temp_from_theta(a['theta'], a['p'], out = out),
+                 'theta_from_temp': lambda out: calculate.theta_from_temp(a['T'], a['p'], out = out),
+                 'partial_from_vapour': lambda out: calculate.partial_from_vapour(a['e'], a['T'], a['p'], out = out),
+                 'q_from_partialpressure': lambda out: calculate.q_from_partialpressure(a['e'], a['p'], out = out),
+                 'vapour_pressure_from_q': lambda out: calculate.vapour_pressure_from_q(a['q'], a['p'], out = out)}
+    for method in ['exact', 'linear', 'cubic']:
+        for phase, function in [('water', calculate.svpw_from_temp), ('ice', calculate.svpi_from_temp),
+                                ('mixed', calculate.svpm_from_temp)]:
+            functions['svp_' + phase + '_' + method] = (lambda function, method:
+                                                        lambda out: function(a['dew_point'], method = method,
+                                                                             out = out))(function, method)
+        for state in ['liquid_water', 'ice', 'mixed']:
+            functions['RH_' + state + '_' + method] = (lambda state, method:
+                                                       lambda out: calculate.RH_from_vapourpressure(
+                                                           a['e'], a['T'], state, method = method,
+                                                           out = out))(state, method)
+    return functions
+
+
+def test_out_functions():
+    """
+    Tests that each function of calculate with an out argument gives the same result with it
+    as without, in float64 and float32, and that results held in arrays of the workspace of
+    one function are not changed by calling the others
+    """
+    for dtype, rtol in [(np.float64, 1e-12), (np.float32, 1e-6)]:
+        arrays = thermodynamic_arrays(dtype)
+        functions = out_functions(arrays)
+        for name, function in functions.items():
+            expected = function(None)
+            out = np.empty_like(arrays['T'])
+            result = function(out)
+            assert result is out, name + " does not return out"
+            assert result.dtype == expected.dtype, name + " with out is not in the precision of its inputs"
+            assert np.allclose(result, expected, rtol = rtol, atol = 0), \
+                   name + " with out differs from without in " + np.dtype(dtype).name
+
+        held = {}
+        for name, function in functions.items():
+            held[name] = function(calculate.workspace('test_out_functions', name, arrays['T'].shape, dtype))
+        for name, function in functions.items():
+            function(np.empty_like(arrays['T']))
+        for name in functions:
+            assert np.array_equal(held[name], calculate.workspace('test_out_functions', name, arrays['T'].shape,
+                                                                  dtype)), \
+                   "result of " + name + " held in the workspace was changed by another function"
+            assert np.allclose(held[name], functions[name](None), rtol = rtol, atol = 0), \
+                   "result of " + name + " held in the workspace was changed"
+
+    T = thermodynamic_arrays(np.float64)['T']
+    for phase in ['water', 'ice']:
+        assert np.array_equal(calculate.sonntag(T, phase, out = np.empty_like(T)), calculate.sonntag(T, phase)), \
+               "sonntag with out differs from without for " + phase
+    assert np.allclose(calculate.svpm_exact(T, out = np.empty_like(T)), calculate.svpm_exact(T), rtol = 1e-14), \
+           "svpm_exact with out differs from without"
+
+
+def test_out_in_place():
+    """
+    Tests that the functions of calculate whose out may be one of their inputs give the same
+    result when it is
+    """
+    a = thermodynamic_arrays(np.float64)
+    cases = [(calculate.temp_from_theta, ['theta', 'p']), (calculate.theta_from_temp, ['T', 'p']),
+             (calculate.partial_from_vapour, ['e', 'T', 'p']), (calculate.q_from_partialpressure, ['e', 'p']),
+             (calculate.vapour_pressure_from_q, ['q', 'p'])]
+    for function, inputs in cases:
+        arguments = [a[key].copy() for key in inputs]
+        expected = function(*arguments)
+        assert np.allclose(function(*arguments, out = arguments[0]), expected, rtol = 1e-12, atol = 0), \
+               function.__name__ + " differs when out is its first input"
@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import composite
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def station_cube(seed = 0):
+    """
+    2D (time x altitude) cube of temperatures with some missing values
+    """
+    rng = np.random.RandomState(seed)
+    n_times, n_levels = 3000, 4
+    time = iris.coords.DimCoord(np.arange(n_times)*12., standard_name = 'time',
+                                units = 'hours since 1970-01-01 00:00:00')
+    altitude = iris.coords.DimCoord(np.linspace(-2000., 2000., n_levels), long_name = 'altitude', units = 'm')
+    data = rng.normal(220., 10., (n_times, n_levels)) + rng.exponential(5., (n_times, n_levels))
+    data[rng.uniform(size = data.shape) < 0.1] = np.nan
+    return iris.cube.Cube(data, standard_name = 'air_temperature', units = 'K',
+                          dim_coords_and_dims = [(time, 0), (altitude, 1)])
+
+
+def test_composite_quantiles():
+    """
+    Tests that the quantiles of composite are within the stated quantile_error of the exact
+    quantiles, with and without a mask, for two numbers of bins
+    """
+    cube = station_cube()
+    folder = tempfile.mkdtemp()
+    environment = os.environ.get('NAWDEX_OUTPUT_ROOT')
+    try:
+        os.environ['NAWDEX_OUTPUT_ROOT'] = folder
+        os.makedirs(os.path.join(folder, 'EMN_00001'))
+        iris.save(cube, os.path.join(folder, 'EMN_00001', 'sonde_2D_trop_relative.nc'))
+
+        selected = np.random.RandomState(1).uniform(size = cube.shape) < 0.3
+        mask_dic = {'name' : 'weights', 'weights' : {'EMN_00001' : selected.astype(float)}}
+        for n_bins in [20, 200]:
+            for name, weights, data in [('all', composite.ALL_DIC, cube.data),
+                                        ('weights', mask_dic, np.where(selected, cube.data, np.nan))]:
+                statistics = composite.composite('air_temperature', ['EMN_00001'], ['sonde'], weights,
+                                                 QUANTILES, n_bins)['sonde']
+                width = (np.nanmax(cube.data) - np.nanmin(cube.data))/n_bins
+                assert np.isclose(statistics['quantile_error'], width), \
+                       "quantile_error is not the width of the bins for " + str(n_bins) + " bins"
+                exact = np.nanpercentile(data, np.array(QUANTILES)*100, axis = 0)
+                error = np.max(np.abs(statistics['quantiles'] - exact))
+                assert error <= statistics['quantile_error'], \
+                       "quantiles with mask " + name + " and " + str(n_bins) + " bins are " + str(error) + \
+                       " from the exact quantiles"
+    finally:
+        composite.clear_arrays()
+        if environment is None:
+            os.environ.pop('NAWDEX_OUTPUT_ROOT', None)
+        else:
+            os.environ['NAWDEX_OUTPUT_ROOT'] = environment
+        shutil.rmtree(folder)
@@ -0,0 +1,143 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from quality_control import QC_DIC, check_profile, flag_names, is_rejected
+
+
+def clean_profile():
+    """
+    :return: arrays of altitude, m, temperature, K, and pressure, Pa, of a profile every
+             100 m up to 15 km with a lapse rate of 6.5 K/km up to 11 km and isothermal above
+    """
+    altitude = np.arange(0., 15001., 100.)
+    temperature = 288.15 - 0.0065*np.minimum(altitude, 11000.)
+    pressure = 101325.*np.exp(-altitude/8000.)
+    return altitude, temperature, pressure
+
+
+def check(altitude, temperature, pressure, expected, dropped = (), rejected = False):
+    """
+    Assert that check_profile sets exactly the expected flags and drops exactly the levels given
+    :param expected: list of the names of the flags expected
+    :param dropped: indices of the levels expected to be dropped
+    :param rejected: True if the ascent is expected to be rejected
+    """
+    keep, flags = check_profile(altitude, temperature, pressure, QC_DIC)
+    name = ', '.join(expected) if expected else 'no flags'
+    assert sorted(flag_names(flags)) == sorted(expected), \
+           "flags " + ', '.join(flag_names(flags)) + " set rather than " + name
+    assert np.array_equal(np.nonzero(~keep)[0], sorted(dropped)), "wrong levels dropped for " + name
+    assert is_rejected(flags) == rejected, "ascent rejected, or not rejected, wrongly for " + name
+
+
+def test_clean_profile():
+    """
+    Tests that no flags are set and no levels dropped for a good profile
+    """
+    check(*clean_profile(), expected = [])
+
+
+def test_missing_levels():
+    """
+    Tests that missing and non-physical levels are dropped and flagged, and that long runs of
+    them are flagged
+    """
+    altitude, temperature, pressure = clean_profile()
+    temperature[10] = np.nan
+    pressure[12] = -999.
+    check(altitude, temperature, pressure, ['missing_levels'], [10, 12])
+
+    altitude, temperature, pressure = clean_profile()
+    run = np.arange(20, 21 + QC_DIC['max_missing_run'])
+    altitude[run] = np.nan
+    check(altitude, temperature, pressure, ['missing_levels', 'long_missing_run'], run)
+
+
+def test_duplicate_levels():
+    """
+    Tests that a level at the same altitude as the one below is dropped and flagged
+    """
+    altitude, temperature, pressure = clean_profile()
+    altitude[50] = altitude[49]
+    check(altitude, temperature, pressure, ['duplicate_levels'], [50])
+
+
+def test_non_monotonic_altitude():
+    """
+    Tests that a level below the highest level beneath it is dropped and flagged, even when
+    the level directly below it is missing
+    """
+    altitude, temperature, pressure = clean_profile()
+    altitude[50] = altitude[48] - 10.
+    check(altitude, temperature, pressure, ['non_monotonic_altitude'], [50])
+
+    altitude, temperature, pressure = clean_profile()
+    altitude[50] = altitude[48] - 10.
+    temperature[49] = np.nan
+    check(altitude, temperature, pressure, ['missing_levels', 'non_monotonic_altitude'], [49, 50])
+
+
+def test_temperature_spikes():
+    """
+    Tests that warm and cold spikes of single levels are dropped and flagged, and that steps
+    in temperature are not
+    """
+    for spike in [1, -1]:
+        altitude, temperature, pressure = clean_profile()
+        temperature[60] += spike*(QC_DIC['spike_threshold'] + 1.)
+        check(altitude, temperature, pressure, ['temperature_spikes'], [60])
+
+    altitude, temperature, pressure = clean_profile()
+    temperature[60:] += QC_DIC['spike_threshold'] + 1.
+    check(altitude, temperature, pressure, [])
+
+
+def test_superadiabatic_layer():
+    """
+    Tests that a fall in potential temperature is flagged above the boundary layer but not
+    within it, and that its levels are kept
+    """
+    altitude, temperature, pressure = clean_profile()
+    temperature[20:30] += 2*QC_DIC['superadiabatic_drop']
+    check(altitude, temperature, pressure, ['superadiabatic_layer'])
+
+    altitude, temperature, pressure = clean_profile()
+    temperature[:5] += 2*QC_DIC['superadiabatic_drop']
+    check(altitude, temperature, pressure, [])
+
+
+def test_low_profile_top():
+    """
+    Tests that profiles not reaching the minimum top, also once missing levels are dropped,
+    are flagged and rejected
+    """
+    altitude, temperature, pressure = clean_profile()
+    below = altitude < QC_DIC['min_top']
+    check(altitude[below], temperature[below], pressure[below], ['low_profile_top'], rejected = True)
+
+    altitude, temperature, pressure = clean_profile()
+    temperature[~below] = np.nan
+    check(altitude, temperature, pressure, ['missing_levels', 'long_missing_run', 'low_profile_top'],
+          np.nonzero(~below)[0], rejected = True)
+
+
+def test_too_few_levels():
+    """
+    Tests that profiles with fewer levels than needed, also once bad levels are dropped, are
+    flagged and rejected
+    """
+    altitude = np.array([7000., 8000.])
+    check(altitude, 288.15 - 0.0065*altitude, 101325.*np.exp(-altitude/8000.), ['too_few_levels'],
+          rejected = True)
+
+    altitude = np.array([7000., 8000., 8000.])
+    check(altitude, 288.15 - 0.0065*altitude, 101325.*np.exp(-altitude/8000.),
+          ['duplicate_levels', 'too_few_levels'], [2], rejected = True)
+
+    empty = np.array([])
+    check(empty, empty, empty, ['low_profile_top', 'too_few_levels'], rejected = True)
@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import ragged
+
+
+def padded_cubelist(seed = 0):
+    """
+    CubeList of 2D (time x altitude) cubes, each row valid only over part of the altitudes
+    with nan padding either side and some missing values within, and of one 1D cube
+    """
+    rng = np.random.RandomState(seed)
+    n_times, n_levels = 6, 40
+    time = iris.coords.DimCoord(np.arange(n_times)*12., standard_name = 'time',
+                                units = 'hours since 1970-01-01 00:00:00')
+    altitude = iris.coords.DimCoord(np.linspace(-5000., 5000., n_levels), long_name = 'altitude', units = 'm')
+
+    starts = rng.randint(0, 10, n_times)
+    ends = n_levels - rng.randint(0, 10, n_times)
+    ends[2] = starts[2]
+    # one ascent with no values at all
+    columns = np.arange(n_levels)
+    padding = (columns < starts[:, np.newaxis]) | (columns >= ends[:, np.newaxis])
+
+    cubelist = iris.cube.CubeList()
+    for name, units in [('air_temperature', 'K'), ('specific_humidity', 'kg kg-1')]:
+        data = rng.uniform(200., 300., (n_times, n_levels))
+        data[padding] = np.nan
+        data[rng.uniform(size = data.shape) < 0.05] = np.nan
+        cubelist.append(iris.cube.Cube(data, standard_name = name, units = units,
+                                       dim_coords_and_dims = [(time, 0), (altitude, 1)]))
+    cubelist.append(iris.cube.Cube(rng.uniform(8000., 12000., n_times), long_name = 'tropopause_altitude',
+                                   units = 'm', dim_coords_and_dims = [(time, 0)]))
+    return cubelist
+
+
+def test_ragged_round_trip():
+    """
+    Tests that the arrays of a CubeList saved with save_cubelist and read with load are the
+    same as the padded 2D arrays saved
+    """
+    cubelist = padded_cubelist()
+    folder = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(folder, 'sonde_2D_trop_relative.npz')
+        ragged.save_cubelist(cubelist, filename)
+        contents = ragged.load(filename)
+    finally:
+        shutil.rmtree(folder)
+
+    assert np.array_equal(contents['time'], cubelist[0].coord('time').points), "times are not the same"
+    assert np.array_equal(contents['altitude_levels'], cubelist[0].coord('altitude').points), \
+           "altitude levels are not the same"
+
+    for cube in cubelist:
+        name = cube.name()
+        assert contents['metadata'][name]['units'] == str(cube.units), "units of " + name + " are not the same"
+        if cube.ndim == 2:
+            dense = ragged.to_dense(contents[name])
+            assert dense.shape == cube.shape, "shape of " + name + " is not the same"
+            assert np.allclose(dense, cube.data, equal_nan = True), name + " is not the same after loading"
+            assert np.allclose(ragged.to_dense(contents[name], [1, 2]), cube.data[[1, 2]], equal_nan = True), \
+                   "rows of " + name + " are not the same after loading"
+        else:
+            assert np.allclose(contents[name], cube.data), name + " is not the same after loading"
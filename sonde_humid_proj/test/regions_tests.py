@@ -0,0 +1,53 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the Sophie_code folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Sophie_code'))
+
+from write_all_regions import find_tropopause
+from batch_regions import find_tropopause_array
+
+
+def regions_profile(height, trop_height, noise = 0., seed = 0):
+    """
+    Temperature profile with a lapse rate of 6.5 K/km up to the tropopause and isothermal above
+    :param height: array of heights, km
+    :param trop_height: height of the tropopause, km
+    :param noise: standard deviation of random noise added to the temperature, K
+    :param seed: integer, seed for random numbers
+    :return: array of temperatures, K
+    """
+    temperature = 288. - 6.5*np.minimum(height, trop_height)
+    return temperature + np.random.RandomState(seed).normal(0., noise, len(height))
+
+
+def test_find_tropopause_array():
+    """
+    Tests that the array version of find_tropopause finds the same level as the original, for
+    profiles with a tropopause, without one, and with no values at all
+    """
+    height = np.arange(0., 20., 0.1)
+    irregular = np.sort(np.random.RandomState(1).uniform(0.02, 20., 300))
+
+    profiles = {'tropopause': (height, regions_profile(height, 11.)),
+                'noisy tropopause': (irregular, regions_profile(irregular, 9., noise = 0.5, seed = 2)),
+                'no tropopause': (height, 288. - 6.5*height),
+                'all nan': (height, np.zeros_like(height) + np.nan)}
+
+    for key in profiles:
+        height, temperature = profiles[key]
+        assert find_tropopause_array(temperature, height) == find_tropopause(temperature, height), \
+               "find_tropopause_array differs from find_tropopause for the profile with " + key
+
+    for key, found in [('tropopause', True), ('noisy tropopause', True), ('no tropopause', False),
+                       ('all nan', False)]:
+        height, temperature = profiles[key]
+        assert (find_tropopause_array(temperature, height) > 0) == found, \
+               "tropopause found, or not found, wrongly in the profile with " + key
+
+    height, temperature = profiles['tropopause']
+    no_height = np.zeros_like(height) + np.nan
+    assert find_tropopause_array(temperature, no_height) == find_tropopause(temperature, no_height), \
+           "find_tropopause_array differs from find_tropopause for a profile with no heights"
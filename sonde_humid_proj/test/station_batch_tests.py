@@ -0,0 +1,107 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import iris
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import synthetic_data
+from concatenate import concatenate_cubelist_dictionary
+from my_filters import gaussian_kernel_smooth
+from re_grid import PRODUCTS
+from station_batch import batch_station
+
+ENVIRONMENT = ['NAWDEX_DATA_ROOT', 'NAWDEX_FILE_LISTS', 'NAWDEX_OUTPUT_ROOT']
+
+
+def loop_gaussian_kernel_smooth(T, Z, d, whw):
+    """
+    gaussian_kernel_smooth as it was before it was vectorised, looping over every point
+    """
+    lent = len(T)
+
+    T_smooth = np.zeros_like(T)
+
+    for j in range(lent):
+
+        n = min(whw, j, lent-j-1)
+        # maximum of whw points either side of point, window half width
+
+        top = 0
+        bottom = 0
+
+        for i in range(j-n, j+n+1):
+
+            weight = np.exp((-(Z[j]-Z[i])**2)/(2*d**2))
+
+            bottom += weight
+            top += weight*T[i]
+
+        T_smooth[j] = top/bottom
+
+    return T_smooth
+
+
+def test_gaussian_kernel_smooth():
+    """
+    Tests that gaussian_kernel_smooth is the same as the loop over points, on an irregular
+    altitude grid with missing values of both the data and the altitude
+    """
+    rng = np.random.RandomState(0)
+    Z = np.cumsum(rng.uniform(1., 40., 300))
+    T = 290. - 0.0065*Z + rng.normal(0., 0.5, len(Z))
+    T[[0, 57, 58, 200]] = np.nan
+    Z[[120, 299]] = np.nan
+
+    for d, whw in [(50, 200), (20, 5), (100, 0)]:
+        assert np.allclose(gaussian_kernel_smooth(T, Z, d, whw), loop_gaussian_kernel_smooth(T, Z, d, whw),
+                           equal_nan = True), \
+               "gaussian_kernel_smooth differs from the loop over points for " + str((d, whw))
+
+
+def test_batch_station():
+    """
+    Tests that station-batch mode saves the same 2D fields as concatenate_cubelist_dictionary,
+    for a small synthetic station
+    """
+    folder = tempfile.mkdtemp()
+    environment = dict((name, os.environ.get(name)) for name in ENVIRONMENT)
+    try:
+        os.environ['NAWDEX_DATA_ROOT'] = os.path.join(folder, 'data')
+        os.environ['NAWDEX_FILE_LISTS'] = os.path.join(folder, 'data', 'File_lists')
+        source, station_number = synthetic_data.generate_dataset(os.environ['NAWDEX_DATA_ROOT'],
+                                                                 n_stations = 1, n_ascents = 3,
+                                                                 sonde_spacing = 50.)[0]
+
+        os.environ['NAWDEX_OUTPUT_ROOT'] = os.path.join(folder, 'ascent')
+        concatenate_cubelist_dictionary(source, station_number)
+        os.environ['NAWDEX_OUTPUT_ROOT'] = os.path.join(folder, 'batch')
+        batch_station(source, station_number)
+
+        for key, dtype, lead_time in PRODUCTS:
+            filename = os.path.join(source + '_' + station_number, key + '_2D_trop_relative.nc')
+            ascent = iris.load(os.path.join(folder, 'ascent', filename))
+            batch = iris.load(os.path.join(folder, 'batch', filename))
+
+            assert sorted(cube.name() for cube in ascent) == sorted(cube.name() for cube in batch), \
+                   "station-batch mode does not save the same fields as concatenate for " + key
+
+            for cube in ascent:
+                batch_cube = batch.extract(iris.Constraint(name = cube.name()))[0]
+                assert np.array_equal(cube.coord('time').points, batch_cube.coord('time').points), \
+                       "station-batch mode does not keep the same ascents as concatenate for " + key
+                assert np.allclose(np.ma.filled(np.asanyarray(cube.data, dtype = float), np.nan),
+                                   np.ma.filled(np.asanyarray(batch_cube.data, dtype = float), np.nan),
+                                   equal_nan = True), \
+                       cube.name() + " differs between station-batch mode and concatenate for " + key
+    finally:
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(folder)
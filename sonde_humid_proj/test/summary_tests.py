@@ -0,0 +1,67 @@
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# Add the src folder to the sys.path list, as its modules import each other by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import summary
+import synthetic_data
+from concatenate import concatenate_cubelist_dictionary, create_datetime_list
+from read_files import output_folder
+
+ENVIRONMENT = ['NAWDEX_DATA_ROOT', 'NAWDEX_FILE_LISTS', 'NAWDEX_OUTPUT_ROOT']
+
+
+def test_ascent_release_times():
+    """
+    Tests that each ascent is given the release time whose nearest 6-hourly verification time
+    is the time of the ascent, and nan where there is none
+    """
+    releases = [datetime.datetime(2016, 9, 20, 11, 15), datetime.datetime(2016, 9, 20, 23, 0),
+                datetime.datetime(2016, 9, 22, 2, 59)]
+    day = summary.hours_since_1970(datetime.datetime(2016, 9, 20))
+    times = day + np.array([12., 24., 36., 48.])
+    expected = day + np.array([11.25, 23., np.nan, 50. + 59./60])
+    assert np.allclose(summary.ascent_release_times(times, releases), expected, equal_nan = True), \
+           "release times are not those of the nearest verification times"
+    assert np.isnan(summary.ascent_release_times(times, None)).all(), \
+           "release times are not nan without release datetimes"
+
+
+def test_summary_release_time():
+    """
+    Tests that the table saved with the 2D files of a small synthetic station has the release
+    times of the ascents in the file list
+    """
+    folder = tempfile.mkdtemp()
+    environment = dict((name, os.environ.get(name)) for name in ENVIRONMENT)
+    try:
+        os.environ['NAWDEX_DATA_ROOT'] = os.path.join(folder, 'data')
+        os.environ['NAWDEX_FILE_LISTS'] = os.path.join(folder, 'data', 'File_lists')
+        os.environ['NAWDEX_OUTPUT_ROOT'] = os.path.join(folder, 'output')
+        source, station_number = synthetic_data.generate_dataset(os.environ['NAWDEX_DATA_ROOT'],
+                                                                 n_stations = 1, n_ascents = 3,
+                                                                 sonde_spacing = 50.)[0]
+        concatenate_cubelist_dictionary(source, station_number)
+
+        table = summary.load_summary(os.path.join(output_folder(source, station_number),
+                                                  summary.SUMMARY_FILENAME))
+        releases = [summary.hours_since_1970(time) for time in create_datetime_list(source, station_number)]
+        for key, lead_time in summary.LEAD_TIMES:
+            rows = summary.select(table, product = key)
+            assert np.array_equal(rows['release_time'], releases), \
+                   "release times of " + key + " are not those of the file list"
+            assert np.all(np.abs(rows['release_time'] - rows['time']) <= 3), \
+                   "release times of " + key + " are not near the verification times"
+    finally:
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(folder)